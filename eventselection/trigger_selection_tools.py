@@ -8,21 +8,32 @@
 import awkward as ak
 import numpy as np
 
+# internal helper functions
+
+def stack_fields(record, fields, what='field'):
+    ### internal helper function to stack boolean fields into a 2D numpy array
+    # returns: numpy array of shape (number of events, number of fields)
+    stack = np.empty((len(record), len(fields)), dtype=bool)
+    for i, field in enumerate(fields):
+        # check if field is present in events
+        if field not in record.fields:
+            msg = 'ERROR: {} {} not found.'.format(what, field)
+            raise Exception(msg)
+        stack[:,i] = ak.to_numpy(record[field])
+    return stack
+
 # external functions
 # (meant to be called from outside while doing event selections)
 
 def pass_met_filters(events, filters=None):
     if filters is None: filters = ['METFilters']
-    mask = (events.event >= 0)
-    for f in filters:
-        # check if filter is present in events
-        if f not in events.Flag.fields:
-            msg = 'ERROR: filter {} not found.'.format(f)
-            raise Exception(msg)
-        mask = (mask & events.Flag[f])
-    return mask
+    mask = np.all(stack_fields(events.Flag, filters, what='filter'), axis=1)
+    return ak.Array(mask)
 
 def pass_any_lepton_trigger(events, triggers=None):
+    # note: the combined triggers are expected to be added to events.HLT
+    #       beforehand (see preprocessing/triggervariables.py),
+    #       so that they are evaluated only once per set of events.
     if triggers is None:
         triggers = [
           'trigger_e',
@@ -36,11 +47,5 @@ def pass_any_lepton_trigger(events, triggers=None):
           'trigger_emm',
           'trigger_emm'
         ]
-    mask = (events.event < 0)
-    for trigger in triggers:
-        # check if trigger is present in events
-        if trigger not in events.HLT.fields:
-            msg = 'ERROR: trigger {} not found.'.format(trigger)
-            raise Exception(msg)
-        mask = (mask | events.HLT[trigger])
-    return mask
+    mask = np.any(stack_fields(events.HLT, triggers, what='trigger'), axis=1)
+    return ak.Array(mask)
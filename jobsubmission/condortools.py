@@ -11,6 +11,10 @@
 
 import os
 import sys
+import re
+import subprocess
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import jobtracker
 
 def makeUnique(fname):
     ### make a file name unique by appending a number to it,
@@ -104,14 +108,46 @@ def makeJobDescription(name, exe, argstring=None,
         f.write('queue\n\n')
     print('makeJobDescription created {}'.format(fname))
 
+def getJobLogs(jobDescription, clusterid):
+    ### get the user log file of each job in a job description file
+    # returns: a list of log file names (one per queued job, ordered by process id)
+    logtemplate = None
+    nqueue = 0
+    with open(jobDescription, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('log'): logtemplate = line.split('=',1)[1].strip()
+            if line.startswith('queue'): nqueue += 1
+    if logtemplate is None: return []
+    logs = []
+    for procid in range(nqueue):
+        log = logtemplate.replace('$(ClusterId)', str(clusterid))
+        log = log.replace('$(Cluster)', str(clusterid))
+        log = log.replace('$(ProcId)', str(procid))
+        log = log.replace('$(Process)', str(procid))
+        logs.append(log)
+    return logs
+
 def submitCondorJob(jobDescription):
     ### submit a job description file as a condor job
+    # returns: the cluster id of the submitted jobs (or None if it could not be determined)
+    # note: the submitted jobs are added to the job registry (if any),
+    #       so that they can be tracked through their log files, see jobtracker.py
     fname = os.path.splitext(jobDescription)[0]+'.txt'
     if not os.path.exists(fname):
         print('ERROR: job description file {} not found'.format(fname))
         sys.exit()
     # maybe later extend this part to account for failed submissions etc!
-    os.system('condor_submit {}'.format(fname))
+    cmdres = subprocess.run(['condor_submit', fname], stdout=subprocess.PIPE)
+    cmdout = cmdres.stdout.decode('utf-8')
+    print(cmdout, end='')
+    sys.stdout.flush()
+    match = re.search(r'submitted to cluster (\d+)', cmdout)
+    if match is None: return None
+    clusterid = int(match.group(1))
+    for procid, log in enumerate(getJobLogs(fname, clusterid)):
+        jobtracker.registerJob('condor', clusterid, procid, log)
+    return clusterid
 
 def submitCommandAsCondorJob(name, command, stdout=None, stderr=None, log=None,
                         cpus=1, mem=1024, disk=10240,
@@ -121,12 +157,13 @@ def submitCommandAsCondorJob(name, command, stdout=None, stderr=None, log=None,
                         jobflavour=None):
     ### submit a single command as a single job
     # command is a string representing a single command (executable + args)
-    submitCommandsAsCondorJobs(name, [[command]], stdout=stdout, stderr=stderr, log=log,
+    # returns: the cluster id of the submitted job
+    return submitCommandsAsCondorJobs(name, [[command]], stdout=stdout, stderr=stderr, log=log,
             cpus=cpus, mem=mem, disk=disk,
             home=home,
             proxy=proxy,
             cmssw_version=cmssw_version,
-            jobflavour=jobflavour)
+            jobflavour=jobflavour)[0]
 
 def submitCommandsAsCondorCluster(name, commands, stdout=None, stderr=None, log=None,
                         cpus=1, mem=1024, disk=10240,
@@ -137,6 +174,7 @@ def submitCommandsAsCondorCluster(name, commands, stdout=None, stderr=None, log=
     ### run several similar commands within a single cluster of jobs
     # note: each command must have the same executable and number of args, only args can differ!
     # note: commands can be a list of commands (-> a job will be submitted for each command)
+    # returns: the cluster id of the submitted jobs
     
     # parse arguments
     name = os.path.splitext(name)[0]
@@ -166,7 +204,7 @@ def submitCommandsAsCondorCluster(name, commands, stdout=None, stderr=None, log=
             script.write('arguments = "{}"\n'.format(thisargstring))
             script.write('queue\n\n')
     # finally submit the job
-    submitCondorJob(jdname)
+    return submitCondorJob(jdname)
 
 def submitCommandsAsCondorJob(name, commands, stdout=None, stderr=None, log=None,
                         cpus=1, mem=1024, disk=10240, 
@@ -177,12 +215,13 @@ def submitCommandsAsCondorJob(name, commands, stdout=None, stderr=None, log=None
     ### submit a set of commands as a single job
     # commands is a list of strings, each string represents a single command (executable + args)
     # the commands can be anything and are not necessarily same executable or same number of args.
-    submitCommandsAsCondorJobs(name, [commands], stdout=stdout, stderr=stderr, log=log,
+    # returns: the cluster id of the submitted job
+    return submitCommandsAsCondorJobs(name, [commands], stdout=stdout, stderr=stderr, log=log,
                         cpus=cpus, mem=mem, disk=disk, 
                         home=home,
                         proxy=proxy,
                         cmssw_version=cmssw_version,
-                        jobflavour=jobflavour)
+                        jobflavour=jobflavour)[0]
 
 def submitCommandsAsCondorJobs(name, commands, stdout=None, stderr=None, log=None,
             cpus=1, mem=1024, disk=10240,
@@ -193,6 +232,8 @@ def submitCommandsAsCondorJobs(name, commands, stdout=None, stderr=None, log=Non
     ### submit multiple sets of commands as jobs (one job per set)
     # commands is a list of lists of strings, each string represents a single command
     # the commands can be anything and are not necessarily same executable or number of args.
+    # returns: a list of cluster ids (one per set of commands)
+    clusterids = []
     for commandset in commands:
         # parse arguments
         name = os.path.splitext(name)[0]
@@ -207,4 +248,5 @@ def submitCommandsAsCondorJobs(name, commands, stdout=None, stderr=None, log=Non
                             cpus=cpus,mem=mem,disk=disk,proxy=proxy,
                             jobflavour=jobflavour)
         # finally submit the job
-        submitCondorJob(jdname)
+        clusterids.append(submitCondorJob(jdname))
+    return clusterids
@@ -0,0 +1,304 @@
+####################################################
+# Event-driven tracking of submitted (condor) jobs #
+####################################################
+
+# general use:
+# instead of polling condor_q for all jobs of the user,
+# the jobs submitted in a given step are recorded in a registry file,
+# and their status is followed by reading the condor user log files
+# (the '<name>_log_<clusterid>_<procid>' files written by the job description,
+# see condortools.makeJobDescription).
+# the log files are read incrementally (only new events are parsed on each update),
+# so waiting for a step to finish does not require any calls to condor.
+# the registry file is set through an environment variable,
+# so that jobs submitted from subprocesses (e.g. the *_loop.py scripts)
+# are registered as well, see condortools.submitCondorJob.
+# the local job runner (see localtools.py) writes the same log format,
+# so local jobs can be tracked in exactly the same way.
+# example usage:
+#   with JobRegistry('jobs.txt'):
+#       os.system('python3 eventloop_loop.py')
+#   JobTracker.fromRegistry('jobs.txt').wait()
+# note: held jobs are not finished, but condor holds jobs for routine failures
+#       (e.g. exceeding the requested memory), after which they might never be released;
+#       therefore jobs that stay held for longer than a grace period
+#       are considered as failed (see JobTracker).
+
+import os
+import re
+import sys
+import json
+import time
+
+
+# environment variable holding the path to the registry file
+REGISTRY_ENV = 'JOBTRACKER_REGISTRY'
+
+# condor user log event codes
+# (see the htcondor documentation on job event log codes)
+EVENT_SUBMIT = 0
+EVENT_EXECUTE = 1
+EVENT_EVICTED = 4
+EVENT_TERMINATED = 5
+EVENT_ABORTED = 9
+EVENT_HELD = 12
+EVENT_RELEASED = 13
+EVENT_NAMES = {
+    EVENT_SUBMIT: 'Job submitted from host: {}',
+    EVENT_EXECUTE: 'Job executing on host: {}',
+    EVENT_EVICTED: 'Job was evicted.',
+    EVENT_TERMINATED: 'Job terminated.',
+    EVENT_ABORTED: 'Job was aborted.',
+    EVENT_HELD: 'Job was held.',
+    EVENT_RELEASED: 'Job was released.'
+}
+
+# regular expressions for parsing the log files
+EVENT_HEADER = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.(\d+)\)')
+RETURN_VALUE = re.compile(r'\(return value (-?\d+)\)')
+SIGNAL_VALUE = re.compile(r'\(signal (\d+)\)')
+
+# job statuses
+STATUS_IDLE = 'idle'
+STATUS_RUNNING = 'running'
+STATUS_HELD = 'held'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_ABORTED = 'aborted'
+STATUS_HELD_TIMEOUT = 'held (timeout)'
+FINAL_STATUSES = [STATUS_DONE, STATUS_FAILED, STATUS_ABORTED, STATUS_HELD_TIMEOUT]
+FAILED_STATUSES = [STATUS_FAILED, STATUS_ABORTED, STATUS_HELD_TIMEOUT]
+
+# default time in seconds after which held jobs are considered as failed
+DEFAULT_HELD_TIMEOUT = 3600
+
+
+### functionality for writing and parsing log files
+
+def formatUserLogEvent(code, clusterid, procid, lines=None):
+    ### format a single event in the condor user log format
+    # input arguments:
+    # - code: event code (see EVENT_* above)
+    # - clusterid, procid: job identifiers
+    # - lines: list of additional lines describing the event
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    header = '{:03d} ({:03d}.{:03d}.000) {} '.format(code, clusterid, procid, timestamp)
+    header += EVENT_NAMES.get(code, '').format(os.uname()[1])
+    text = header + '\n'
+    if lines is not None:
+        for line in lines: text += '\t{}\n'.format(line)
+    text += '...\n'
+    return text
+
+def writeUserLogEvent(log, code, clusterid, procid, returnvalue=None):
+    ### append a single event to a log file in the condor user log format
+    # note: for termination events, the return value must be provided.
+    lines = None
+    if code==EVENT_TERMINATED:
+        lines = ['(1) Normal termination (return value {})'.format(returnvalue)]
+    with open(log, 'a') as f:
+        f.write(formatUserLogEvent(code, clusterid, procid, lines=lines))
+
+def parseUserLogEvents(text):
+    ### parse condor user log events from a piece of text
+    # returns a list of dicts with keys 'code', 'clusterid', 'procid' and 'returnvalue'
+    # (the latter is None for non-termination events and for abnormal terminations,
+    # in which case the signal is stored under 'signal').
+    events = []
+    for block in text.split('...\n'):
+        lines = block.strip('\n').split('\n')
+        match = EVENT_HEADER.match(lines[0])
+        if match is None: continue
+        event = ({
+          'code': int(match.group(1)),
+          'clusterid': int(match.group(2)),
+          'procid': int(match.group(3)),
+          'returnvalue': None,
+          'signal': None
+        })
+        if event['code']==EVENT_TERMINATED:
+            body = '\n'.join(lines[1:])
+            retmatch = RETURN_VALUE.search(body)
+            if retmatch is not None: event['returnvalue'] = int(retmatch.group(1))
+            sigmatch = SIGNAL_VALUE.search(body)
+            if sigmatch is not None: event['signal'] = int(sigmatch.group(1))
+        events.append(event)
+    return events
+
+
+### functionality for registering submitted jobs
+
+def registerJob(backend, clusterid, procid, log, registry=None):
+    ### add a job to the registry file
+    # input arguments:
+    # - backend: name of the backend that runs the job (e.g. 'condor' or 'local')
+    # - clusterid, procid: job identifiers
+    # - log: path to the user log file of the job
+    # - registry: path to the registry file
+    #   (default: read from the environment; nothing is done if not set)
+    if registry is None: registry = os.environ.get(REGISTRY_ENV, None)
+    if registry is None: return
+    job = ({
+      'backend': backend,
+      'clusterid': int(clusterid),
+      'procid': int(procid),
+      'log': os.path.abspath(log)
+    })
+    with open(registry, 'a') as f:
+        f.write(json.dumps(job)+'\n')
+
+def readRegistry(registry):
+    ### read all jobs from a registry file
+    if not os.path.exists(registry): return []
+    with open(registry, 'r') as f:
+        jobs = [json.loads(line) for line in f if len(line.strip())>0]
+    return jobs
+
+
+class JobRegistry(object):
+    ### context manager that registers all jobs submitted within its scope
+    # jobs are registered in the given file
+    # (also when submitted from subprocesses, through the environment variable).
+    # note: the registry file is emptied when entering the scope.
+
+    def __init__(self, registry):
+        self.registry = os.path.abspath(registry)
+        self.previous = None
+
+    def __enter__(self):
+        if os.path.exists(self.registry): os.remove(self.registry)
+        self.previous = os.environ.get(REGISTRY_ENV, None)
+        os.environ[REGISTRY_ENV] = self.registry
+        return self
+
+    def __exit__(self, *args):
+        if self.previous is None: os.environ.pop(REGISTRY_ENV, None)
+        else: os.environ[REGISTRY_ENV] = self.previous
+
+    def jobs(self):
+        return readRegistry(self.registry)
+
+
+### functionality for tracking jobs
+
+class JobTracker(object):
+    ### follow the status of a set of jobs through their user log files
+
+    def __init__(self, jobs, heldtimeout=DEFAULT_HELD_TIMEOUT):
+        ### initializer
+        # input arguments:
+        # - jobs: list of dicts with keys 'clusterid', 'procid' and 'log'
+        #   (e.g. as read from a registry file)
+        # - heldtimeout: time in seconds after which held jobs are considered as failed
+        #   (counted from the moment the hold is seen by the tracker; None for no limit)
+        self.heldtimeout = heldtimeout
+        self.jobs = {}
+        for job in jobs:
+            key = (int(job['clusterid']), int(job['procid']))
+            self.jobs[key] = ({
+              'log': job['log'],
+              'backend': job.get('backend', 'condor'),
+              'status': STATUS_IDLE,
+              'returnvalue': None,
+              'heldsince': None
+            })
+        # keep track of how far each log file has been read
+        self.offsets = {job['log']: 0 for job in self.jobs.values()}
+
+    @classmethod
+    def fromRegistry(cls, registry, heldtimeout=DEFAULT_HELD_TIMEOUT):
+        return cls(readRegistry(registry), heldtimeout=heldtimeout)
+
+    def update(self):
+        ### read new events from all log files and update the job statuses
+        for log in self.offsets.keys():
+            if not os.path.exists(log): continue
+            with open(log, 'r') as f:
+                f.seek(self.offsets[log])
+                text = f.read()
+            # only parse complete events, the rest is read again on the next update
+            end = text.rfind('...\n')
+            if end < 0: continue
+            end += len('...\n')
+            self.offsets[log] += len(text[:end].encode('utf-8'))
+            for event in parseUserLogEvents(text[:end]):
+                self.processEvent(event)
+        # consider jobs that are held for too long as failed
+        if self.heldtimeout is None: return
+        for job in self.jobs.values():
+            if( job['status']==STATUS_HELD
+                and time.time()-job['heldsince'] > self.heldtimeout ):
+                job['status'] = STATUS_HELD_TIMEOUT
+
+    def processEvent(self, event):
+        ### update the status of a job given a single log event
+        key = (event['clusterid'], event['procid'])
+        if key not in self.jobs: return
+        job = self.jobs[key]
+        code = event['code']
+        if code==EVENT_HELD:
+            if job['heldsince'] is None: job['heldsince'] = time.time()
+        else: job['heldsince'] = None
+        if code==EVENT_EXECUTE: job['status'] = STATUS_RUNNING
+        elif code in [EVENT_EVICTED, EVENT_RELEASED]: job['status'] = STATUS_IDLE
+        elif code==EVENT_HELD: job['status'] = STATUS_HELD
+        elif code==EVENT_ABORTED: job['status'] = STATUS_ABORTED
+        elif code==EVENT_TERMINATED:
+            job['returnvalue'] = event['returnvalue']
+            if event['returnvalue']==0: job['status'] = STATUS_DONE
+            else: job['status'] = STATUS_FAILED
+
+    def counts(self):
+        ### get the number of jobs per status
+        counts = {}
+        for job in self.jobs.values():
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
+
+    def isDone(self):
+        ### check whether all jobs have finished (successfully or not)
+        return all([job['status'] in FINAL_STATUSES for job in self.jobs.values()])
+
+    def failedJobs(self):
+        ### get the identifiers of all jobs that did not finish successfully
+        # (including jobs that were held for longer than the grace period)
+        return sorted([key for key, job in self.jobs.items()
+                       if job['status'] in FAILED_STATUSES])
+
+    def heldJobs(self):
+        ### get the identifiers of all jobs that are held
+        # (including jobs that were held for longer than the grace period)
+        return sorted([key for key, job in self.jobs.items()
+                       if job['status'] in [STATUS_HELD, STATUS_HELD_TIMEOUT]])
+
+    def wait(self, interval=5, timeout=None, verbose=False):
+        ### wait until all jobs have finished
+        # input arguments:
+        # - interval: time in seconds between reading the log files
+        #   (reading only new events is cheap, so this can be short)
+        # - timeout: maximum time to wait in seconds (default: no limit)
+        # - verbose: print a status summary whenever it changes
+        # returns: True if all jobs finished, False in case of a timeout
+        # note: jobs that are held for longer than the grace period of the tracker
+        #       are considered as finished (and failed), and are always reported.
+        start_time = time.time()
+        previous = None
+        reported = set()
+        while True:
+            self.update()
+            counts = self.counts()
+            if( verbose and counts!=previous ):
+                msg = ', '.join(['{} {}'.format(n, status) for status, n in sorted(counts.items())])
+                print('JobTracker: {} jobs ({})'.format(len(self.jobs), msg))
+                sys.stdout.flush()
+                previous = counts
+            for key in self.heldJobs():
+                if( key in reported or self.jobs[key]['status']!=STATUS_HELD_TIMEOUT ): continue
+                print('JobTracker: WARNING: job {}.{} is held for more than {} seconds,'.format(
+                  key[0], key[1], self.heldtimeout)
+                  + ' considering it as failed (see {}).'.format(self.jobs[key]['log']))
+                sys.stdout.flush()
+                reported.add(key)
+            if self.isDone(): return True
+            if( timeout is not None and time.time()-start_time > timeout ): return False
+            time.sleep(interval)
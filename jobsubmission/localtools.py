@@ -0,0 +1,124 @@
+###################################################################
+# functionality for running jobs in parallel on the local machine #
+###################################################################
+
+# general use:
+# local alternative to the condor submission tools in condortools.py,
+# e.g. for running on an interactive node with many cores.
+# each job is executed in a separate bash process,
+# with at most a given number of jobs running at the same time.
+# the stdout and stderr of each job are written to files with the same naming
+# as for condor jobs (<name>_out_<clusterid>_<procid> and <name>_err_<clusterid>_<procid>),
+# so that jobcheck.py can be used in the same way to check the jobs afterwards.
+# in addition, a <name>_log_<clusterid>_<procid> file keeps track of the attempts
+# and exit codes of each job, in the same format as condor user log files,
+# so that the jobs can be followed with jobtracker.py as well.
+# optionally, the memory of each job can be capped (the job fails when exceeding it),
+# and failed jobs (non-zero exit code) can be retried.
+
+import os
+import sys
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import jobtracker
+
+
+def getClusterId(name):
+    ### get a cluster id for which no output files exist yet
+    # (the process id of the current process, incremented if needed)
+    clusterid = os.getpid()
+    while os.path.exists('{}_err_{}_0'.format(name, clusterid)): clusterid += 1
+    return clusterid
+
+def makeMemoryLimitCommand(mem):
+    ### make a shell command that limits the memory of the job it is prepended to
+    # input arguments:
+    # - mem: maximum memory in MB (or None for no limit)
+    # note: the limit is set on the address space (virtual memory) of the job,
+    #       which is usually somewhat larger than the resident memory.
+    # note: the limit is set by the shell itself rather than in a preexec_fn,
+    #       since the jobs are started from multiple threads,
+    #       where running python code between fork and exec is not safe.
+    if mem is None: return None
+    return 'ulimit -v {}'.format(int(mem)*1024)
+
+def runLocalJob(script, stdout, stderr, log, clusterid=0, procid=0, mem=None, retries=0):
+    ### run a single job locally and return its exit code
+    # input arguments:
+    # - script: string holding the commands to execute (newline-separated)
+    # - stdout, stderr, log: names of output, error and log files
+    # - clusterid, procid: job identifiers (used in the log file)
+    # - mem: maximum memory in MB (or None for no limit)
+    # - retries: number of times to retry the job if it fails
+    # note: the stdout and stderr files are overwritten for each attempt,
+    #       so they only contain the output of the last attempt
+    #       (as expected by the starting and done tag check in jobcheck.py).
+    # note: failed attempts that are retried are written to the log as evictions,
+    #       only the last attempt is written as a termination.
+    limit = makeMemoryLimitCommand(mem)
+    if limit is not None: script = limit + '\n' + script
+    returncode = None
+    for attempt in range(retries+1):
+        jobtracker.writeUserLogEvent(log, jobtracker.EVENT_EXECUTE, clusterid, procid)
+        with open(stdout, 'w') as fout, open(stderr, 'w') as ferr:
+            returncode = subprocess.run(['bash', '-c', script],
+                           stdout=fout, stderr=ferr).returncode
+        if( returncode==0 or attempt==retries ): break
+        jobtracker.writeUserLogEvent(log, jobtracker.EVENT_EVICTED, clusterid, procid)
+    jobtracker.writeUserLogEvent(log, jobtracker.EVENT_TERMINATED, clusterid, procid,
+      returnvalue=returncode)
+    return returncode
+
+def runCommandSetsLocally(name, commands, nworkers=None, mem=None, retries=0):
+    ### run multiple sets of commands as local jobs (one job per set)
+    # input arguments:
+    # - name: base name for the output, error and log files
+    # - commands: list of lists of strings, each string represents a single command;
+    #   the commands within a set are executed sequentially in the same shell.
+    # - nworkers: maximum number of jobs to run simultaneously (default: number of cores)
+    # - mem: maximum memory per job in MB (default: no limit)
+    # - retries: number of times to retry failed jobs
+    # returns: a list of exit codes (one per job)
+    name = os.path.splitext(name)[0]
+    if nworkers is None: nworkers = os.cpu_count()
+    nworkers = max(1, min(nworkers, len(commands)))
+    clusterid = getClusterId(name)
+    cwd = os.path.abspath(os.getcwd())
+    print('runCommandSetsLocally: running {} jobs with {} workers'.format(
+      len(commands), nworkers))
+    sys.stdout.flush()
+    # register the jobs
+    logs = []
+    for procid in range(len(commands)):
+        log = os.path.join(cwd, '{}_log_{}_{}'.format(name, clusterid, procid))
+        if os.path.exists(log): os.remove(log)
+        jobtracker.writeUserLogEvent(log, jobtracker.EVENT_SUBMIT, clusterid, procid)
+        jobtracker.registerJob('local', clusterid, procid, log)
+        logs.append(log)
+    # run the jobs
+    futures = []
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        for procid, commandset in enumerate(commands):
+            script = 'cd {}\n'.format(cwd) + '\n'.join(commandset) + '\n'
+            stdout = os.path.join(cwd, '{}_out_{}_{}'.format(name, clusterid, procid))
+            stderr = os.path.join(cwd, '{}_err_{}_{}'.format(name, clusterid, procid))
+            futures.append(executor.submit(runLocalJob, script, stdout, stderr, logs[procid],
+                             clusterid=clusterid, procid=procid, mem=mem, retries=retries))
+    returncodes = [future.result() for future in futures]
+    # print summary
+    nfailed = sum([1 for returncode in returncodes if returncode!=0])
+    print('runCommandSetsLocally: {} jobs finished, {} failed'.format(
+      len(returncodes), nfailed))
+    for procid, returncode in enumerate(returncodes):
+        if returncode==0: continue
+        print('  - job {} (exit code {}), see {}_err_{}_{}'.format(
+          procid, returncode, name, clusterid, procid))
+    return returncodes
+
+def runCommandsLocally(name, commands, nworkers=None, mem=None, retries=0):
+    ### run several commands as local jobs (one job per command)
+    # input arguments: see runCommandSetsLocally,
+    # except that commands is a list of strings (each string represents a single command).
+    return runCommandSetsLocally(name, [[command] for command in commands],
+             nworkers=nworkers, mem=mem, retries=retries)
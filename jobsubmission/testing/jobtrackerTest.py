@@ -0,0 +1,115 @@
+#######################################
+# A tester for the job tracking tools #
+#######################################
+# How to use?
+#   Simply run "python jobtrackerTest.py" without arguments.
+#   No condor is needed: the jobs are run with the local job runner (see localtools.py),
+#   which writes log files in the same format as condor.
+#   The test runs a few short jobs (one of which fails) in a background thread,
+#   follows them with the job tracker, and checks the final statuses.
+#   In addition, a log file with the exact format written by condor is parsed,
+#   and a held job is checked to be considered as failed after the grace period.
+
+import sys
+import os
+import time
+import tempfile
+import threading
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]))
+import jobsubmission.localtools as lt
+import jobsubmission.jobtracker as jt
+
+
+# example of a condor user log file (one job that ran and terminated normally)
+CONDOR_LOG = """000 (4211.000.000) 2023-10-17 12:00:00 Job submitted from host: <10.0.0.1:9618?addrs=10.0.0.1-9618>
+...
+001 (4211.000.000) 2023-10-17 12:01:12 Job executing on host: <10.0.0.2:9618?addrs=10.0.0.2-9618>
+...
+006 (4211.000.000) 2023-10-17 12:06:12 Image size of job updated: 120000
+	117  -  MemoryUsage of job (MB)
+	119328  -  ResidentSetSize of job (KB)
+...
+005 (4211.000.000) 2023-10-17 12:10:55 Job terminated.
+	(1) Normal termination (return value 0)
+		Usr 0 00:07:31, Sys 0 00:00:05  -  Run Remote Usage
+		Usr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage
+	0  -  Run Bytes Sent By Job
+...
+"""
+
+
+def test_condor_log(workdir):
+    ### check parsing of a log file as written by condor
+    log = os.path.join(workdir, 'condor_log_4211_0')
+    # write the log in two parts to check incremental reading
+    with open(log, 'w') as f: f.write(CONDOR_LOG[:CONDOR_LOG.index('005')])
+    tracker = jt.JobTracker([{'clusterid': 4211, 'procid': 0, 'log': log}])
+    tracker.update()
+    if tracker.isDone():
+        raise Exception('ERROR: job is done before termination event.')
+    if tracker.jobs[(4211, 0)]['status']!=jt.STATUS_RUNNING:
+        raise Exception('ERROR: wrong status for running job.')
+    with open(log, 'a') as f: f.write(CONDOR_LOG[CONDOR_LOG.index('005'):])
+    tracker.update()
+    if not tracker.isDone():
+        raise Exception('ERROR: job is not done after termination event.')
+    if len(tracker.failedJobs())>0:
+        raise Exception('ERROR: job is wrongly flagged as failed.')
+    print('  - condor log: OK')
+
+def test_held_job(workdir):
+    ### check that a held job does not block waiting forever
+    log = os.path.join(workdir, 'held_log_4212_0')
+    for code in [jt.EVENT_SUBMIT, jt.EVENT_EXECUTE, jt.EVENT_HELD]:
+        jt.writeUserLogEvent(log, code, 4212, 0)
+    tracker = jt.JobTracker([{'clusterid': 4212, 'procid': 0, 'log': log}], heldtimeout=1)
+    tracker.update()
+    if tracker.isDone():
+        raise Exception('ERROR: held job is done before the grace period.')
+    start_time = time.time()
+    if not tracker.wait(interval=0.2, timeout=10):
+        raise Exception('ERROR: waiting for held job timed out.')
+    duration = time.time() - start_time
+    if( tracker.failedJobs()!=[(4212, 0)] or tracker.heldJobs()!=[(4212, 0)] ):
+        raise Exception('ERROR: held job is not flagged as failed and held.')
+    # a released job is not held anymore
+    jt.writeUserLogEvent(log, jt.EVENT_RELEASED, 4212, 0)
+    tracker.update()
+    if( tracker.isDone() or len(tracker.heldJobs())>0 ):
+        raise Exception('ERROR: released job is still flagged as held.')
+    print('  - held job: OK (waited {:.1f} seconds)'.format(duration))
+
+def test_local_jobs(workdir):
+    ### run local jobs in the background and wait for them with the tracker
+    commands = ['sleep 2; echo job0', 'sleep 4; echo job1', 'sleep 1; exit 3']
+    registry = os.path.join(workdir, 'registry.txt')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    with jt.JobRegistry(registry):
+        thread = threading.Thread(target=lt.runCommandsLocally,
+                   args=('cjob_jobtrackerTest', commands))
+        thread.start()
+        # wait until the jobs are registered
+        while len(jt.readRegistry(registry))<len(commands): time.sleep(0.1)
+    os.chdir(cwd)
+    tracker = jt.JobTracker.fromRegistry(registry)
+    start_time = time.time()
+    tracker.wait(interval=0.5, verbose=True)
+    duration = time.time() - start_time
+    thread.join()
+    failed = tracker.failedJobs()
+    if len(failed)!=1 or failed[0][1]!=2:
+        raise Exception('ERROR: unexpected failed jobs: {}'.format(failed))
+    if tracker.jobs[failed[0]]['returnvalue']!=3:
+        raise Exception('ERROR: wrong return value for failed job.')
+    print('  - local jobs: OK (waited {:.1f} seconds)'.format(duration))
+
+
+if __name__=='__main__':
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print('Testing job tracker:')
+        test_condor_log(workdir)
+        test_held_job(workdir)
+        test_local_jobs(workdir)
@@ -1,25 +1,184 @@
 #####################################################
 # Functions for cleaning objects around one another #
 #####################################################
+# The minimum delta R between each object to clean and the objects to clean from
+# is calculated on flattened columns, by looping over the (padded) positions
+# of the objects to clean from, i.e. without building the cartesian product.
+# If numba is available, a compiled kernel looping over the objects per event
+# is used instead (for float32 inputs, as in NanoAOD).
+# The result is identical to coffea's nearest function
+# (using the same delta R definition as the vector package),
+# see testing/objectselection/cleaning_benchmark.py for a check.
+# Cleaning masks can be cached, keyed on the content of the input collections,
+# so that repeated cleaning of the same objects (e.g. for jet variations
+# that do not change the jet direction) is only done once.
 
 # imports
 import sys
+import threading
+import hashlib
 from pathlib import Path
+from collections import OrderedDict
+import numpy as np
 import awkward as ak
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
-def clean(toclean, cleanfrom, conesize):
+# cache of cleaning masks
+# (maps a hash of the inputs to the flat cleaning mask)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_size = 16
+
+def clear_cache():
+    ### clear the cache of cleaning masks
+    with _cache_lock: _cache.clear()
+
+def get_flat_columns(objects, fields=('eta', 'phi')):
+    ### internal helper function to get the counts and flat columns of a collection
+    counts = ak.to_numpy(ak.num(objects, axis=1))
+    columns = [ak.to_numpy(ak.flatten(objects[field], axis=1)) for field in fields]
+    return (counts, *columns)
+
+def get_cache_key(*arrays, conesize=None):
+    ### internal helper function to hash the inputs of a cleaning
+    h = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        h.update(str(array.dtype).encode())
+        h.update(str(len(array)).encode())
+        h.update(np.ascontiguousarray(array).view(np.uint8))
+    h.update(repr(conesize).encode())
+    return h.digest()
+
+def min_delta_r(counts, eta, phi, cleanfromcounts, cleanfrometa, cleanfromphi,
+                use_numba=None):
+    ### calculate the minimum delta R between objects and other objects in the same event
+    # input arguments:
+    # - counts, eta, phi: number of objects per event and flat eta and phi
+    #   of the objects for which to calculate the minimum delta R
+    # - cleanfromcounts, cleanfrometa, cleanfromphi: same for the other objects
+    # - use_numba: whether to use the compiled kernel
+    #   (default: use it if numba is available and all inputs are float32)
+    # returns:
+    # flat array with the minimum delta R for each object
+    # (nan for objects in events without other objects)
+    # note: the delta R is calculated in the same way as in the vector package
+    #       (used by coffea), and the square root is only taken after the minimum,
+    #       so the result is identical to coffea's nearest function.
+    dtype = np.result_type(eta, phi, cleanfrometa, cleanfromphi)
+    if use_numba is None: use_numba = (numba is not None and dtype==np.float32)
+    if use_numba:
+        if numba is None:
+            raise Exception('ERROR in min_delta_r: numba is not available.')
+        if dtype!=np.float32:
+            msg = 'ERROR in min_delta_r: the numba kernel only supports float32 inputs.'
+            raise Exception(msg)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        cleanfromoffsets = np.concatenate(([0], np.cumsum(cleanfromcounts)))
+        result = np.empty(len(eta), dtype=np.float32)
+        return min_delta_r_kernel(offsets, eta, phi, cleanfromoffsets, cleanfrometa, cleanfromphi,
+                                  np.float32(np.pi), np.float32(2 * np.pi), result)
+    nevents = len(counts)
+    width = int(np.max(cleanfromcounts)) if nevents>0 else 0
+    # pad the objects to clean from to a fixed width per event
+    cleanfromevent = np.repeat(np.arange(nevents), cleanfromcounts)
+    cleanfromstarts = np.cumsum(cleanfromcounts) - cleanfromcounts
+    cleanfromidx = np.arange(len(cleanfrometa)) - cleanfromstarts[cleanfromevent]
+    padded_eta = np.zeros((width, nevents), dtype=dtype)
+    padded_phi = np.zeros((width, nevents), dtype=dtype)
+    padded_eta[cleanfromidx, cleanfromevent] = cleanfrometa
+    padded_phi[cleanfromidx, cleanfromevent] = cleanfromphi
+    # loop over padded positions and keep the minimum squared delta R,
+    # only considering objects in events with an object at that position
+    event = np.repeat(np.arange(nevents), counts)
+    ncleanfrom = cleanfromcounts[event]
+    order = np.argsort(-ncleanfrom, kind='stable')
+    ncleanfrom = ncleanfrom[order]
+    event = event[order]
+    ordered_eta = eta[order].astype(dtype, copy=False)
+    ordered_phi = phi[order].astype(dtype, copy=False)
+    mindr2 = np.full(len(eta), np.inf, dtype=dtype)
+    for idx in range(width):
+        # (objects are sorted by decreasing number of objects to clean from)
+        n = int(np.searchsorted(-ncleanfrom, -idx, side='left'))
+        deta = ordered_eta[:n] - padded_eta[idx][event[:n]]
+        dphi = (ordered_phi[:n] - padded_phi[idx][event[:n]] + np.pi) % (2 * np.pi) - np.pi
+        np.minimum(mindr2[:n], dphi**2 + deta**2, out=mindr2[:n])
+    mindr2[ncleanfrom==0] = np.nan
+    result = np.empty(len(eta), dtype=dtype)
+    result[order] = np.sqrt(mindr2)
+    return result
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def min_delta_r_kernel(offsets, eta, phi, cleanfromoffsets, cleanfrometa, cleanfromphi,
+                           pi, twopi, result):
+        ### calculate the minimum delta R looping over the objects per event (float32 inputs)
+        # note: the modulo is written out explicitly as in numpy,
+        #       to get the same result as (dphi + pi) % (2*pi) - pi in float32.
+        for ievent in range(len(offsets)-1):
+            for i in range(offsets[ievent], offsets[ievent+1]):
+                mindr2 = np.float32(np.inf)
+                found = False
+                for j in range(cleanfromoffsets[ievent], cleanfromoffsets[ievent+1]):
+                    deta = eta[i] - cleanfrometa[j]
+                    dphi = phi[i] - cleanfromphi[j] + pi
+                    # (fast paths for |dphi| < 2*pi, where fmod is exact without division)
+                    if dphi >= 0 and dphi < twopi: mod = dphi
+                    elif dphi >= twopi and dphi < 2*twopi: mod = dphi - twopi
+                    elif dphi < 0 and dphi > -twopi: mod = dphi + twopi
+                    else:
+                        mod = np.fmod(dphi, twopi)
+                        if mod < 0: mod = mod + twopi
+                        elif mod==0: mod = np.float32(0.)
+                    dphi = mod - pi
+                    dr2 = dphi*dphi + deta*deta
+                    if dr2 < mindr2: mindr2 = dr2
+                    found = True
+                result[i] = np.sqrt(mindr2) if found else np.float32(np.nan)
+        return result
+
+def clean(toclean, cleanfrom, conesize, use_cache=None, use_numba=None):
     ### internal helper function
-    # references for use of 'nearest' function:
-    # - https://coffeateam.github.io/coffea/notebooks/nanoevents.html
-    # - https://github.com/CoffeaTeam/coffea/blob/
-    #   58ad8d138905e186e0e0a57239f77026f9a1229e/coffea/nanoevents/methods/vector.py#L706
-    dr = toclean.nearest(cleanfrom, return_metric=True)[1]
+    # note: this used to be done with coffea's nearest function,
+    #       i.e. toclean.nearest(cleanfrom, return_metric=True)[1] > conesize
+    #       (with None for events without objects to clean from filled as True),
+    #       the result is the same but without building the cartesian product.
+    counts, eta, phi = get_flat_columns(toclean)
+    cleanfromcounts, cleanfrometa, cleanfromphi = get_flat_columns(cleanfrom)
+    if len(counts)!=len(cleanfromcounts):
+        msg = 'ERROR in clean: collections have different number of events'
+        msg += ' ({} and {}).'.format(len(counts), len(cleanfromcounts))
+        raise Exception(msg)
+    if use_numba is None:
+        dtype = np.result_type(eta, phi, cleanfrometa, cleanfromphi)
+        use_numba = (numba is not None and dtype==np.float32)
+    # note: by default, the cache is only used with the numpy implementation,
+    #       since hashing the inputs takes about as long as the compiled kernel.
+    if use_cache is None: use_cache = not use_numba
+    key = None
+    if use_cache:
+        key = get_cache_key(counts, eta, phi, cleanfromcounts, cleanfrometa, cleanfromphi,
+                            conesize=conesize)
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return ak.unflatten(_cache[key], counts)
+    dr = min_delta_r(counts, eta, phi, cleanfromcounts, cleanfrometa, cleanfromphi,
+                     use_numba=use_numba)
     mask = (dr > conesize)
-    mask = ak.fill_none(mask, True)
-    return mask
+    mask[np.isnan(dr)] = True
+    if use_cache:
+        with _cache_lock:
+            _cache[key] = mask
+            while len(_cache) > _cache_size: _cache.popitem(last=False)
+    return ak.unflatten(mask, counts)
 
-def clean_electrons_from_muons(electrons, muons, conesize = 0.05):
+def clean_electrons_from_muons(electrons, muons, conesize = 0.05, use_cache=None):
     ### define a mask to ignore electrons in a small cone around loose muons
     # input arguments:
     # - electrons: awkward array of electrons (e.g. from events.Electron)
@@ -29,10 +188,12 @@ def clean_electrons_from_muons(electrons, muons, conesize = 0.05):
     #   note: to select only specific muons to clean from,
     #         use e.g. events.Muon[some_mask] instead of events.Muon
     # - conesize: size of the cone around the muon in which to ignore electrons
+    # - use_cache: reuse the mask from a previous call with identical inputs
+    #   (default: only if numba is not used)
     # returns: a mask for electrons that do not overlap with selected muons
-    return clean(electrons, muons, conesize)
+    return clean(electrons, muons, conesize, use_cache=use_cache)
 
-def clean_jets_from_leptons(jets, leptons, conesize=0.4):
+def clean_jets_from_leptons(jets, leptons, conesize=0.4, use_cache=None):
     ### define a mask to ignore jets in a cone around leptons
     # input arguments:
     # - jets: awkward array of jets (e.g. from events.Jet)
@@ -44,5 +205,7 @@ def clean_jets_from_leptons(jets, leptons, conesize=0.4):
     #   note: to select only specific leptons to clean from,
     #         both electron and muon arrays can be masked before concatenation
     # - conesize: size of the cone around the lepton in which to ignore jets
+    # - use_cache: reuse the mask from a previous call with identical inputs
+    #   (default: only if numba is not used)
     # returns: a mask for jets that do not overlap with selected leptons
-    return clean(jets, leptons, conesize)
+    return clean(jets, leptons, conesize, use_cache=use_cache)
@@ -2,22 +2,34 @@
 # Definition of electron selections #
 #####################################
 
-def electronselection(electrons, selectionid=None):
+# selections that are built on a looser selection
+# (maps the selection identifier to the identifier of the looser selection;
+#  the mask of the latter can be passed as basemask to electronselection)
+electron_id_dependencies = {
+    'dummy_tight': 'dummy_loose',
+    'ttwloose_fo': 'run2ul_loose',
+    'ttwloose_tight': 'ttwloose_fo'
+}
+
+def electronselection(electrons, selectionid=None, basemask=None):
     ### perform electron selection
     # input arguments:
     # - electrons: awkward array of electrons
     #   (e.g. from events.Electron)
     # - selectionid: selection identifier
+    # - basemask: precomputed mask of the looser selection this one is built on
+    #   (see electron_id_dependencies), to avoid evaluating it again;
+    #   ignored for selections that are not built on another one.
     # returns:
     # a boolean mask for electrons
     
     # switch between selections
     if( selectionid is None ): return (electrons.pt > 0.)
     elif( selectionid=='dummy_loose' ): return electronid_dummy_loose(electrons)
-    elif( selectionid=='dummy_tight'): return electronid_dummy_tight(electrons)
+    elif( selectionid=='dummy_tight'): return electronid_dummy_tight(electrons, loosemask=basemask)
     elif( selectionid=='run2ul_loose' ): return electronid_run2ul_loose(electrons)
-    elif( selectionid=='ttwloose_fo' ): return electronid_ttwloose_fo(electrons)
-    elif( selectionid=='ttwloose_tight' ): return electronid_ttwloose_tight(electrons)
+    elif( selectionid=='ttwloose_fo' ): return electronid_ttwloose_fo(electrons, loosemask=basemask)
+    elif( selectionid=='ttwloose_tight' ): return electronid_ttwloose_tight(electrons, fomask=basemask)
     elif( selectionid=='topmvav2_loose'): return electronid_topmvav2_loose(electrons)
     
     # raise error if selection parameters are invalid
@@ -35,9 +47,10 @@ def electronid_dummy_loose(electrons):
     )
     return selection
 
-def electronid_dummy_tight(electrons):
+def electronid_dummy_tight(electrons, loosemask=None):
+    if loosemask is None: loosemask = electronid_dummy_loose(electrons)
     selection = (
-        electronid_dummy_loose(electrons)
+        loosemask
         & (electrons.pt > 30.)
     )
     return selection
@@ -71,9 +84,10 @@ def electronid_run2ul_loose(electrons):
 # - so far, only the 2018 FO ID has been implemented (for testing),
 #   later extend to other years (with slightly modified values)
 
-def electronid_ttwloose_fo(electrons):
+def electronid_ttwloose_fo(electrons, loosemask=None):
+    if loosemask is None: loosemask = electronid_run2ul_loose(electrons)
     selection = (
-        electronid_run2ul_loose(electrons)
+        loosemask
         & (electrons.convVeto)
         & (electrons.tightCharge==2)
         & ( (electrons.mvaTOP > 0.81)
@@ -83,9 +97,10 @@ def electronid_ttwloose_fo(electrons):
     )
     return selection
 
-def electronid_ttwloose_tight(electrons):
+def electronid_ttwloose_tight(electrons, fomask=None):
+    if fomask is None: fomask = electronid_ttwloose_fo(electrons)
     selection = (
-        electronid_ttwloose_fo(electrons)
+        fomask
         & (electrons.mvaTOP > 0.81)
     )
     return selection
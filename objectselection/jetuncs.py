@@ -58,6 +58,98 @@ def get_varied_met(events, variation):
     met = ak.with_field(met, met_phi, where='phi')
     return met
 
+class VariedCollection(object):
+    ### lightweight view of a collection (e.g. events.Jet) with some varied columns
+    # the varied columns (e.g. pt and mass) are calculated lazily on first access,
+    # all other fields are taken from the original collection without copying.
+    # the view supports attribute access (e.g. jets.pt, jets.eta),
+    # so it can be passed directly to selection functions such as jetselection.
+    # indexing with a mask (e.g. jets[jet_mask]) returns a regular awkward array
+    # holding only the selected objects, with the varied columns filled in.
+
+    def __init__(self, collection, columns):
+        ### initializer
+        # input arguments:
+        # - collection: the original collection (e.g. events.Jet)
+        # - columns: dict matching field names to functions that calculate
+        #   the varied column from the original collection
+        self.collection = collection
+        self.columns = columns
+        self.cache = {}
+
+    def __getattr__(self, name):
+        # note: only called for names that are not regular attributes of the view
+        if name in ['collection', 'columns', 'cache']: raise AttributeError(name)
+        if name in self.columns.keys():
+            if name not in self.cache.keys():
+                self.cache[name] = self.columns[name](self.collection)
+            return self.cache[name]
+        return getattr(self.collection, name)
+
+    def __getitem__(self, key):
+        if isinstance(key, str): return getattr(self, key)
+        res = self.collection[key]
+        for name in self.columns.keys():
+            res = ak.with_field(res, getattr(self, name)[key], where=name)
+        return res
+
+    def __len__(self):
+        return len(self.collection)
+
+    @property
+    def fields(self):
+        return self.collection.fields
+
+
+class VariedEvents(object):
+    ### lightweight view of events with some collections replaced
+    # e.g. VariedEvents(events, Jet=varied_jets, MET=varied_met)
+    # can be used instead of events in event variable calculation, event selection
+    # and reweighting, without modifying the original events.
+
+    def __init__(self, events, **collections):
+        self.events = events
+        self.collections = collections
+
+    def __getattr__(self, name):
+        if name in ['events', 'collections']: raise AttributeError(name)
+        if name in self.collections.keys(): return self.collections[name]
+        return getattr(self.events, name)
+
+    def __getitem__(self, key):
+        if isinstance(key, str): return getattr(self, key)
+        msg = 'ERROR: VariedEvents can only be indexed by field name.'
+        raise Exception(msg)
+
+    def __len__(self):
+        return len(self.events)
+
+
+def get_jet_variation_view(events, variation):
+    ### get a lazy view of the varied jet collection
+    # equivalent to get_varied_jets, but without rebuilding the jet collection;
+    # see VariedCollection.
+    jets = events.Jet
+    if variation=='nominal': return jets
+    if variation.startswith('unclustEn'): return jets
+    columns = {
+      'pt': lambda jets: getattr(jets, 'pt_{}'.format(variation)) * (jets.pt / jets.pt_nom),
+      'mass': lambda jets: getattr(jets, 'mass_{}'.format(variation)) * (jets.mass / jets.mass_nom)
+    }
+    return VariedCollection(jets, columns)
+
+def get_met_variation_view(events, variation):
+    ### get a lazy view of the varied MET
+    # equivalent to get_varied_met, but without rebuilding the MET collection;
+    # see VariedCollection.
+    met = events.MET
+    if variation=='nominal': return met
+    columns = {
+      'pt': lambda met: getattr(met, 'T1Smear_pt_{}'.format(variation)) * (met.pt / met.T1Smear_pt),
+      'phi': lambda met: getattr(met, 'T1Smear_phi_{}'.format(variation)) + (met.phi - met.T1Smear_phi)
+    }
+    return VariedCollection(met, columns)
+
 def get_available_jec_variations(events):
     ### get list of available JEC variations 
     variations = ([b[3:-2] for b in events.Jet.fields 
@@ -0,0 +1,119 @@
+###########################################
+# Evaluation of all lepton IDs as bitmask #
+###########################################
+# The lepton IDs defined in electronselection.py and muonselection.py
+# are evaluated on flattened columns (each variable is flattened only once,
+# and the selections are evaluated on plain numpy arrays instead of jagged arrays).
+# Each ID is evaluated once, in dependency order: IDs that are built on a looser ID
+# (e.g. tight on FO on loose) get the already evaluated mask of the looser ID
+# instead of evaluating it again (see electron_id_dependencies and muon_id_dependencies).
+# The result is a small integer per lepton, in which each bit corresponds
+# to one selection ID (see electron_ids and muon_ids below),
+# so that the masks for the individual IDs become simple bit tests.
+# Note: the selection IDs themselves are only defined in
+#       electronselection.py and muonselection.py, nothing is duplicated here.
+
+# imports
+import numpy as np
+import awkward as ak
+from objectselection.electronselection import electronselection
+from objectselection.electronselection import electron_id_dependencies
+from objectselection.muonselection import muonselection
+from objectselection.muonselection import muon_id_dependencies
+
+
+# definition of bits
+# (selection ID at position i in the list corresponds to bit i)
+electron_ids = ['dummy_loose', 'dummy_tight', 'run2ul_loose',
+                'ttwloose_fo', 'ttwloose_tight', 'topmvav2_loose']
+muon_ids = ['dummy_loose', 'dummy_tight', 'run2ul_loose',
+            'ttwloose_fo', 'ttwloose_tight', 'topmvav2_loose']
+
+
+class FlatColumns(object):
+    ### view of a jagged collection as flat numpy columns
+    # the columns are accessed as attributes (e.g. columns.pt),
+    # so that they can be passed to electronselection and muonselection;
+    # each column is flattened only once, when it is first accessed.
+
+    def __init__(self, objects):
+        self._objects = objects
+        self._fields = set(objects.fields)
+        self._columns = {}
+
+    def __getattr__(self, field):
+        if field.startswith('_'): raise AttributeError(field)
+        if field not in self._columns:
+            if field not in self._fields:
+                raise AttributeError('collection has no field {}'.format(field))
+            self._columns[field] = ak.to_numpy(ak.flatten(self._objects[field], axis=1))
+        return self._columns[field]
+
+
+def lepton_id_bits(leptons, flavour, selectionids=None):
+    ### evaluate lepton IDs as a bitmask
+    # input arguments:
+    # - leptons: awkward array of electrons or muons
+    #   (e.g. from events.Electron)
+    # - flavour: either 'electron' or 'muon'
+    # - selectionids: list of selection IDs to evaluate
+    #   (default: all IDs for which the needed variables are present)
+    # returns:
+    # jagged array of uint8 with the same structure as leptons,
+    # where bit i is set if the lepton passes selection ID i
+    # (see electron_ids and muon_ids; use id_mask to get the mask for a given ID)
+    if flavour=='electron':
+        ids, selection, dependencies = electron_ids, electronselection, electron_id_dependencies
+    elif flavour=='muon':
+        ids, selection, dependencies = muon_ids, muonselection, muon_id_dependencies
+    else:
+        msg = 'ERROR in lepton_id_bits: flavour {} not recognized.'.format(flavour)
+        raise Exception(msg)
+    skipmissing = (selectionids is None)
+    if selectionids is None: selectionids = ids
+    for sid in selectionids:
+        if sid not in ids:
+            msg = 'ERROR in lepton_id_bits:'
+            msg += ' selection {} not recognized for {}s.'.format(sid, flavour)
+            raise Exception(msg)
+    counts = ak.num(leptons, axis=1)
+    columns = FlatColumns(leptons)
+    # evaluate each needed ID once, looser IDs before the IDs built on them
+    # (None for IDs for which not all variables are present)
+    masks = {}
+    def evaluate(sid):
+        if sid in masks: return masks[sid]
+        basemask = None
+        if sid in dependencies:
+            basemask = evaluate(dependencies[sid])
+            if basemask is None:
+                masks[sid] = None
+                return None
+        try:
+            mask = selection(columns, selectionid=sid, basemask=basemask)
+            masks[sid] = np.asarray(mask, dtype=bool)
+        except AttributeError:
+            if not skipmissing: raise
+            masks[sid] = None
+        return masks[sid]
+    bits = np.zeros(int(np.sum(counts)), dtype=np.uint8)
+    for sid in selectionids:
+        mask = evaluate(sid)
+        if mask is None: continue
+        bits |= (mask.astype(np.uint8) << ids.index(sid))
+    return ak.unflatten(bits, counts)
+
+def electron_id_bits(electrons, selectionids=None):
+    return lepton_id_bits(electrons, 'electron', selectionids=selectionids)
+
+def muon_id_bits(muons, selectionids=None):
+    return lepton_id_bits(muons, 'muon', selectionids=selectionids)
+
+def id_mask(bits, flavour, selectionid):
+    ### get the mask for a given selection ID from a bitmask made by lepton_id_bits
+    ids = electron_ids if flavour=='electron' else muon_ids
+    if selectionid not in ids:
+        msg = 'ERROR in id_mask:'
+        msg += ' selection {} not recognized for {}s.'.format(selectionid, flavour)
+        raise Exception(msg)
+    return ((bits & (1 << ids.index(selectionid))) != 0)
@@ -2,22 +2,34 @@
 # Definition of muon selections #
 #################################
 
-def muonselection(muons, selectionid=None):
+# selections that are built on a looser selection
+# (maps the selection identifier to the identifier of the looser selection;
+#  the mask of the latter can be passed as basemask to muonselection)
+muon_id_dependencies = {
+    'dummy_tight': 'dummy_loose',
+    'ttwloose_fo': 'run2ul_loose',
+    'ttwloose_tight': 'ttwloose_fo'
+}
+
+def muonselection(muons, selectionid=None, basemask=None):
     ### perform muon selection
     # input arguments:
     # - muons: awkward array of muons
     #   (e.g. from events.Muon)
     # - selectionid: selection identifier
+    # - basemask: precomputed mask of the looser selection this one is built on
+    #   (see muon_id_dependencies), to avoid evaluating it again;
+    #   ignored for selections that are not built on another one.
     # returns:
     # a boolean mask for muons
     
     # switch between selections
     if( selectionid is None ): return (muons.pt > 0.)
     elif( selectionid=='dummy_loose' ): return muonid_dummy_loose(muons)
-    elif( selectionid=='dummy_tight'): return muonid_dummy_tight(muons)
+    elif( selectionid=='dummy_tight'): return muonid_dummy_tight(muons, loosemask=basemask)
     elif( selectionid=='run2ul_loose' ): return muonid_run2ul_loose(muons)
-    elif( selectionid=='ttwloose_fo' ): return muonid_ttwloose_fo(muons)
-    elif( selectionid=='ttwloose_tight' ): return muonid_ttwloose_tight(muons)
+    elif( selectionid=='ttwloose_fo' ): return muonid_ttwloose_fo(muons, loosemask=basemask)
+    elif( selectionid=='ttwloose_tight' ): return muonid_ttwloose_tight(muons, fomask=basemask)
     elif( selectionid=='topmvav2_loose'): return muonid_topmvav2_loose(muons)
 
     # raise error if selection parameters are invalid
@@ -35,9 +47,10 @@ def muonid_dummy_loose(muons):
     )
     return selection
 
-def muonid_dummy_tight(muons):
+def muonid_dummy_tight(muons, loosemask=None):
+    if loosemask is None: loosemask = muonid_dummy_loose(muons)
     selection = (
-        muonid_dummy_loose(muons)
+        loosemask
         & (muons.pt > 30.)
     )
     return selection
@@ -71,18 +84,20 @@ def muonid_run2ul_loose(muons):
 # - so far, only the 2018 FO ID has been implemented (for testing),
 #   later extend to other years (with slightly modified values)
 
-def muonid_ttwloose_fo(muons):
+def muonid_ttwloose_fo(muons, loosemask=None):
+    if loosemask is None: loosemask = muonid_run2ul_loose(muons)
     selection = (
-        muonid_run2ul_loose(muons)
+        loosemask
         & ( (muons.mvaTOP > 0.64)
             | ( (muons.jetBTagDeepFlavor < 0.025)
                 & (muons.jetPtRatio > 0.45) ) )
     )
     return selection
 
-def muonid_ttwloose_tight(muons):
+def muonid_ttwloose_tight(muons, fomask=None):
+    if fomask is None: fomask = muonid_ttwloose_fo(muons)
     selection = (
-        muonid_ttwloose_fo(muons)
+        fomask
         & (muons.mvaTOP > 0.64)
     )
     return selection
@@ -5,9 +5,25 @@
 # imports
 import sys
 import os
+import numpy as np
 import awkward as ak
+from coffea.nanoevents.methods.nanoaod import GenParticle
 
-def geometricmatch(events, recopart, recopartpdgid, allowphoton=False):
+# status flags of gen particles that are considered prompt
+promptflags = ['isPrompt', 'isDirectPromptTauDecayProduct', 'isHardProcess',
+               'fromHardProcess', 'fromHardProcessBeforeFSR']
+
+def flagmask(flags):
+    ### internal helper function to get the bitmask corresponding to a list of status flags
+    mask = 0
+    for flag in flags: mask |= (1 << GenParticle.FLAGS.index(flag))
+    return mask
+
+def flat(array):
+    ### internal helper function to flatten a jagged array into a numpy array
+    return np.asarray(ak.flatten(array, axis=1))
+
+def geometricmatch(gen, lepevent, lepeta, lepphi, recopartpdgid, threshold=0.2):
     ### internal helper function to determine geometric gen match,
     # in case the builtin gen matching is not valid.
     # based on:
@@ -15,70 +31,114 @@ def geometricmatch(events, recopart, recopartpdgid, allowphoton=False):
     # which was in turn based on:
     # https://github.com/GhentAnalysis/heavyNeutrino/blob/UL_master/multilep/src/GenTools.cc
     # input arguments:
-    # - events: object of type NanoEventsArray
-    # - recopart: array of reco particles, obtained via e.g. events.Electron
+    # - gen: dict of flat numpy arrays with gen particle properties
+    #   ('offsets', 'pdgId', 'status', 'statusFlags', 'eta', 'phi'; see get_gen_arrays)
+    # - lepevent: flat numpy array with the event index of each reco particle to match
+    # - lepeta, lepphi: flat numpy arrays with eta and phi of each reco particle to match
     # - recopartpdgid: pdg id (in absolute value) of reco particles
-    # - allowphoton: whether to allow a matching gen particle with pdgid of a photon
-    # - verbose: whether to do some info printing
+    # - threshold: maximum delta R for a valid match
     # returns:
-    # array of matching gen particles (with None elements where no valid match was found)
-    
+    # flat numpy array with the index of the nearest selected gen particle
+    # in the flattened gen particle collection (-1 where no valid match was found)
+    # note: the nearest gen particle with the same pdg id is taken;
+    #       for reco particles without such a match, photons are allowed as well.
+    # note: all reco particles are matched at once, by padding the candidate
+    #       gen particles in their event to the maximum number of candidates.
+    res = np.full(len(lepevent), -1, dtype=np.int64)
+    if len(lepevent)==0: return res
+
     # define mask for which gen particles to consider for matching
-    statusmask = (events.GenPart.status==1) # (for stable gen particles)
+    statusmask = (gen['status']==1) # (for stable gen particles)
     if abs(recopartpdgid)==15:
-        statusmask = ((events.GenPart.status==2)
-                      & events.GenPart.hasFlags(['isLastCopy']))
+        statusmask = ((gen['status']==2)
+                      & ((gen['statusFlags'] & flagmask(['isLastCopy']))!=0))
                       # (special case for taus)
-    pdgidmask = (abs(events.GenPart.pdgId)==abs(recopartpdgid))
-    if allowphoton: pdgidmask = pdgidmask | (abs(events.GenPart.pdgId)==22)
-    genmask = statusmask & pdgidmask
+    abspdgid = np.abs(gen['pdgId'])
+    samepdgid = (abspdgid==abs(recopartpdgid))
+    candidates = np.nonzero(statusmask & (samepdgid | (abspdgid==22)))[0]
+    if len(candidates)==0: return res
+
+    # find the candidates in the event of each reco particle (padded)
+    nevents = len(gen['offsets'])-1
+    candevent = np.searchsorted(gen['offsets'], candidates, side='right')-1
+    ncands = np.bincount(candevent, minlength=nevents)
+    candstart = np.concatenate(([0], np.cumsum(ncands)[:-1]))
+    nlepcands = ncands[lepevent]
+    maxcands = int(np.max(nlepcands))
+    if maxcands==0: return res
+    padidx = np.arange(maxcands)
+    padmask = (padidx[np.newaxis,:] < nlepcands[:,np.newaxis])
+    candidx = np.where(padmask, candstart[lepevent][:,np.newaxis] + padidx[np.newaxis,:], 0)
+    genidx = candidates[candidx]
 
-    # find nearest selected gen particle for each reco particle
-    (nearestgen,dr) = recopart.nearest(events.GenPart[genmask], threshold=0.2, return_metric=True)
+    # calculate delta R
+    deta = lepeta[:,np.newaxis] - gen['eta'][genidx]
+    dphi = (lepphi[:,np.newaxis] - gen['phi'][genidx] + np.pi) % (2*np.pi) - np.pi
+    dr = np.where(padmask, np.hypot(deta, dphi), np.inf)
 
-    # repeat the procedure with allowing photons for cases without valid match so far
-    if not allowphoton:
-        nearestgen2 = geometricmatch(events, recopart, recopartpdgid, allowphoton=True)
-        nearestgen = ak.where(ak.is_none(nearestgen, axis=1), nearestgen2, nearestgen)
-    
-    # return the result
-    return nearestgen
+    # find nearest gen particle, first without and then with photons
+    rows = np.arange(len(lepevent))
+    drsame = np.where(samepdgid[genidx], dr, np.inf)
+    nearestsame = np.argmin(drsame, axis=1)
+    nearestall = np.argmin(dr, axis=1)
+    res = np.where(dr[rows, nearestall] <= threshold, genidx[rows, nearestall], res)
+    res = np.where(drsame[rows, nearestsame] <= threshold, genidx[rows, nearestsame], res)
+    return res
 
-def findmatch(events, recopart, recopartpdgid):
+def get_gen_arrays(events):
+    ### internal helper function to get flat arrays of gen particle properties
+    gen = {key: flat(events.GenPart[key])
+           for key in ['pdgId', 'status', 'statusFlags', 'eta', 'phi']}
+    gen['offsets'] = np.concatenate(([0], np.cumsum(np.asarray(ak.num(events.GenPart, axis=1)))))
+    return gen
+
+def findmatch(events, recopart, recopartpdgid, gen=None):
     ### internal helper function to determine gen match.
     # priority is given on builtin matching, with fallback to geometric matching.
     # input arguments:
     # - events: object of type NanoEventsArray
     # - recopart: array of reco particles, obtained via e.g. events.Electron
     # - recopartpdgid: pdg id (in absolute value) of reco particles
+    # - gen: flat gen particle arrays (see get_gen_arrays; made if not provided)
     # returns:
-    # array of matching gen particles (with None elements where no valid match was found)
-    genmatch = recopart.matched_gen # (builtin matching)
-    validmatch = (genmatch.pdgId==recopart.pdgId)
-    validmatch = ak.fill_none(validmatch, False)
-    genmatch_geometric = geometricmatch(events, recopart, recopartpdgid)
-    genmatch = ak.where(validmatch, genmatch, genmatch_geometric)
-    # implementation note: the above is inefficient as geometric matches are calculated
-    # for all reco particles, while we only need the ones for which the builtin match is invalid.
-    # so ideally would do something like this:
-    # genmatch[~validmatch] = geometricmatch(events, recopart[~validmatch], recopartpdgid)
-    # however, this kind of in-place assignment seems to be prohibited in awkward arrays.
-    return genmatch
+    # flat numpy array with the index of the matching gen particle for each reco particle
+    # in the flattened gen particle collection (-1 where no valid match was found)
+    # note: geometric matching is only done for the reco particles
+    #       for which the builtin match is not valid.
+    if gen is None: gen = get_gen_arrays(events)
+    counts = np.asarray(ak.num(recopart, axis=1))
+    lepevent = np.repeat(np.arange(len(counts)), counts)
+    lepgenidx = flat(recopart.genPartIdx).astype(np.int64)
+    leppdgid = flat(recopart.pdgId)
+    # builtin matching
+    ngen = np.diff(gen['offsets'])[lepevent]
+    hasgenidx = ((lepgenidx>=0) & (lepgenidx<ngen))
+    match = np.where(hasgenidx, gen['offsets'][lepevent] + lepgenidx, -1)
+    validmatch = hasgenidx.copy()
+    validmatch[hasgenidx] = (gen['pdgId'][match[hasgenidx]]==leppdgid[hasgenidx])
+    # geometric matching for the others
+    unmatched = np.nonzero(~validmatch)[0]
+    match[unmatched] = geometricmatch(gen, lepevent[unmatched],
+      flat(recopart.eta)[unmatched], flat(recopart.phi)[unmatched], recopartpdgid)
+    return match
 
-def genpart_is_prompt(genpart):
-    ### internal helper function to determine promptness of gen particles
-    # input arguments:
-    # - genpart: array of gen particles, obtained via e.g. events.Electron.matched_gen
+def get_gen_variables(events, recopart, recopartpdgid):
+    ### internal helper function to calculate gen variables of reco particles
     # returns:
-    # mask for promptness of the provided gen particles
-    isprompt = ((genpart.hasFlags(['isPrompt']))
-                | (genpart.hasFlags(['isDirectPromptTauDecayProduct']))
-                | (genpart.hasFlags(['isHardProcess']))
-                | (genpart.hasFlags(['fromHardProcess']))
-                | (genpart.hasFlags(['fromHardProcessBeforeFSR']))
-    )
-    isprompt = ak.fill_none(isprompt, False)
-    return isprompt
+    # dict matching variable names to jagged arrays of the same structure as recopart
+    gen = get_gen_arrays(events)
+    match = findmatch(events, recopart, recopartpdgid, gen=gen)
+    hasmatch = (match>=0)
+    matchpdgid = np.zeros(len(match), dtype=gen['pdgId'].dtype)
+    matchpdgid[hasmatch] = gen['pdgId'][match[hasmatch]]
+    matchflags = np.zeros(len(match), dtype=gen['statusFlags'].dtype)
+    matchflags[hasmatch] = gen['statusFlags'][match[hasmatch]]
+    isprompt = ((matchflags & flagmask(promptflags))!=0)
+    ischargeflip = (hasmatch & (flat(recopart.pdgId)==-matchpdgid))
+    counts = ak.num(recopart, axis=1)
+    return {'isPrompt': ak.unflatten(isprompt, counts),
+            'matchPdgId': ak.unflatten(matchpdgid, counts),
+            'isChargeFlip': ak.unflatten(ischargeflip, counts)}
 
 def add_electron_gen_variables(events, variables=['all']):
     ### add electron generator variables to events
@@ -89,24 +149,24 @@ def add_electron_gen_variables(events, variables=['all']):
     allvariables = ('all' in variables)
     checkvars = variables[:]
     # do matching one time only (instead of repeating for all variables)
-    matches = findmatch(events, events.Electron, 11)
+    genvariables = get_gen_variables(events, events.Electron, 11)
     # isPrompt
     if( allvariables or 'isPrompt' in variables):
         if not allvariables: checkvars.remove('isPrompt')
         events.Electron = ak.with_field(events.Electron, 
-          genpart_is_prompt(matches),
+          genvariables['isPrompt'],
           where='isPrompt')
     # matchPdgId
     if( allvariables or 'matchPdgId' in variables):
         if not allvariables: checkvars.remove('matchPdgId')
         events.Electron = ak.with_field(events.Electron,
-          ak.fill_none(matches.pdgId, 0),
+          genvariables['matchPdgId'],
           where='matchPdgId')
     # isChargeFlip
     if( allvariables or 'isChargeFlip' in variables ):
         if not allvariables: checkvars.remove('isChargeFlip')
         events.Electron = ak.with_field(events.Electron,
-          ak.fill_none(events.Electron.pdgId==-matches.pdgId, False),
+          genvariables['isChargeFlip'],
           where='isChargeFlip')
     # also update key access
     events['Electron'] = events.Electron
@@ -125,24 +185,24 @@ def add_muon_gen_variables(events, variables=['all']):
     allvariables = ('all' in variables)
     checkvars = variables[:]
     # do matching one time only (instead of repeating for all variables)
-    matches = findmatch(events, events.Muon, 13)
+    genvariables = get_gen_variables(events, events.Muon, 13)
     # isPrompt
     if( allvariables or 'isPrompt' in variables):
         if not allvariables: checkvars.remove('isPrompt')
         events.Muon = ak.with_field(events.Muon,
-          genpart_is_prompt(matches),
+          genvariables['isPrompt'],
           where='isPrompt')
     # matchPdgId
     if( allvariables or 'matchPdgId' in variables):
         if not allvariables: checkvars.remove('matchPdgId')
         events.Muon = ak.with_field(events.Muon,
-          ak.fill_none(matches.pdgId, 0),
+          genvariables['matchPdgId'],
           where='matchPdgId')
     # isChargeFlip
     if( allvariables or 'isChargeFlip' in variables ):
         if not allvariables: checkvars.remove('isChargeFlip')
         events.Muon = ak.with_field(events.Muon,
-          ak.fill_none(events.Muon.pdgId==-matches.pdgId, False),
+          genvariables['isChargeFlip'],
           where='isChargeFlip')
     # also update key access
     events['Muon'] = events.Muon
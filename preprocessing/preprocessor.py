@@ -24,7 +24,7 @@ class PreProcessor(object):
     def process( self, events,
                  leptonvariables=None,
                  leptongenvariables=None,
-                 topmvavariable=None, topmvaversion=None,
+                 topmvavariable=None, topmvaversion=None, topmvanthreads=1,
                  dotriggers=False ):
         ### do preprocessing of a set of events
         # - use leptonvariables = ['all'] to calculate all lepton variables.
@@ -33,6 +33,7 @@ class PreProcessor(object):
         #   use topmvavariable = 'mvaTOP' (or another name) 
         #   and topmvaversion = 'ULv1' (or another version)
         #   to enable it.
+        #   use topmvanthreads to set the number of threads for calculating the scores.
 
         # do checks
         if( topmvavariable is not None and 'year' not in events.metadata.keys() ):
@@ -57,7 +58,8 @@ class PreProcessor(object):
 
         # add TOP lepton mva scores
         if topmvavariable is not None:
-            reader = topmva.TopLeptonMvaReader(events.metadata['year'], topmvaversion, verbose=True)
+            reader = topmva.TopLeptonMvaReader(events.metadata['year'], topmvaversion,
+                       nthreads=topmvanthreads, verbose=True)
             reader.set_scores(events, name=topmvavariable)
 
         # add aggregated triggers
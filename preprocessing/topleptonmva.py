@@ -7,18 +7,109 @@
 # - This module depends on the presence of the variables jetPtRatio and jetBTagDeepFlavor,
 #   which are not stored by default in the nanoAOD files.
 #   Hence, the module leptonvariables must be run first before this one.
+# - The boosters are kept in a registry, so each model is loaded only once per process
+#   (even if a new reader is made for every chunk of events).
+# - The input features are written from flattened columns
+#   into a preallocated float32 matrix (the input type used internally by xgboost),
+#   avoiding the conversion of a list of jagged arrays.
 
 # imports
 import os
+import threading
 import numpy as np
 import xgboost as xgb
 import awkward as ak
 
+
+# registry of loaded boosters, matching (version, flavour, year) to a Booster
+_boosters = {}
+_boosters_lock = threading.Lock()
+
+def get_weightfile(year, version, flavour):
+    ### get the weight file for a given year, version and lepton flavour
+    weightdir = os.path.join(os.path.dirname(__file__), '../data/leptonmva/weights')
+    weightfile = 'TOP'
+    if version == 'ULv2': weightfile += 'v2'
+    diryear = year.replace('20','')
+    if year=='2016PreVFP': diryear = '16APV'
+    if year=='2016PostVFP': diryear = '16'
+    weightfile += 'UL' + diryear + '_XGB.weights.bin'
+    prefix = {'electron': 'el_', 'muon': 'mu_'}[flavour]
+    return os.path.join(weightdir, prefix + weightfile)
+
+def get_booster(year, version, flavour, verbose=False):
+    ### get a booster from the registry, loading it from file on first use
+    key = (version, flavour, year)
+    with _boosters_lock:
+        if key in _boosters: return _boosters[key]
+        weightfile = get_weightfile(year, version, flavour)
+        if verbose:
+            print('INFO: loading TOP lepton MVA weights with following properties:')
+            print('  - year: {}'.format(year))
+            print('  - version: {}'.format(version))
+            print('  - {} weights file: {}'.format(flavour, weightfile))
+        if not os.path.exists(weightfile):
+            msg = 'ERROR in TopLeptonMvaReader:'
+            msg += ' file {} does not exist.'.format(weightfile)
+            raise Exception(msg)
+        booster = xgb.Booster()
+        booster.load_model(weightfile)
+        _boosters[key] = booster
+        return booster
+
+
+def get_flat_column(leptons, field):
+    ### get a lepton variable as a flat numpy array
+    # note: None values (e.g. when there is no matched jet) are set to zero.
+    return np.asarray(ak.fill_none(ak.flatten(leptons[field], axis=1), 0))
+
+def fill_features(leptons, flavour, version, features):
+    ### fill the input features for a lepton collection
+    # input arguments:
+    # - leptons: jagged array of electrons or muons (e.g. events.Electron)
+    # - flavour: either 'electron' or 'muon'
+    # - version: version of the lepton MVA
+    # - features: float32 array of shape (number of leptons, number of features)
+    #   (modified in place)
+    col = lambda field: get_flat_column(leptons, field)
+    features[:,0] = col('pt')
+    features[:,1] = col('eta')
+    features[:,2] = col('jetNDauCharged')
+    miniisocharged = col('miniPFRelIso_chg')
+    features[:,3] = miniisocharged
+    features[:,4] = col('miniPFRelIso_all') - miniisocharged
+    features[:,5] = col('jetPtRelv2')
+    features[:,6] = col('jetPtRatio')
+    features[:,7] = col('pfRelIso03_all')
+    features[:,8] = col('jetBTagDeepFlavor')
+    features[:,9] = col('sip3d')
+    features[:,10] = np.log(np.abs(col('dxy')))
+    features[:,11] = np.log(np.abs(col('dz')))
+    if flavour=='electron':
+        features[:,12] = col('mvaFall17V2noIso')
+        if version=='ULv2': features[:,13] = col('lostHits')
+    else:
+        features[:,12] = col('segmentComp')
+    return features
+
+def get_nfeatures(flavour, version):
+    ### get the number of input features
+    if( flavour=='electron' and version=='ULv2' ): return 14
+    return 13
+
+
 class TopLeptonMvaReader(object):
 
-    def __init__(self, year, version, verbose=False):
+    def __init__(self, year, version, nthreads=1, verbose=False):
+        ### initializer
+        # input arguments:
+        # - year: data-taking year
+        # - version: version of the lepton MVA
+        # - nthreads: number of threads used by xgboost for the predictions
+        # - verbose: print information when loading the weights
         self.year = year
         self.version = version
+        self.nthreads = nthreads
 
         # check arguments
         if year not in ['2016PreVFP','2016PostVFP','2017','2018']:
@@ -27,111 +118,48 @@ class TopLeptonMvaReader(object):
             raise Exception(msg)
         if version not in ['ULv1', 'ULv2']:
             msg = 'ERROR in TopLeptonMvaReader:'
-            msg += ' year {} not recognized.'.format(year)
+            msg += ' version {} not recognized.'.format(version)
             raise Exception(msg)
 
         # define working points
         self.wps = {'ULv1': [0.20, 0.41, 0.64, 0.81], 
                     'ULv2': [0.59, 0.81, 0.90, 0.94] }
 
-        # set directory and file names
-        weightdir = os.path.join(os.path.dirname(__file__), '../data/leptonmva/weights')
-        weightfile = 'TOP'
-        if self.version == 'ULv2': weightfile += 'v2'
-        diryear = year.replace('20','')
-        if year=='2016PreVFP': diryear = '16APV'
-        if year=='2016PostVFP': diryear = '16'
-        weightfile += 'UL' + diryear + '_XGB.weights.bin'
-        elweightfile = os.path.join(weightdir, 'el_' + weightfile)
-        muweightfile = os.path.join(weightdir, 'mu_' + weightfile)
-
-        # do printouts if requested
-        if verbose:
-            print('INFO: loading TOP lepton MVA weights with following properties:')
-            print('  - year: {}'.format(year))
-            print('  - version: {}'.format(version))
-            print('  - electron weights file: {}'.format(elweightfile))
-            print('  - muon weights file: {}'.format(muweightfile))
-        
-        # check if weight files exist
-        for f in [elweightfile, muweightfile]:
-            if not os.path.exists(f):
-                msg = 'ERROR in TopLeptonMvaReader:'
-                msg += ' file {} does not exist.'.format(f)
-                raise Exception(msg)
-
-        # load weights
-        self.electronmva = xgb.Booster() 
-        self.electronmva.load_model(elweightfile)
-        self.muonmva = xgb.Booster()
-        self.muonmva.load_model(muweightfile)
-        
+        # get the boosters (loaded only once per process)
+        self.electronmva = get_booster(year, version, 'electron', verbose=verbose)
+        self.muonmva = get_booster(year, version, 'muon', verbose=verbose)
+
+        # feature matrices (reused between calls, extended when needed)
+        self.buffers = {}
+
+    def get_features(self, leptons, flavour):
+        ### get the input feature matrix for a lepton collection
+        nleptons = int(ak.sum(ak.num(leptons, axis=1)))
+        nfeatures = get_nfeatures(flavour, self.version)
+        buffer = self.buffers.get(flavour)
+        if( buffer is None or len(buffer) < nleptons ):
+            buffer = np.empty((nleptons, nfeatures), dtype=np.float32)
+            self.buffers[flavour] = buffer
+        return fill_features(leptons, flavour, self.version, buffer[:nleptons])
+
+    def get_scores(self, leptons, flavour):
+        ### calculate the lepton MVA scores for a lepton collection
+        # returns: a jagged array of scores with the same structure as leptons
+        booster = self.electronmva if flavour=='electron' else self.muonmva
+        features = self.get_features(leptons, flavour)
+        counts = ak.num(leptons, axis=1)
+        if len(features)==0: scores = np.zeros(0, dtype=np.float32)
+        else:
+            booster.set_param({'nthread': self.nthreads})
+            scores = booster.inplace_predict(features)
+        return ak.unflatten(scores, counts)
+
     def set_scores(self, events, name='mvaTOP'):
         ### add the lepton MVA scores
         # input arguments:
         # - events: an object of type NanoEventsArray
         # - name: name of the field to add to events.Electron and events.Muon
-
-        # collect scores for electrons
-        electron_features = ([
-          events.Electron.pt,
-          events.Electron.eta,
-          events.Electron.jetNDauCharged,
-          events.Electron.miniPFRelIso_chg,
-          events.Electron.miniPFRelIso_all - events.Electron.miniPFRelIso_chg,
-          events.Electron.jetPtRelv2,
-          events.Electron.jetPtRatio,
-          events.Electron.pfRelIso03_all,
-          events.Electron.jetBTagDeepFlavor,
-          events.Electron.sip3d,
-          np.log(np.abs(events.Electron.dxy)),
-          np.log(np.abs(events.Electron.dz)),
-          events.Electron.mvaFall17V2noIso
-        ])
-        if( self.version=='ULv2' ):
-            electron_features.append(events.Electron.lostHits)
-        # set None values (e.g. when there is no matched jet) to zero
-        electron_features = ak.where(ak.is_none(electron_features, axis=2), 0., electron_features)
-        # flatten into a numpy array of shape (ninstances, nfeatures)
-        counts = ak.num(electron_features[0])
-        electron_features = np.transpose(np.array(ak.flatten(electron_features, axis=2)))
-        # make c-contiguous
-        electron_features = np.ascontiguousarray(electron_features)
-        # call xgboost predictor
-        electron_scores = self.electronmva.inplace_predict(electron_features)
-        # unflatten into an awkward array
-        electron_scores = ak.unflatten(electron_scores, counts)
-        # set the scores as an additional field for electrons
-        events.Electron = ak.with_field(events.Electron, electron_scores, where=name)
-        events['Electron'] = events.Electron
-
-        # calculate score for muons
-        muon_features = ([
-          events.Muon.pt,
-          events.Muon.eta,
-          events.Muon.jetNDauCharged,
-          events.Muon.miniPFRelIso_chg,
-          events.Muon.miniPFRelIso_all - events.Muon.miniPFRelIso_chg,
-          events.Muon.jetPtRelv2,
-          events.Muon.jetPtRatio,
-          events.Muon.pfRelIso03_all,
-          events.Muon.jetBTagDeepFlavor,
-          events.Muon.sip3d,
-          np.log(np.abs(events.Muon.dxy)),
-          np.log(np.abs(events.Muon.dz)),
-          events.Muon.segmentComp
-        ])
-        # set None values (e.g. when there is no matched jet) to zero
-        muon_features = ak.where(ak.is_none(muon_features, axis=2), 0., muon_features)
-        # flatten into a numpy array of shape (ninstances, nfeatures)
-        counts = ak.num(muon_features[0])
-        muon_features = np.transpose(np.array(ak.flatten(muon_features, axis=2)))
-        # make c-contiguous
-        muon_features = np.ascontiguousarray(muon_features)
-        # call xgboost predictor
-        muon_scores = self.muonmva.inplace_predict(muon_features)
-        # unflatten into an awkward array
-        muon_scores = ak.unflatten(muon_scores, counts)
-        # set the scores as an additional field for muons
-        events.Muon = ak.with_field(events.Muon, muon_scores, where=name)
-        events['Muon'] = events.Muon
+        electron_scores = self.get_scores(events.Electron, 'electron')
+        events['Electron'] = ak.with_field(events.Electron, electron_scores, where=name)
+        muon_scores = self.get_scores(events.Muon, 'muon')
+        events['Muon'] = ak.with_field(events.Muon, muon_scores, where=name)
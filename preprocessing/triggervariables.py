@@ -2,12 +2,25 @@
 # Add combinations of triggers #
 ################################
 
+# The trigger definitions are parsed only once per process into a TriggerMenu,
+# and all combined triggers are evaluated together:
+# the needed HLT branches are stacked into a 2D boolean array
+# (number of events x number of branches),
+# which is multiplied (in boolean algebra, i.e. OR of ANDs)
+# with a matrix defining which branches belong to which combined trigger.
+
 # imports
 import os
 import sys
 import json
+import threading
+import numpy as np
 import awkward as ak
 
+# registry of trigger menus per year
+_menus = {}
+_menus_lock = threading.Lock()
+
 def load_triggerdefs():
     ### internal helper function to load the json file with trigger definitions
     # path to json file is hard-coded for now, maybe later use an argument.
@@ -16,31 +29,90 @@ def load_triggerdefs():
         triggerdefs = json.load(f)
     return triggerdefs
 
+
+class TriggerMenu(object):
+    ### collection of combined triggers for a given year
+
+    def __init__(self, year, triggerdefs):
+        ### initializer
+        # input arguments:
+        # - year: data-taking year
+        # - triggerdefs: dict matching combined trigger names to lists of HLT branch names
+        self.year = year
+        self.triggerdefs = triggerdefs
+        self.triggers = list(triggerdefs.keys())
+        self.hltset = set([hlt for hlts in triggerdefs.values() for hlt in hlts])
+        self.hlts = sorted(self.hltset)
+        # matrix of shape (number of HLT branches, number of combined triggers)
+        self.definition = np.zeros((len(self.hlts), len(self.triggers)), dtype=bool)
+        hltindex = {hlt: i for i, hlt in enumerate(self.hlts)}
+        for j, trigger in enumerate(self.triggers):
+            for hlt in triggerdefs[trigger]: self.definition[hltindex[hlt], j] = True
+        # cache of resolved definitions per set of available branches
+        self.resolved = {}
+
+    def resolve(self, fields):
+        ### find which HLT branches are available
+        # input arguments:
+        # - fields: list of available HLT branch names (e.g. events.HLT.fields)
+        # returns: a tuple of the list of available needed HLT branches
+        #          and the corresponding rows of the definition matrix
+        # (only the needed branches are used as key,
+        #  so e.g. adding the combined triggers to the fields does not matter)
+        key = frozenset(self.hltset.intersection(fields))
+        if key not in self.resolved:
+            available = [i for i, hlt in enumerate(self.hlts) if hlt in key]
+            for trigger in self.triggers:
+                for hlt in self.triggerdefs[trigger]:
+                    if hlt in key: continue
+                    msg = 'WARNING: trigger {} not found'.format(hlt)
+                    msg += ' (needed for definition of {});'.format(trigger)
+                    msg += ' this trigger will be ignored in the combination.'
+                    print(msg)
+            self.resolved[key] = ([self.hlts[i] for i in available],
+                                  self.definition[available, :])
+        return self.resolved[key]
+
+    def evaluate(self, hlt):
+        ### evaluate all combined triggers
+        # input arguments:
+        # - hlt: record array of HLT branches (e.g. events.HLT)
+        # returns: a dict matching combined trigger names to numpy boolean masks
+        # note: the masks are not stored in the menu,
+        #       since the menu is shared between all chunks of events.
+        branches, definition = self.resolve(hlt.fields)
+        nevents = len(hlt)
+        if len(branches)==0: passed = np.zeros((nevents, len(self.triggers)), dtype=bool)
+        else:
+            stack = np.empty((nevents, len(branches)), dtype=bool)
+            for i, branch in enumerate(branches): stack[:,i] = ak.to_numpy(hlt[branch])
+            passed = np.matmul(stack, definition)
+        return {trigger: passed[:,j] for j, trigger in enumerate(self.triggers)}
+
+
+def get_trigger_menu(year):
+    ### get the trigger menu for a given year (parsed only once per process)
+    with _menus_lock:
+        if year not in _menus:
+            triggerdefs = load_triggerdefs()
+            if year not in triggerdefs.keys():
+                raise Exception('ERROR in get_trigger_menu: year {} not recognized;'.format(year)
+                  +' options are: {}'.format(triggerdefs.keys()))
+            _menus[year] = TriggerMenu(year, triggerdefs[year])
+        return _menus[year]
+
 def add_trigger_variables(events, year=None, returntriggerdefs=False):
     ### add combined trigger definitions to NanoEvents
-    # load trigger definitions
+    # get trigger definitions
     if year is None:
         raise Exception('ERROR in add_trigger_variables: year is not set.')
-    triggerdefs = load_triggerdefs()
-    if year not in triggerdefs.keys():
-        raise Exception('ERROR in add_trigger_variables: year {} not recognized;'.format(year)
-          +' options are: {}'.format(triggerdefs.keys()))
-    triggerdefs = triggerdefs[year]
-    # loop over combined triggers
-    for trigger, hlts in triggerdefs.items():
-        # make a mask for this combined trigger
-        mask = (events.event < 0)
-        for hlt in hlts:
-            # check if trigger is present in events
-            if hlt not in events.HLT.fields:
-                msg = 'WARNING: trigger {} not found'.format(hlt)
-                msg += ' (needed for definition of {});'.format(trigger)
-                msg += ' this trigger will be ignored in the combination.'
-                print(msg)
-                continue
-            mask = (mask | events.HLT[hlt])
-        # add this as a new variable
-        events.HLT = ak.with_field(events.HLT, mask, where=trigger)
-        events['HLT'] = events.HLT
+    menu = get_trigger_menu(year)
+    # evaluate all combined triggers
+    masks = menu.evaluate(events.HLT)
+    # add them as new variables
+    hlt = events.HLT
+    for trigger, mask in masks.items():
+        hlt = ak.with_field(hlt, mask, where=trigger)
+    events['HLT'] = hlt
     # return added triggers if requested
-    if returntriggerdefs: return triggerdefs
+    if returntriggerdefs: return menu.triggerdefs
@@ -41,6 +41,17 @@ class AbstractReweighter(ABC):
             msg += ' allowed values are {}'.format(self.variations)
             raise Exception(msg)
 
+    def enable_cache(self):
+        # default behaviour: no caching.
+        # can be overridden in concrete reweighters with expensive intermediate results
+        # that can be reused between calls on the same events and masks,
+        # e.g. within one call to CombinedReweighter.allweights.
+        pass
+
+    def clear_cache(self):
+        # default behaviour: no caching (see enable_cache).
+        pass
+
     @abstractmethod
     def weights(self, events, **kwargs):
         pass
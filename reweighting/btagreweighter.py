@@ -30,12 +30,43 @@
 
 import os
 import sys
+import re
+import json
 import numpy as np
 import awkward as ak
 from correctionlib._core import CorrectionSet
 from pathlib import Path
 sys.path.append(Path(__file__).parents[1])
 from reweighting.abstractreweighter import AbstractReweighter
+from reweighting.correctionlibtools import evaluate_flat
+
+
+def read_normalization_cache(cachefile):
+    ### read a b-tag normalization cache file
+    # the cache file is a json file with the following structure:
+    # {year: {samplename: {systematic: {njets: [average weight, number of events]}}}}
+    # (see normalization_sample_name for the sample names)
+    # (see testanalysis/btagnormalization.py for how to produce it).
+    # returns: the cache as a dict (empty if the file does not exist yet)
+    if not os.path.exists(cachefile): return {}
+    with open(cachefile, 'r') as f:
+        cache = json.load(f)
+    return cache
+
+def write_normalization_cache(cachefile, cache):
+    ### write a b-tag normalization cache file (see read_normalization_cache)
+    cachedir = os.path.dirname(os.path.abspath(cachefile))
+    if not os.path.exists(cachedir): os.makedirs(cachedir)
+    with open(cachefile, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+def normalization_sample_name(inputfile):
+    ### get the sample name under which the normalization of a file is stored in a cache file
+    # the name is the base name of the file without extension and without file index suffix
+    # (e.g. both sample_0.root and sample_1.root give sample),
+    # so that all files of a sample that is split over multiple files share one entry.
+    name = os.path.splitext(os.path.basename(inputfile))[0]
+    return re.sub(r'_[0-9]+$', '', name)
 
 
 class BTagReweighter(AbstractReweighter):
@@ -54,6 +85,8 @@ class BTagReweighter(AbstractReweighter):
             self.variations.append(unctype+'_down')
         self.normalize = normalize
         self.normalization = None
+        self.normalization_lookup = None
+        self.cache = None
 
     def var_to_unc(self, variation):
         ### internal helper function for change between naming conventions
@@ -67,45 +100,83 @@ class BTagReweighter(AbstractReweighter):
         if variation.endswith('_up'): return 'up_'+variation[:-3]
         if variation.endswith('_down'): return 'down_'+variation[:-5]
 
-    def get_jet_weights(self, jets, systematic):
-        ### internal helper function: get per-jet weights for specified systematic
-        # input arguments:
-        # - jets: a jet collection, e.g. events.Jet
-        # - systematic: name of a valid systematic in the BTV convention,
-        #   i.e. 'central' for nominal, 'up_[unctype]' or 'down_[unctype]'.
-        # note: correctionlib does not seem to handle jagged arrays,
-        #       so need to flatten and unflatten as intermediary steps
-        # note: also flattened arrays do not seem to work, not clear why...
-        #       use a for-loop for now...
+    def enable_cache(self):
+        ### start caching per-jet columns and weights
+        # (overriding default method)
+        # note: while the cache is enabled, all calls are assumed to be
+        #       for the same jet collection, e.g. within one CombinedReweighter.allweights call;
+        #       the cache must be cleared before evaluating on other jets.
+        self.cache = {'columns': None, 'weights': {}}
+
+    def clear_cache(self):
+        ### stop caching and clear cached per-jet columns and weights
+        # (overriding default method)
+        self.cache = None
+
+    def get_jet_columns(self, jets):
+        ### internal helper function: get flattened jet properties needed for evaluation
+        # returns a dict of flat numpy arrays
+        if( self.cache is not None and self.cache['columns'] is not None ):
+            return self.cache['columns']
+        jets_flat = ak.flatten(jets)
+        jets_flavor = ak.to_numpy(jets_flat.hadronFlavour)
+        columns = {
+          'pt': ak.to_numpy(jets_flat.pt),
+          'abseta': np.abs(ak.to_numpy(jets_flat.eta)),
+          'flavor': jets_flavor,
+          'discr': ak.to_numpy(jets_flat.btagDeepFlavB),
+          'cmask': (jets_flavor==4),
+          'udsgbmask': ((jets_flavor==0) | (jets_flavor==5))
+        }
+        if self.cache is not None: self.cache['columns'] = columns
+        return columns
+
+    def evaluate_columns(self, columns, systematic, mask=None):
+        ### internal helper function: evaluate the correction on (a subset of) the jets
+        correction = self.evaluator[self.jsonmap]
+        if mask is None:
+            return evaluate_flat(correction, systematic,
+              columns['flavor'], columns['abseta'], columns['pt'], columns['discr'])
+        return evaluate_flat(correction, systematic,
+          columns['flavor'][mask], columns['abseta'][mask],
+          columns['pt'][mask], columns['discr'][mask])
+
+    def get_flat_jet_weights(self, jets, systematic):
+        ### internal helper function: get flattened per-jet weights for specified systematic
         # note: correctionlib does not handle separate systematics for udsg, c and b-jets,
         #       so need to explicitly mask the jets based on flavor before calling evaluate.
-        jets_flat, jets_shape = ak.flatten(jets), ak.num(jets)
-        jets_pt = np.array(jets_flat.pt).astype(float)
-        jets_abseta = np.array(abs(jets_flat.eta)).astype(float)
-        jets_flavor = np.array(jets_flat.hadronFlavour).astype(int)
-        jets_discr = np.array(jets_flat.btagDeepFlavB).astype(float)
-        weights = np.ones(len(jets_flat))
+        #       the systematic is evaluated only for jets of the relevant flavor,
+        #       the other jets get the central weight (taken from the cache if enabled).
+        if( self.cache is not None and systematic in self.cache['weights'] ):
+            return self.cache['weights'][systematic]
+        columns = self.get_jet_columns(jets)
         unctype = systematic.replace('up_','').replace('down_','')
         # case where systematic can be applied only to jets of specific flavor
         # (and need to use central for other jets!)
         if( unctype in self.unctypes_cjets or unctype in self.unctypes_udsgbjets ):
-            if unctype in self.unctypes_cjets:
-                jetids = np.nonzero(jets_flavor==4)[0]
-            elif unctype in self.unctypes_udsgbjets:
-                jetids = np.nonzero(((jets_flavor==0) | (jets_flavor==5)))[0]
-            for idx in range(len(jets_flat)):
-                thissystematic = systematic
-                if idx not in jetids: thissystematic = 'central'
-                weights[idx] = self.evaluator[self.jsonmap].evaluate(
-                  thissystematic, jets_flavor[idx], jets_abseta[idx], jets_pt[idx], jets_discr[idx])
+            if unctype in self.unctypes_cjets: sysmask = columns['cmask']
+            elif unctype in self.unctypes_udsgbjets: sysmask = columns['udsgbmask']
+            if self.cache is not None:
+                weights = np.copy(self.get_flat_jet_weights(jets, 'central'))
+            else:
+                weights = np.ones(len(sysmask))
+                weights[~sysmask] = self.evaluate_columns(columns, 'central', mask=~sysmask)
+            weights[sysmask] = self.evaluate_columns(columns, systematic, mask=sysmask)
         # 'regular' case where systematic can be applied to all jets
-        else:
-            for idx in range(len(jets_flat)):
-                weights[idx] = self.evaluator[self.jsonmap].evaluate(
-                  systematic, jets_flavor[idx], jets_abseta[idx], jets_pt[idx], jets_discr[idx])
-        weights = ak.unflatten(weights, jets_shape)
+        else: weights = self.evaluate_columns(columns, systematic)
+        if self.cache is not None: self.cache['weights'][systematic] = weights
         return weights
 
+    def get_jet_weights(self, jets, systematic):
+        ### internal helper function: get per-jet weights for specified systematic
+        # input arguments:
+        # - jets: a jet collection, e.g. events.Jet
+        # - systematic: name of a valid systematic in the BTV convention,
+        #   i.e. 'central' for nominal, 'up_[unctype]' or 'down_[unctype]'.
+        # note: evaluated in vectorized calls on the flattened jets, see correctionlibtools.
+        weights = self.get_flat_jet_weights(jets, systematic)
+        return ak.unflatten(weights, ak.num(jets))
+
     def get_jet_weights_rss(self, jets, systematics):
         ### internal helper function: get per-jet weights for root-sum-square of systematics
         # input arguments:
@@ -199,43 +270,161 @@ class BTagReweighter(AbstractReweighter):
         (unctype, upordown) = self.var_to_unc(variation)
         return self.weightsupdown(events, upordown, jet_mask=jet_mask, unctype=unctype)
 
-    def set_normalization(self, jets, unctypes=None):
+    def get_normalization_systematics(self, unctypes=None):
+        ### internal helper function: get systematics to normalize for given unctypes
         if unctypes is None: unctypes = []
         if unctypes=='all': unctypes = self.unctypes
         systematics = ['central']
         systematics += ['up_'+unc for unc in unctypes]
         systematics += ['down_'+unc for unc in unctypes]
+        return systematics
+
+    def get_normalization_sums(self, jets, unctypes=None):
+        ### get the sum of event weights and number of events per number of jets
+        # input arguments: see set_normalization
+        # returns: a dict of the form {systematic: {njets: (sum of weights, number of events)}}
+        # note: sums for different sets of events (e.g. chunks of a file)
+        #       can be combined with add_normalization_sums
+        #       and converted to a normalization with set_normalization_from_sums.
+        systematics = self.get_normalization_systematics(unctypes=unctypes)
+        sums = {}
+        # count number of events per number of jets,
+        # and sort the events by number of jets (keeping the original order within each group)
+        # note: the weights are summed per group with np.sum on the events of that group
+        #       in their original order, as before, so the sums are bit-identical
+        #       to selecting the events of each group separately
+        #       (a weighted np.bincount would differ at rounding level).
+        jets_shape = ak.num(jets).to_numpy()
+        counts = np.bincount(jets_shape)
+        njets_set = np.nonzero(counts)[0]
+        order = np.argsort(jets_shape, kind='stable')
+        stops = np.cumsum(counts)
+        starts = stops - counts
+        # loop over systematics
+        # (with caching enabled, so the central weights are evaluated only once)
+        self.enable_cache()
+        try:
+            for sys in systematics:
+                sums[sys] = {}
+                # get event weights for this systematic
+                weights = ak.to_numpy(self.get_event_weights(jets, sys))
+                # determine sum of weights per number of jets
+                weights = weights[order]
+                for njets in njets_set:
+                    sumw = np.sum(weights[starts[njets]:stops[njets]])
+                    sums[sys][int(njets)] = (sumw, int(counts[njets]))
+        finally: self.clear_cache()
+        return sums
+
+    def add_normalization_sums(self, sums, othersums):
+        ### combine two dicts of normalization sums (see get_normalization_sums)
+        if sums is None: return othersums
+        if set(sums.keys())!=set(othersums.keys()):
+            msg = 'ERROR: cannot combine normalization sums for different systematics.'
+            raise Exception(msg)
+        res = {}
+        for sys in sums.keys():
+            res[sys] = dict(sums[sys])
+            for njets, (sumw, nevents) in othersums[sys].items():
+                if njets not in res[sys].keys(): res[sys][njets] = (sumw, nevents)
+                else: res[sys][njets] = (res[sys][njets][0]+sumw, res[sys][njets][1]+nevents)
+        return res
+
+    def set_normalization_from_sums(self, sums):
+        ### set the normalization from sums of event weights (see get_normalization_sums)
         self.normalization = {}
-        # make default normalization
-        for sys in systematics:
+        for sys in sums.keys():
+            # make default normalization
             self.normalization[sys] = {}
             self.normalization[sys][0] = (1,0)
-        # make collection of event indices per number of jets
-        jets_shape = ak.num(jets).to_numpy()
-        njets_set = sorted(list(set(jets_shape)))
-        njets_inds = {}
-        for njets in njets_set:
-            njets_inds[njets] = np.nonzero(jets_shape==njets)
-        # loop over systematics
-        for sys in systematics:
-            # get event weights for this systematic
-            weights = self.get_event_weights(jets, sys)
             # determine average weight per number of jets
-            for njets in njets_set:
-                thisweights = weights[njets_inds[njets]]
-                self.normalization[sys][njets] = (np.mean(thisweights),len(thisweights))
+            for njets in sorted(sums[sys].keys()):
+                (sumw, nevents) = sums[sys][njets]
+                self.normalization[sys][njets] = (sumw/nevents, nevents)
+        self.set_normalization_lookup()
+
+    def set_normalization(self, jets, unctypes=None):
+        ### set the normalization (average event weight per number of jets)
+        # input arguments:
+        # - jets: a jet collection, e.g. events.Jet[jet_mask]
+        # - unctypes: list of unctypes to normalize (or 'all'); central is always included.
+        sums = self.get_normalization_sums(jets, unctypes=unctypes)
+        self.set_normalization_from_sums(sums)
+
+    def get_normalization_dict(self):
+        ### get the normalization in a json-serializable format
+        # (i.e. with str keys for the number of jets and lists instead of tuples)
+        if self.normalization is None:
+            raise Exception('ERROR: requested normalization, but reweighter was not normalized.')
+        res = {}
+        for sys in self.normalization.keys():
+            res[sys] = {}
+            for njets, (norm, nevents) in self.normalization[sys].items():
+                res[sys][str(njets)] = [float(norm), int(nevents)]
+        return res
+
+    def set_normalization_from_dict(self, normdict):
+        ### set the normalization from a dict as returned by get_normalization_dict
+        self.normalization = {}
+        for sys in normdict.keys():
+            self.normalization[sys] = {}
+            for njets in sorted(normdict[sys].keys(), key=int):
+                (norm, nevents) = normdict[sys][njets]
+                self.normalization[sys][int(njets)] = (norm, nevents)
+        self.set_normalization_lookup()
+
+    def save_normalization(self, cachefile, samplename, year):
+        ### add the current normalization for a given sample and year to a cache file
+        # note: if the cache file already exists, the entries for other samples are kept,
+        #       while an existing entry for this sample and year is overwritten.
+        cache = read_normalization_cache(cachefile)
+        if year not in cache.keys(): cache[year] = {}
+        cache[year][samplename] = self.get_normalization_dict()
+        write_normalization_cache(cachefile, cache)
+
+    def load_normalization(self, cachefile, samplename, year, unctypes=None):
+        ### set the normalization for a given sample and year from a cache file
+        # input arguments:
+        # - cachefile: path to a normalization cache file (see read_normalization_cache)
+        # - samplename: name of the sample (see normalization_sample_name)
+        # - year: data taking year of the sample
+        # - unctypes: list of unctypes (or 'all') that must be present in the cache
+        if not os.path.exists(cachefile):
+            raise Exception('ERROR: b-tag normalization file {} does not exist.'.format(cachefile))
+        cache = read_normalization_cache(cachefile)
+        if( year not in cache.keys() or samplename not in cache[year].keys() ):
+            msg = 'ERROR: b-tag normalization file {}'.format(cachefile)
+            msg += ' has no entry for sample {} ({}).'.format(samplename, year)
+            raise Exception(msg)
+        normdict = cache[year][samplename]
+        for sys in self.get_normalization_systematics(unctypes=unctypes):
+            if sys not in normdict.keys():
+                msg = 'ERROR: b-tag normalization file {}'.format(cachefile)
+                msg += ' has no normalization for systematic {}'.format(sys)
+                msg += ' for sample {} ({}).'.format(samplename, year)
+                raise Exception(msg)
+        self.set_normalization_from_dict(normdict)
+
+    def set_normalization_lookup(self):
+        ### internal helper function: convert the normalization to dense lookup arrays
+        # for each systematic, the lookup array holds at index i the normalization factor
+        # for events with i jets, i.e. the one for the largest njets key <= i;
+        # events with more jets than the last index use the last index.
+        self.normalization_lookup = {}
+        for sys in self.normalization.keys():
+            njetkeys = sorted(self.normalization[sys].keys())
+            lookup = np.ones(njetkeys[-1]+1)
+            for njets in njetkeys:
+                lookup[njets:] = self.normalization[sys][njets][0]
+            self.normalization_lookup[sys] = lookup
 
     def normalizeweights(self, weights, njets, systematic):
         if self.normalization is None:
             raise Exception('ERROR: requested normalization, but reweighter was not normalized.')
         if systematic not in self.normalization.keys():
             raise Exception('ERROR: normalization not set for systematic {}'.format(systematic))
-        normfactors = np.zeros(len(weights))
-        njetkeys = np.array(list(self.normalization[systematic].keys()))
-        njetkeys_reverse = njetkeys[::-1]
-        for i, njet in enumerate(njets):
-            njetkey = next(key for key in njetkeys_reverse if key<=njet)
-            normfactors[i] = self.normalization[systematic][njetkey][0]
+        lookup = self.normalization_lookup[systematic]
+        normfactors = lookup[np.minimum(np.asarray(njets), len(lookup)-1)]
         return np.divide(weights, normfactors)
 
     def __str__(self):
@@ -15,6 +15,8 @@ class CombinedReweighter(object):
 
     def __init__(self):
         self.reweighters = {}
+        self.reweighter_args = {}
+        self.context = None
 
     # checking presence of reweighters
 
@@ -43,10 +45,15 @@ class CombinedReweighter(object):
             msg += ' does not seem to inherit from AbstractReweighter.'
             raise Exception(msg)
         self.reweighters[name] = reweighter
+        self.reweighter_args[name] = self.resolve_kwargs(reweighter.weights)
 
     def remove_reweighter(self, name):
         self.error_if_not_has_reweighter(name)
         _ = self.reweighters.pop(name)
+        _ = self.reweighter_args.pop(name)
+        if self.context is not None:
+            for key in [key for key in self.context['weights'].keys() if key[0]==name]:
+                _ = self.context['weights'].pop(key)
 
     # getting reweighters and uncertainties
 
@@ -89,81 +96,160 @@ class CombinedReweighter(object):
             args[name] = list(inspect.signature(reweighter.weights).parameters.keys())
         return args
 
-    def select_kwargs(self, f, kwargs):
+    def resolve_kwargs(self, f):
         ### internal helper function
         # find allowed arguments for function f
+        # returns None if f can take any kwargs, else a set of allowed argument names
+        # note: this is evaluated only once per reweighter (in add_reweighter),
+        #       since inspect.signature is too slow to call for every weight evaluation.
         f_args = inspect.signature(f).parameters.keys()
+        if 'kwargs' in f_args: return None
+        return frozenset(f_args)
+
+    def select_kwargs(self, f, kwargs):
+        ### internal helper function
+        # find allowed arguments for function f
+        # note: for reweighters in this combined reweighter,
+        #       use the faster select_reweighter_kwargs instead.
+        f_args = self.resolve_kwargs(f)
         # if f can take any kwargs, return all kwargs
-        if 'kwargs' in f_args: return kwargs
+        if f_args is None: return kwargs
         # else select only allowed arguments
         return {key: val for key, val in kwargs.items() if key in f_args}
 
+    def select_reweighter_kwargs(self, name, kwargs):
+        ### internal helper function
+        # select allowed arguments for the reweighter with given name,
+        # using the allowed arguments resolved in add_reweighter
+        f_args = self.reweighter_args[name]
+        if f_args is None: return kwargs
+        return {key: val for key, val in kwargs.items() if key in f_args}
+
+    # evaluation context
+
+    def get_reweighters_independent_of(self, argnames):
+        ### get the names of reweighters that do not take any of the given keyword arguments
+        # input arguments:
+        # - argnames: list of keyword argument names (e.g. ['jet_mask', 'bjet_mask'])
+        # note: reweighters that take arbitrary kwargs are considered dependent.
+        res = []
+        for name, f_args in self.reweighter_args.items():
+            if f_args is None: continue
+            if len(f_args.intersection(argnames))>0: continue
+            res.append(name)
+        return res
+
+    def set_context(self, events, keep=None, **kwargs):
+        ### set the evaluation context in which per-reweighter weights are cached
+        # input arguments:
+        # - events and **kwargs: the events and keyword arguments (e.g. object masks)
+        #   for which the weights of subsequent calls should be cached.
+        # - keep: list of reweighter names for which the weights cached in the previous context
+        #   are still valid in the new one, e.g. reweighters that do not depend on the jets
+        #   when only the jets are varied (see get_reweighters_independent_of).
+        #   their cached weights are carried over to the new context,
+        #   provided the keyword arguments they take are the same objects.
+        #   the events may be a different object (e.g. a view with varied jets, see jetuncs),
+        #   it is up to the caller to make sure the kept reweighters are not affected.
+        # note: only calls with the same events and kwargs objects (compared by identity)
+        #       are looked up in or added to the cache, other calls are evaluated as usual.
+        # note: any previous context (and its cache, except for the reweighters in keep)
+        #       is discarded, so this function must be called again whenever the masks change,
+        #       or the content of events changes without the events object itself changing
+        #       (e.g. when replacing events.Jet by JEC/JER-varied jets).
+        weights = {}
+        if( keep is not None and self.context is not None ):
+            for name in keep:
+                thiskwargs = self.select_reweighter_kwargs(name, kwargs)
+                prevkwargs = self.select_reweighter_kwargs(name, self.context['kwargs'])
+                if set(thiskwargs.keys())!=set(prevkwargs.keys()): continue
+                if any(val is not prevkwargs[key] for key, val in thiskwargs.items()): continue
+                for key, val in self.context['weights'].items():
+                    if key[0]==name: weights[key] = val
+        self.context = {'events': events, 'kwargs': kwargs, 'weights': weights}
+
+    def clear_context(self):
+        ### discard the evaluation context and its cache
+        self.context = None
+
+    def in_context(self, events, kwargs):
+        ### internal helper function: check if events and kwargs match the evaluation context
+        if self.context is None: return False
+        if events is not self.context['events']: return False
+        if set(kwargs.keys())!=set(self.context['kwargs'].keys()): return False
+        for key, val in kwargs.items():
+            if val is not self.context['kwargs'][key]: return False
+        return True
+
+    def evaluate(self, events, reweightername, wtype, unctype=None, variation=None, **kwargs):
+        ### internal helper function: get per-event weights for a single reweighter
+        # input arguments:
+        # - wtype: choose from 'nominal', 'up', 'down' or 'var'
+        # - unctype: passed to weightsup or weightsdown
+        # - variation: passed to weightsvar
+        # note: the returned array is shared with the cache and should not be modified in place.
+        key = (reweightername, wtype, unctype, variation)
+        incontext = self.in_context(events, kwargs)
+        if( incontext and key in self.context['weights'] ): return self.context['weights'][key]
+        reweighter = self.reweighters[reweightername]
+        thiskwargs = self.select_reweighter_kwargs(reweightername, kwargs)
+        if wtype=='nominal': weights = reweighter.weights(events, **thiskwargs)
+        elif wtype=='up': weights = reweighter.weightsup(events, unctype=unctype, **thiskwargs)
+        elif wtype=='down': weights = reweighter.weightsdown(events, unctype=unctype, **thiskwargs)
+        elif wtype=='var': weights = reweighter.weightsvar(events, variation, **thiskwargs)
+        else:
+            msg = 'ERROR: wtype {} not recognized'.format(wtype)
+            raise Exception(msg)
+        weights = np.array(weights)
+        if incontext: self.context['weights'][key] = weights
+        return weights
+
     # getting nominal and varied weights
 
-    def weights(self, events, **kwargs):
-        ### get total nominal per-event weights
+    def totalweights(self, events, reweightername, wtype, unctype=None, variation=None, **kwargs):
+        ### internal helper function: get total per-event weights with one reweighter varied
         weights = np.ones(len(events))
-        for name, reweighter in self.reweighters.items():
-            thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-            weights = np.multiply(weights, reweighter.weights(events, **thiskwargs))
+        for name in self.reweighters.keys():
+            if name==reweightername:
+                weights = np.multiply(weights, self.evaluate(events, name, wtype,
+                            unctype=unctype, variation=variation, **kwargs))
+            else: weights = np.multiply(weights, self.evaluate(events, name, 'nominal', **kwargs))
         return np.array(weights)
 
+    def weights(self, events, **kwargs):
+        ### get total nominal per-event weights
+        return self.totalweights(events, None, 'nominal', **kwargs)
+
     def weightsup(self, events, reweightername, unctype=None, **kwargs):
         ### get total per-event weights with one reweighter varied up
-        weights = np.ones(len(events))
-        for name, reweighter in self.reweighters.items():
-            thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-            if name==reweightername:
-              weights = np.multiply(weights, reweighter.weightsup(events, unctype=unctype, **thiskwargs))
-            else: weights = np.multiply(weights, reweighter.weights(events, **thiskwargs))
-        return np.array(weights)
+        return self.totalweights(events, reweightername, 'up', unctype=unctype, **kwargs)
 
     def weightsdown(self, events, reweightername, unctype=None, **kwargs):
         ### get total per-event weights with one reweighter varied down
-        weights = np.ones(len(events))
-        for name, reweighter in self.reweighters.items():
-            thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-            if name==reweightername:
-                weights = np.multiply(weights, reweighter.weightsdown(events, unctype=unctype, **thiskwargs))
-            else: weights = np.multiply(weights, reweighter.weights(events, **thiskwargs))
-        return np.array(weights)
+        return self.totalweights(events, reweightername, 'down', unctype=unctype, **kwargs)
 
     def weightsvar(self, events, reweightername, variation, **kwargs):
         ### get total per-event weights with one reweighter varied
-        weights = np.ones(len(events))
-        for name, reweighter in self.reweighters.items():
-            thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-            if name==reweightername:
-              weights = np.multiply(weights, reweighter.weightsvar(events, variation, **thiskwargs))
-            else: weights = np.multiply(weights, reweighter.weights(events, **thiskwargs))
-        return np.array(weights)
+        return self.totalweights(events, reweightername, 'var', variation=variation, **kwargs)
 
     def singleweights(self, events, reweightername, **kwargs):
         ### get nominal per-event weights for a single reweighter
-        reweighter = self.reweighters[reweightername]
-        thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-        weights = reweighter.weights(events, **thiskwargs)
+        weights = self.evaluate(events, reweightername, 'nominal', **kwargs)
         return np.array(weights)
 
     def singleweightsup(self, events, reweightername, unctype=None, **kwargs):
         ### get per-event weights for a single reweighter varied up
-        reweighter = self.reweighters[reweightername]
-        thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-        weights = reweighter.weightsup(events, unctype=unctype, **thiskwargs)
+        weights = self.evaluate(events, reweightername, 'up', unctype=unctype, **kwargs)
         return np.array(weights)
 
     def singleweightsdown(self, events, reweightername, unctype=None, **kwargs):
         ### get per-event weights for a single reweighter varied down
-        reweighter = self.reweighters[reweightername]
-        thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-        weights = reweighter.weightsdown(events, unctype=unctype, **thiskwargs)
+        weights = self.evaluate(events, reweightername, 'down', unctype=unctype, **kwargs)
         return np.array(weights)
 
     def singleweightsvar(self, events, reweightername, variation, **kwargs):
         ### get per-event weights for a single reweighter varied
-        reweighter = self.reweighters[reweightername]
-        thiskwargs = self.select_kwargs(reweighter.weights, kwargs)
-        weights = reweighter.weightsvar(events, variation, **thiskwargs)
+        weights = self.evaluate(events, reweightername, 'var', variation=variation, **kwargs)
         return np.array(weights)
 
     # convenience function for getting nominal weights and all variations
@@ -189,6 +275,18 @@ class CombinedReweighter(object):
         if wtype not in ['total', 'individual']:
             msg = 'ERROR: wtype {} not recognized'.format(wtype)
             raise Exception(msg)
+        # enable caching in the individual reweighters
+        # (events and kwargs are the same for all evaluations below)
+        for reweighter in self.reweighters.values(): reweighter.enable_cache()
+        try: res = self.allweights_cached(events, res, variations,
+                 reweighternames=reweighternames, wtype=wtype, verbose=verbose, **kwargs)
+        finally:
+            for reweighter in self.reweighters.values(): reweighter.clear_cache()
+        return res
+
+    def allweights_cached(self, events, res, variations,
+        reweighternames=None, wtype='total', verbose=False, **kwargs):
+        ### internal helper function for allweights
         if verbose: print('Calculating nominal weights'); sys.stdout.flush()
         res['nominal'] = self.weights(events, **kwargs)
         if verbose: print('Calculating weights for sytematic variations'); sys.stdout.flush()
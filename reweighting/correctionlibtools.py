@@ -0,0 +1,74 @@
+############################################################
+# Tools for vectorized evaluation of correctionlib objects #
+############################################################
+# The low-level correctionlib bindings (correctionlib._core) only accept
+# python scalars in Correction.evaluate, which is why passing flattened arrays
+# to evaluate does not work.
+# Whole arrays must instead be passed to Correction.evalv,
+# with numerical inputs cast to the dtype that matches the declared input type
+# ('real' -> float64, 'int' -> int32), as C-contiguous numpy arrays.
+# String inputs (e.g. systematic names) are passed as scalars.
+# Jagged (awkward) inputs are flattened before evaluation
+# and the result is unflattened to the original structure afterwards.
+
+
+import sys
+import os
+import numpy as np
+import awkward as ak
+
+
+def cast_input(value, inputtype):
+    ### internal helper function: cast a single input to the type expected by correctionlib
+    # input arguments:
+    # - value: scalar, numpy array or flat awkward array
+    # - inputtype: declared type of the correction input ('real', 'int' or 'string')
+    if inputtype=='string': return value
+    if isinstance(value, (str, bytes)):
+        msg = 'ERROR: got string input {} for correctionlib input'.format(value)
+        msg += ' of type {}.'.format(inputtype)
+        raise Exception(msg)
+    dtype = np.float64 if inputtype=='real' else np.int32
+    if np.ndim(value)==0: return dtype(value).item()
+    return np.ascontiguousarray(ak.to_numpy(value), dtype=dtype)
+
+def evaluate_flat(correction, *args):
+    ### evaluate a correction on flat arrays in a single call
+    # input arguments:
+    # - correction: correctionlib correction object,
+    #   e.g. CorrectionSet.from_file(sffile)[jsonmap]
+    # - args: inputs to the correction, in the order defined by the correction;
+    #   numerical inputs can be scalars or flat arrays (numpy or awkward),
+    #   all arrays must have the same length.
+    # returns: a numpy array of type float64 (or a float if all inputs are scalars)
+    inputtypes = [inp.type for inp in correction.inputs]
+    if len(args)!=len(inputtypes):
+        msg = 'ERROR: correction {} takes {} inputs'.format(correction.name, len(inputtypes))
+        msg += ' but got {}.'.format(len(args))
+        raise Exception(msg)
+    args = [cast_input(arg, inputtype) for arg, inputtype in zip(args, inputtypes)]
+    if not any(isinstance(arg, np.ndarray) for arg in args):
+        return correction.evaluate(*args)
+    return np.asarray(correction.evalv(*args), dtype=np.float64)
+
+def evaluate_jagged(correction, *args):
+    ### evaluate a correction on jagged arrays in a single call
+    # input arguments:
+    # - correction: see evaluate_flat
+    # - args: inputs to the correction, in the order defined by the correction;
+    #   numerical inputs can be scalars or jagged awkward arrays
+    #   with one level of nesting (e.g. events.Jet.pt);
+    #   all jagged arrays must have the same structure.
+    # returns: a jagged awkward array with the same structure as the inputs
+    counts = None
+    flatargs = []
+    for arg in args:
+        if isinstance(arg, ak.Array):
+            if counts is None: counts = ak.num(arg, axis=1)
+            arg = ak.flatten(arg, axis=1)
+        flatargs.append(arg)
+    if counts is None:
+        msg = 'ERROR: evaluate_jagged called without any jagged input array.'
+        raise Exception(msg)
+    weights = evaluate_flat(correction, *flatargs)
+    return ak.unflatten(weights, counts)
@@ -15,6 +15,7 @@ from correctionlib._core import CorrectionSet
 from pathlib import Path
 sys.path.append(Path(__file__).parents[1])
 from reweighting.abstractreweighter import AbstractReweighter
+from reweighting.correctionlibtools import evaluate_jagged
 
 
 class ElectronRecoReweighter(AbstractReweighter):
@@ -44,23 +45,12 @@ class ElectronRecoReweighter(AbstractReweighter):
         ### internal helper function
         # note: valuetype must a valid weight type specifier in EGamma convention,
         #       i.e. 'sf' for nominal, 'sfup' or 'sfdown'
-        # note: correctionlib does not seem to handle jagged arrays,
-        #       so need to flatten and unflatten as intermediary steps
-        # note: also flattened arrays do not seem to work, not clear why...
-        #       use a for-loop for now...
+        # note: evaluated in one vectorized call per pt bin, see correctionlibtools.
         weights = np.ones(len(electrons))
         for ptbin in ['RecoBelow20', 'RecoAbove20']:
             electrons_ptbin = self.get_electrons_ptbin(electrons, ptbin)
-            electrons_flat, electrons_shape = ak.flatten(electrons_ptbin), ak.num(electrons_ptbin)
-            electrons_pt = np.array(electrons_flat.pt).astype(float)
-            electrons_eta = np.array(electrons_flat.eta).astype(float)
-            thisweights = np.zeros(len(electrons_pt))
-            for i in range(len(electrons_pt)):
-                thisweights[i] = self.evaluator[self.jsonmap].evaluate(
-                  self.year, valuetype, ptbin, float(electrons_eta[i]), float(electrons_pt[i]))
-            #thisweights = self.evaluator[self.jsonmap].evaluate(
-            #      self.year, valuetype, ptbin, electrons_eta, electrons_pt)
-            thisweights = ak.unflatten(thisweights, electrons_shape)
+            thisweights = evaluate_jagged(self.evaluator[self.jsonmap],
+              self.year, valuetype, ptbin, electrons_ptbin.eta, electrons_ptbin.pt)
             thisweights = ak.prod(thisweights, axis=1)
             weights = np.multiply(weights, thisweights)
         return weights
@@ -13,6 +13,7 @@ from correctionlib._core import CorrectionSet
 from pathlib import Path
 sys.path.append(Path(__file__).parents[1])
 from reweighting.abstractreweighter import AbstractReweighter
+from reweighting.correctionlibtools import evaluate_flat
 
 
 class PileupReweighter(AbstractReweighter):
@@ -31,15 +32,9 @@ class PileupReweighter(AbstractReweighter):
     
     def get_weights(self, events, systematic):
         ### internal helper function
-        # note: correctionlib does not seem to handle jagged arrays,
-        #       so need to flatten and unflatten as intermediary steps
-        # note: also flattened arrays do not seem to work, not clear why...
-        #       use a for-loop for now...
+        # note: evaluated in one vectorized call, see correctionlibtools.
         ntrueint = events.Pileup.nTrueInt
-        weights = np.ones(len(ntrueint))
-        for idx in range(len(ntrueint)):
-            weights[idx] = self.evaluator[self.jsonmap].evaluate(ntrueint[idx], systematic)
-        return weights
+        return evaluate_flat(self.evaluator[self.jsonmap], ntrueint, systematic)
 
     def weights(self, events):
         ### get nominal per-event weights
@@ -0,0 +1,90 @@
+##############################################################
+# Benchmark keyword argument routing in combined reweighter #
+##############################################################
+# Compare the overhead of selecting the keyword arguments for each reweighter
+# with inspect.signature on every call (old approach)
+# to the lookup table resolved once in add_reweighter (current approach),
+# for the call pattern of one CombinedReweighter.allweights call
+# with the full run-II UL reweighter configuration.
+# Note: only the argument routing is timed, the weights themselves are not evaluated.
+
+# imports
+import sys
+import os
+import time
+import inspect
+import argparse
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[3]))
+from samples.sample import year_from_sample_name
+from samples.sampleweights import SampleWeights
+from reweighting.implementation.run2ulreweighter import get_run2ul_reweighter
+
+
+def select_kwargs_inspect(f, kwargs):
+    ### old approach: inspect the signature on every call
+    f_args = inspect.signature(f).parameters.keys()
+    if 'kwargs' in f_args: return kwargs
+    return {key: val for key, val in kwargs.items() if key in f_args}
+
+def allweights_call_pattern(reweighter):
+    ### get the sequence of reweighter names for which kwargs are routed in allweights
+    # (once per reweighter for the total nominal weights,
+    #  once per reweighter for the single nominal weights,
+    #  and once per variation of each reweighter)
+    names = list(reweighter.reweighters.keys())
+    variations = reweighter.get_variations()
+    pattern = list(names)
+    for name in names: pattern += [name]*(1+len(variations[name]))
+    return pattern
+
+
+# input arguments:
+parser = argparse.ArgumentParser(description='Benchmark kwargs routing in combined reweighter')
+parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+parser.add_argument('-r', '--repeat', type=int, default=100)
+args = parser.parse_args()
+
+# print arguments
+print('Running with following configuration:')
+for arg in vars(args):
+    print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+# make combined reweighter
+year = year_from_sample_name(args.inputfile)
+sampleweights = SampleWeights(args.inputfile)
+reweighter = get_run2ul_reweighter(year, sampleweights)
+kwargs = ({
+  'electron_mask': None,
+  'muon_mask': None,
+  'jet_mask': None,
+  'bjet_mask': None
+})
+pattern = allweights_call_pattern(reweighter)
+print('Number of reweighters: {}'.format(len(reweighter.reweighters)))
+print('Number of kwargs selections per allweights call: {}'.format(len(pattern)))
+
+# old approach
+start_time = time.time()
+for _ in range(args.repeat):
+    for name in pattern:
+        _ = select_kwargs_inspect(reweighter.reweighters[name].weights, kwargs)
+time_inspect = (time.time() - start_time) / args.repeat
+
+# current approach
+start_time = time.time()
+for _ in range(args.repeat):
+    for name in pattern:
+        _ = reweighter.select_reweighter_kwargs(name, kwargs)
+time_table = (time.time() - start_time) / args.repeat
+
+# check consistency
+for name, rw in reweighter.reweighters.items():
+    if select_kwargs_inspect(rw.weights, kwargs)!=reweighter.select_reweighter_kwargs(name, kwargs):
+        raise Exception('ERROR: selected kwargs for reweighter {} differ.'.format(name))
+
+# print results
+print('Time per allweights call spent in kwargs routing:')
+print('  - inspect.signature per call: {:.3e} seconds'.format(time_inspect))
+print('  - precomputed lookup table: {:.3e} seconds'.format(time_table))
+print('  - speedup: {:.1f}x'.format(time_inspect/time_table))
@@ -0,0 +1,153 @@
+#######################################################################
+# Test vectorized correctionlib evaluation against per-object loops #
+#######################################################################
+# Regression test for reweighting/correctionlibtools.py:
+# the pileup, electron reco and b-tagging reweighters are evaluated
+# with the vectorized implementation and compared to a reference
+# per-event or per-object loop (the original implementation).
+
+# imports
+import sys
+import os
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+import awkward as ak
+from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
+sys.path.append(str(Path(__file__).parents[3]))
+from objectselection.electronselection import electronselection
+from objectselection.jetselection import jetselection
+from samples.sample import year_from_sample_name
+from reweighting.pileupreweighter import PileupReweighter
+from reweighting.electronrecoreweighter import ElectronRecoReweighter
+from reweighting.btagreweighter import BTagReweighter
+
+
+def pileup_weights_loop(reweighter, events, systematic):
+    ### reference implementation for PileupReweighter.get_weights
+    ntrueint = events.Pileup.nTrueInt
+    weights = np.ones(len(ntrueint))
+    for idx in range(len(ntrueint)):
+        weights[idx] = reweighter.evaluator[reweighter.jsonmap].evaluate(
+          float(ntrueint[idx]), systematic)
+    return weights
+
+def electronreco_weights_loop(reweighter, electrons, valuetype):
+    ### reference implementation for ElectronRecoReweighter.get_weights
+    weights = np.ones(len(electrons))
+    for ptbin in ['RecoBelow20', 'RecoAbove20']:
+        electrons_ptbin = reweighter.get_electrons_ptbin(electrons, ptbin)
+        electrons_flat, electrons_shape = ak.flatten(electrons_ptbin), ak.num(electrons_ptbin)
+        electrons_pt = np.array(electrons_flat.pt).astype(float)
+        electrons_eta = np.array(electrons_flat.eta).astype(float)
+        thisweights = np.zeros(len(electrons_pt))
+        for i in range(len(electrons_pt)):
+            thisweights[i] = reweighter.evaluator[reweighter.jsonmap].evaluate(
+              reweighter.year, valuetype, ptbin, float(electrons_eta[i]), float(electrons_pt[i]))
+        thisweights = ak.unflatten(thisweights, electrons_shape)
+        thisweights = ak.prod(thisweights, axis=1)
+        weights = np.multiply(weights, thisweights)
+    return weights
+
+def btag_jet_weights_loop(reweighter, jets, systematic):
+    ### reference implementation for BTagReweighter.get_jet_weights
+    jets_flat, jets_shape = ak.flatten(jets), ak.num(jets)
+    jets_pt = np.array(jets_flat.pt).astype(float)
+    jets_abseta = np.array(abs(jets_flat.eta)).astype(float)
+    jets_flavor = np.array(jets_flat.hadronFlavour).astype(int)
+    jets_discr = np.array(jets_flat.btagDeepFlavB).astype(float)
+    weights = np.ones(len(jets_flat))
+    unctype = systematic.replace('up_','').replace('down_','')
+    sysmask = np.ones(len(jets_flat), dtype=bool)
+    if unctype in reweighter.unctypes_cjets: sysmask = (jets_flavor==4)
+    elif unctype in reweighter.unctypes_udsgbjets:
+        sysmask = ((jets_flavor==0) | (jets_flavor==5))
+    for idx in range(len(jets_flat)):
+        thissystematic = systematic if sysmask[idx] else 'central'
+        weights[idx] = reweighter.evaluator[reweighter.jsonmap].evaluate(
+          thissystematic, int(jets_flavor[idx]), float(jets_abseta[idx]),
+          float(jets_pt[idx]), float(jets_discr[idx]))
+    return ak.unflatten(weights, jets_shape)
+
+def compare(name, reference, vectorized, reftime, vectime):
+    ### compare reference and vectorized weights and print the result
+    reference = np.asarray(ak.flatten(reference, axis=None))
+    vectorized = np.asarray(ak.flatten(vectorized, axis=None))
+    if len(reference)!=len(vectorized):
+        msg = 'ERROR: {}: length mismatch ({} vs {})'.format(name, len(reference), len(vectorized))
+        raise Exception(msg)
+    maxdiff = np.max(np.abs(reference-vectorized)) if len(reference)>0 else 0.
+    print('  - {}: {} values, max. abs. difference {}'.format(name, len(reference), maxdiff))
+    print('    loop: {:.3f} s, vectorized: {:.3f} s'.format(reftime, vectime))
+    if not np.array_equal(reference, vectorized):
+        msg = 'ERROR: {}: vectorized weights differ from reference.'.format(name)
+        raise Exception(msg)
+
+def timed(f, *args):
+    ### evaluate a function and return its output and the time it took
+    start_time = time.time()
+    res = f(*args)
+    return (res, time.time()-start_time)
+
+
+if __name__=='__main__':
+
+    # input arguments:
+    parser = argparse.ArgumentParser(description='Test vectorized correctionlib evaluation')
+    parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-b', '--btagsffile', default=None, type=os.path.abspath)
+    parser.add_argument('-n', '--nentries', type=int, default=-1)
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make NanoEvents array
+    print('Loading events from input file...')
+    year = year_from_sample_name(args.inputfile)
+    events = NanoEventsFactory.from_root(
+        args.inputfile,
+        entry_stop=args.nentries if args.nentries>=0 else None,
+        schemaclass=NanoAODSchema,
+        metadata={'year': year}
+    ).events()
+    print('Number of events in input file: {}'.format(ak.count(events.event)))
+    weightdir = os.path.join(Path(__file__).parents[2], 'data')
+
+    # pileup reweighter
+    print('Comparing pileup weights:')
+    sffile = os.path.join(weightdir, 'pileup', 'puWeights_{}.json'.format(year))
+    reweighter = PileupReweighter(sffile, year)
+    for systematic in ['nominal', 'up', 'down']:
+        (ref, reftime) = timed(pileup_weights_loop, reweighter, events, systematic)
+        (vec, vectime) = timed(reweighter.get_weights, events, systematic)
+        compare('pileup {}'.format(systematic), ref, vec, reftime, vectime)
+
+    # electron reco reweighter
+    print('Comparing electron reco weights:')
+    sffile = os.path.join(weightdir, 'electronreco', 'electronreco_sf_{}.json'.format(year))
+    reweighter = ElectronRecoReweighter(sffile, year)
+    electrons = events.Electron[electronselection(events.Electron, selectionid='run2ul_loose')]
+    for valuetype in ['sf', 'sfup', 'sfdown']:
+        (ref, reftime) = timed(electronreco_weights_loop, reweighter, electrons, valuetype)
+        (vec, vectime) = timed(reweighter.get_weights, electrons, valuetype)
+        compare('electronreco {}'.format(valuetype), ref, vec, reftime, vectime)
+
+    # b-tagging reweighter
+    if args.btagsffile is None:
+        print('No b-tagging scale factor file provided, skipping b-tagging weights.')
+    else:
+        print('Comparing b-tagging weights:')
+        reweighter = BTagReweighter(args.btagsffile)
+        jets = events.Jet[jetselection(events.Jet, selectionid='run2ul_default')]
+        systematics = ['central'] + ['up_'+unc for unc in reweighter.unctypes]
+        systematics += ['down_'+unc for unc in reweighter.unctypes]
+        for systematic in systematics:
+            (ref, reftime) = timed(btag_jet_weights_loop, reweighter, jets, systematic)
+            (vec, vectime) = timed(reweighter.get_jet_weights, jets, systematic)
+            compare('btagging {}'.format(systematic), ref, vec, reftime, vectime)
+
+    print('All vectorized weights agree with the reference implementation.')
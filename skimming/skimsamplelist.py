@@ -9,6 +9,7 @@ from pathlib import Path
 
 sys.path.append(str(Path(__file__).parents[1]))
 import jobsubmission.condortools as ct
+import jobsubmission.localtools as lt
 from jobsubmission.jobsettings import CMSSW_VERSION
 import tools.argparsetools as apt
 from samples.samplelisttools import readsamplelist
@@ -35,6 +36,9 @@ parser.add_argument('--proxy', default=None, type=apt.path_or_none)
 parser.add_argument('--max_files_per_sample', default=-1, type=int)
 parser.add_argument('--readmode', default='remote', choices=['remote','copy'])
 parser.add_argument('--runmode', default='condor', choices=['condor','local'])
+parser.add_argument('--nworkers', default=None, type=int)
+parser.add_argument('--maxmem', default=None, type=int)
+parser.add_argument('--retries', default=0, type=int)
 args = parser.parse_args()
 
 # print arguments
@@ -120,6 +124,7 @@ for sample_name in sample_names:
 # loop over samples and submit skimming jobs
 print('Starting submission...')
 cwd = os.getcwd()
+localcommands = []
 itlist = zip(sample_names, sample_output_directories)
 for sample_name, sample_output_directory in itlist:
     print('Now processing the following sample:')
@@ -159,11 +164,15 @@ for sample_name, sample_output_directory in itlist:
                 thiscommands.append(skimcommand)
                 thiscommands.append('rm -f {}'.format(output_file_unskimmed))
             for c in thiscommands: commands.append(c)
-        # run in local
-        if( args.runmode=='local' ):
-            for cmd in commands: os.system(cmd)
+        # run in local (after the loop, all chunks in parallel)
+        if( args.runmode=='local' ): localcommands.append(commands)
         # submission via condor
         if( args.runmode=='condor' ): 
             ct.submitCommandsAsCondorJob( 
               'cjob_skimsamplelist', commands,
               cmssw_version=CMSSW_VERSION, proxy=args.proxy )
+
+# run the local jobs
+if( args.runmode=='local' ):
+    lt.runCommandSetsLocally( 'cjob_skimsamplelist', localcommands,
+      nworkers=args.nworkers, mem=args.maxmem, retries=args.retries )
@@ -26,6 +26,82 @@ from samples.sample import year_from_sample_name
 from samples.sample import dtype_from_sample_name
 import tools.argparsetools as apt
 from tools.variabletools import read_variables
+import tools.histtools as ht
+
+
+def get_branches_to_read(tree, variables, dtype, selectiontype,
+      selection_variation, variations, weight_vartonom):
+  ### get the names of the branches in a tree that are needed for binning
+  # input arguments:
+  # - tree: uproot tree
+  # - variables: list of HistogramVariables
+  # - dtype: 'sim' or 'data'
+  # - selectiontype: selection type of the tree (e.g. 'tight', 'fakerate', etc.)
+  # - selection_variation: selection systematic of the tree (e.g. 'nominal')
+  # - variations: list of weight variations to evaluate on this tree
+  # - weight_vartonom: dict matching weight variations to their individual reweighter
+  # returns: list of branch names present in the tree
+  #          (missing variables are skipped here and warned about when filling)
+  branches = [variable.variable for variable in variables]
+  if dtype=='sim':
+    branches.append('genNormWeight')
+    branches.append('reweight_nominal')
+    if selection_variation=='nominal':
+      for variation in variations:
+        if variation=='nominal': continue
+        branches.append('reweight_{}'.format(variation))
+        branches.append('reweight_{}_nom'.format(weight_vartonom[variation]))
+  if selectiontype in ['fakerate', 'efakerate', 'mfakerate']: branches.append('fakeRateWeight')
+  if selectiontype=='chargeflips': branches.append('chargeFlipWeight')
+  treebranches = tree.keys()
+  return sorted(set([branch for branch in branches if branch in treebranches]))
+
+def get_field_sizes(ntuple):
+  ### get the number of compressed and uncompressed bytes per field in an RNTuple
+  # (note: the output of eventloop.py is written as RNTuple by recent uproot versions,
+  #        which do not have the per-branch byte counts of a TTree)
+  # returns: a dict matching top-level field names to tuples (compressed, uncompressed)
+  fields = ntuple.field_records
+  def toplevel(field_id):
+    # (top-level fields are their own parent)
+    while fields[field_id].parent_field_id!=field_id:
+      field_id = fields[field_id].parent_field_id
+    return fields[field_id].field_name
+  sizes = {}
+  for column in ntuple.column_records:
+    compressed = 0
+    nelements = 0
+    for cluster in ntuple.page_link_list:
+      if column.idx>=len(cluster) or cluster[column.idx].suppressed: continue
+      for page in cluster[column.idx].pages:
+        compressed += page.locator.num_bytes
+        nelements += abs(page.num_elements)
+    uncompressed = (nelements * column.nbits + 7) // 8
+    name = toplevel(column.field_id)
+    previous = sizes.get(name, (0, 0))
+    sizes[name] = (previous[0] + compressed, previous[1] + uncompressed)
+  return sizes
+
+def get_io_profile(tree, branches):
+  ### get the number of compressed and uncompressed bytes in a tree
+  # input arguments:
+  # - tree: uproot TTree or RNTuple
+  # - branches: names of the branches (or fields) that are read
+  # returns: a dict with compressed and uncompressed bytes
+  #          for the given branches and for all branches in the tree
+  res = {'read_compressed': 0, 'read_uncompressed': 0,
+         'total_compressed': 0, 'total_uncompressed': 0}
+  if isinstance(tree, uproot.behaviors.RNTuple.RNTuple): sizes = get_field_sizes(tree)
+  else:
+    sizes = {branch: (tree[branch].compressed_bytes, tree[branch].uncompressed_bytes)
+             for branch in tree.keys()}
+  for branch, (compressed, uncompressed) in sizes.items():
+    res['total_compressed'] += compressed
+    res['total_uncompressed'] += uncompressed
+    if branch in branches:
+      res['read_compressed'] += compressed
+      res['read_uncompressed'] += uncompressed
+  return res
 
 
 if __name__=='__main__':
@@ -45,6 +121,7 @@ if __name__=='__main__':
   parser.add_argument('--lumi', default=1, type=float)
   parser.add_argument('--process', default=None)
   parser.add_argument('--split', default=False, action='store_true')
+  parser.add_argument('--profile-io', default=False, action='store_true')
   args = parser.parse_args()
 
   # print arguments
@@ -131,70 +208,93 @@ if __name__=='__main__':
             else: variations = ['nominal']
           for variation in variations:
             hists[eventselection][selectiontype][variation] = []
-            print('Now running on {} / {} / {}'.format(
-              eventselection, selectiontype, variation))
+          print('Now running on {} / {} / {} ({} variations)'.format(
+            eventselection, selectiontype, selection_variation, len(variations)))
             
-            # read the tree
-            events = inputfile[eventselection][selectiontype][selection_variation]['Events']
-            nevents = events.num_entries
-            print('Found tree with {} entries.'.format(nevents))
-            # convert to group of arrays
-            events = events.arrays(library='np')
+          # read the tree
+          # note: the tree is read only once for all weight variations
+          # note: only the branches needed for the variables and weights are read
+          events = inputfile[eventselection][selectiontype][selection_variation]['Events']
+          nevents = events.num_entries
+          print('Found tree with {} entries.'.format(nevents))
+          branches = get_branches_to_read(events, variables, dtype, selectiontype,
+            selection_variation, variations, weight_vartonom)
+          if args.profile_io:
+            profile = get_io_profile(events, branches)
+            print('I/O profile: reading {} out of {} branches'.format(
+              len(branches), len(events.keys())))
+            print('  - decompressed bytes: {} (all branches: {})'.format(
+              profile['read_uncompressed'], profile['total_uncompressed']))
+            print('  - compressed bytes: {} (all branches: {})'.format(
+              profile['read_compressed'], profile['total_compressed']))
+          # convert to group of arrays
+          events = events.arrays(filter_name=branches, library='np')
             
-            # calculate correct event weights (before reweighting)
-            if dtype=='data': weights = np.ones(nevents)
-            else: weights = events['genNormWeight'] * args.xsec * args.lumi
-            if( selectiontype=='fakerate' 
-              or selectiontype=='efakerate' 
-              or selectiontype=='mfakerate' ):
-              frweights = events['fakeRateWeight']
-              if dtype=='sim': frweights = -frweights
-              weights = np.multiply(weights, frweights)
-            if selectiontype=='chargeflips':
-              cfweights = events['chargeFlipWeight']
-              if dtype=='sim': cfweights = np.zeros(nevents)
-              weights = np.multiply(weights, cfweights)
+          # calculate correct event weights (before reweighting)
+          if dtype=='data': weights = np.ones(nevents)
+          else: weights = events['genNormWeight'] * args.xsec * args.lumi
+          if( selectiontype=='fakerate' 
+            or selectiontype=='efakerate' 
+            or selectiontype=='mfakerate' ):
+            frweights = events['fakeRateWeight']
+            if dtype=='sim': frweights = -frweights
+            weights = np.multiply(weights, frweights)
+          if selectiontype=='chargeflips':
+            cfweights = events['chargeFlipWeight']
+            if dtype=='sim': cfweights = np.zeros(nevents)
+            weights = np.multiply(weights, cfweights)
             
-            # modify event weights with reweighting factor
-            # note: the reweighting factors in the nominal tree
-            #       are individual reweighting factors,
-            #       so some extra arithmetic is needed to calculate the total weight
+          # make a matrix of event weights for all variations
+          # (shape: number of events x number of variations)
+          # note: the reweighting factors in the nominal tree
+          #       are individual reweighting factors,
+          #       so some extra arithmetic is needed to calculate the total weight
+          weightmatrix = np.zeros((nevents, len(variations)))
+          nomweights_withoutsingle = {}
+          for i, variation in enumerate(variations):
             if dtype=='sim':
               nomweights = events['reweight_nominal']
               reweight = nomweights # default case: just use nominal weights
               if( selection_variation=='nominal' ):
                 if( variation!='nominal' ):
-                  nomweights_single = events['reweight_{}_nom'.format(weight_vartonom[variation])]
-                  nomweights_withoutsingle = np.divide( nomweights, nomweights_single )
-                  reweight = np.multiply(nomweights_withoutsingle, events['reweight_{}'.format(variation)])
-              weights = np.multiply(weights, reweight)
+                  single = weight_vartonom[variation]
+                  if single not in nomweights_withoutsingle.keys():
+                    nomweights_single = events['reweight_{}_nom'.format(single)]
+                    nomweights_withoutsingle[single] = np.divide( nomweights, nomweights_single )
+                  reweight = np.multiply(nomweights_withoutsingle[single], events['reweight_{}'.format(variation)])
+              weightmatrix[:,i] = np.multiply(weights, reweight)
+            else: weightmatrix[:,i] = weights
             
-            # modify process name if needed
-            thisprocess = args.process
-            if thisprocess is not None:
-              if selectiontype=='fakerate': thisprocess = 'Nonprompt'
-              if selectiontype=='efakerate': thisprocess = 'NonpromptE'
-              if selectiontype=='mfakerate': thisprocess = 'NonpromptMu'
-              if selectiontype=='chargeflips': thisprocess = 'Chargeflips'
+          # modify process name if needed
+          thisprocess = args.process
+          if thisprocess is not None:
+            if selectiontype=='fakerate': thisprocess = 'Nonprompt'
+            if selectiontype=='efakerate': thisprocess = 'NonpromptE'
+            if selectiontype=='mfakerate': thisprocess = 'NonpromptMu'
+            if selectiontype=='chargeflips': thisprocess = 'Chargeflips'
             
-            # loop over variables
-            for variable in variables:
-              if variable.variable not in events.keys():
-                msg = 'WARNING: variable {} not found in input tree, skipping...'.format(variable.variable)
-                print(msg)
-                continue
-              # initialize a histogram
+          # loop over variables
+          for variable in variables:
+            if variable.variable not in events.keys():
+              msg = 'WARNING: variable {} not found in input tree, skipping...'.format(variable.variable)
+              print(msg)
+              continue
+            # initialize a histogram for each variation
+            varhists = []
+            for variation in variations:
               histname = '{}_{}_{}_{}'.format(eventselection, selectiontype, variable.name, variation)
               if thisprocess is not None: histname = '{}_{}'.format(thisprocess, histname)
-              hist = variable.initialize_histogram(histname=histname)
-              # clip the values to be inside the histogram range
-              nbins = hist.GetNbinsX()
-              minvalue = hist.GetBinLowEdge(1) + hist.GetBinWidth(1)/2.
-              maxvalue = hist.GetBinLowEdge(nbins) + hist.GetBinWidth(nbins)/2.
-              values = np.clip(events[variable.variable], minvalue, maxvalue)
-              # fill the histogram
-              for val, weight in zip(values, weights):
-                hist.Fill(val, weight)
+              varhists.append(variable.initialize_histogram(histname=histname))
+            # clip the values to be inside the histogram range
+            hist = varhists[0]
+            nbins = hist.GetNbinsX()
+            minvalue = hist.GetBinLowEdge(1) + hist.GetBinWidth(1)/2.
+            maxvalue = hist.GetBinLowEdge(nbins) + hist.GetBinWidth(nbins)/2.
+            values = np.clip(events[variable.variable], minvalue, maxvalue)
+            # fill the histograms for all variations together
+            # (vectorized equivalent of calling hist.Fill(val, weight) for each event)
+            ht.fillhistograms(varhists, values, weightmatrix)
+            for variation, hist in zip(variations, varhists):
               hists[eventselection][selectiontype][variation].append(hist)
 
   # write to output file
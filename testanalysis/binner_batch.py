@@ -12,6 +12,7 @@ sys.path.append(str(Path(__file__).parents[1]))
 from samples.samplelisttools import readsamplelist
 import tools.argparsetools as apt
 import jobsubmission.condortools as ct
+import jobsubmission.localtools as lt
 from jobsubmission.jobsettings import CMSSW_VERSION
 
 
@@ -30,6 +31,9 @@ if __name__=='__main__':
   parser.add_argument('--lumi', default=1, type=float)
   parser.add_argument('--split', default=False, action='store_true')
   parser.add_argument('--runmode', default='condor', choices=['condor','local'])
+  parser.add_argument('--nworkers', default=None, type=int)
+  parser.add_argument('--maxmem', default=None, type=int)
+  parser.add_argument('--retries', default=0, type=int)
   args = parser.parse_args()
 
   # print arguments
@@ -83,7 +87,8 @@ if __name__=='__main__':
 
   # submit the jobs
   if args.runmode=='local':
-    for cmd in cmds: os.system(cmd)
+    lt.runCommandsLocally( 'cjob_binner', cmds,
+                           nworkers=args.nworkers, mem=args.maxmem, retries=args.retries )
   elif args.runmode=='condor':
     ct.submitCommandsAsCondorCluster( 'cjob_binner', cmds,
                                       cmssw_version=CMSSW_VERSION )
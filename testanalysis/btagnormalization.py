@@ -0,0 +1,148 @@
+##########################################################
+# Compute the b-tag reweighter normalization per sample #
+##########################################################
+# The b-tag shape reweighting does not conserve the total number of events,
+# so the b-tag weights are normalized to an average of 1 per number of jets
+# (see reweighting/btagreweighter.py).
+# By default, eventloop.py computes this normalization on the fly for each input file,
+# which evaluates all b-tag systematics on all jets before the actual event loop starts.
+# This script instead computes the normalization once per sample,
+# using all entries of the sample (also if eventloop.py is later run with -n),
+# and writes it to a json cache file that can be passed to eventloop.py
+# (and eventloop_batch.py) with the --btagnormfile option.
+# The cache file is keyed by year and sample name, where the sample name is the base name
+# of the input file without extension and file index suffix
+# (see normalization_sample_name in reweighting/btagreweighter.py):
+# the normalization sums of all files of a sample that is split over multiple files
+# are added together, and one entry is written per sample and year,
+# which eventloop.py looks up in the same way for each of the files.
+# So one cache file can hold the normalization for many samples and years.
+# Note: the jet selection is the same as in eventloop.py (see select_objects).
+# Note: the samples are processed in parallel with a pool of local processes;
+#       each sample can additionally be read in chunks to limit the memory usage.
+
+
+# import python modules
+import sys
+import os
+import time
+import argparse
+import multiprocessing
+from pathlib import Path
+import uproot
+# import framework modules
+sys.path.append(str(Path(__file__).parents[1]))
+from samples.samplelisttools import readsamplelist
+from samples.sample import year_from_sample_name
+from samples.sample import dtype_from_sample_name
+from reweighting.btagreweighter import BTagReweighter
+from reweighting.btagreweighter import normalization_sample_name
+# import local modules
+from eventloop import select_objects, load_events, get_chunks
+
+
+def get_btag_reweighter(year):
+  ### make a b-tag reweighter with the same configuration as in get_run2ul_reweighter
+  weightdir = os.path.join(Path(__file__).parents[1], 'reweighting', 'data')
+  wfile = os.path.join(weightdir, 'btagging', 'btagging_{}.json'.format(year))
+  return BTagReweighter(wfile, normalize=True)
+
+def get_normalization_sums(inputfile, unctypes=None, skimmed=False, chunksize=-1):
+  ### get the b-tag normalization sums for a single input file
+  # input arguments:
+  # - inputfile: path to input file
+  # - unctypes: list of unctypes (or 'all') to normalize, see BTagReweighter
+  # - skimmed: whether the input file is skimmed (see eventloop.py)
+  # - chunksize: number of entries to read at once (default: full file)
+  # returns: a tuple of the form (inputfile, sums, number of events)
+  #          where sums is the output of BTagReweighter.get_normalization_sums
+  year = year_from_sample_name(inputfile)
+  dtype = dtype_from_sample_name(inputfile)
+  btagreweighter = get_btag_reweighter(year)
+  with uproot.open(inputfile) as f:
+    nevents = f['Events'].num_entries
+  chunks = [(0, nevents)]
+  if( chunksize>0 and chunksize<nevents ): chunks = get_chunks(nevents, chunksize)
+  sums = None
+  for (entry_start, entry_stop) in chunks:
+    events = load_events(inputfile, year, dtype,
+               entry_start=entry_start, entry_stop=entry_stop)
+    masks = select_objects(events, year, dtype, skimmed=skimmed)
+    jets = events.Jet[masks['jet']]
+    sums = btagreweighter.add_normalization_sums(sums,
+      btagreweighter.get_normalization_sums(jets, unctypes=unctypes))
+  sys.stdout.flush()
+  return (inputfile, sums, nevents)
+
+def get_normalization_sums_star(kwargs):
+  ### internal helper function for use with multiprocessing.Pool.imap_unordered
+  return get_normalization_sums(**kwargs)
+
+
+if __name__=='__main__':
+
+  # parse arguments
+  parser = argparse.ArgumentParser(description='Compute b-tag reweighter normalization')
+  parser.add_argument('-i', '--inputdir', required=True, type=os.path.abspath)
+  parser.add_argument('-l', '--samplelist', required=True, type=os.path.abspath)
+  parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath)
+  parser.add_argument('-j', '--nprocesses', default=1, type=int)
+  parser.add_argument('--chunksize', default=-1, type=int)
+  parser.add_argument('--centralonly', default=False, action='store_true',
+    help='Only compute the normalization for the central b-tag weights'
+        +' (sufficient if the btagging systematic is not used).')
+  parser.add_argument('--skimmed', default=False, action='store_true')
+  args = parser.parse_args()
+
+  # print arguments
+  print('Running with following configuration:')
+  for arg in vars(args):
+    print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+  # check samples
+  samples = readsamplelist( args.samplelist, sampledir=args.inputdir, doyear=True )
+  samples = [sample for sample in samples.samples if sample.dtype=='sim']
+  if len(samples)==0:
+    raise Exception('ERROR: no simulated samples found in sample list.')
+  print('Found {} simulated samples.'.format(len(samples)))
+
+  # group the files per sample name and year
+  groups = {}
+  keys = {}
+  for sample in samples:
+    key = (sample.year, normalization_sample_name(sample.path))
+    keys[sample.path] = key
+    if key not in groups: groups[key] = []
+    groups[key].append(sample.path)
+  print('Found {} samples to normalize:'.format(len(groups)))
+  for (year, samplename), paths in groups.items():
+    print('  - {} ({}): {} file(s)'.format(samplename, year, len(paths)))
+
+  # compute the normalization sums for all samples
+  unctypes = None if args.centralonly else 'all'
+  jobs = ([{'inputfile': sample.path, 'unctypes': unctypes,
+            'skimmed': args.skimmed, 'chunksize': args.chunksize}
+           for sample in samples])
+  start_time = time.time()
+  allsums = {}
+  btagreweighters = {year: get_btag_reweighter(year) for (year, _) in groups.keys()}
+  ntot = 0
+  nprocesses = max(1, min(args.nprocesses, len(jobs)))
+  print('Computing normalization using {} processes...'.format(nprocesses))
+  sys.stdout.flush()
+  with multiprocessing.Pool(processes=nprocesses) as pool:
+    for (inputfile, sums, nevents) in pool.imap_unordered(get_normalization_sums_star, jobs):
+      key = keys[inputfile]
+      allsums[key] = btagreweighters[key[0]].add_normalization_sums(allsums.get(key), sums)
+      ntot += nevents
+      print('  - done: {} ({} events)'.format(os.path.basename(inputfile), nevents))
+      sys.stdout.flush()
+  duration = time.time() - start_time
+  print('Processed {} events in {:.1f} seconds.'.format(ntot, duration))
+
+  # write the normalization to the cache file (one entry per sample and year)
+  for (year, samplename) in groups.keys():
+    reweighter = btagreweighters[year]
+    reweighter.set_normalization_from_sums(allsums[(year, samplename)])
+    reweighter.save_normalization(args.outputfile, samplename, year)
+  print('Normalization for {} samples written to {}'.format(len(groups), args.outputfile))
@@ -14,19 +14,36 @@
 #   this gives you more control over terminating the command,
 #   since with "nohup &", the process ID seems to be irretrievable 
 #   after logging out of the m-machine (?).
+# Note: the jobs submitted in each step are recorded in a registry file
+#   and followed through their log files (see jobsubmission/jobtracker.py),
+#   so each step only waits for its own jobs, not for all jobs of the user.
+# Note: see pipeline.py for an alternative that only re-runs the steps
+#   (and samples) affected by a change in the configuration.
 
 
 import sys
 import os
-import time
 sys.path.append(os.path.abspath('../jobsubmission'))
-import jobtools
+from jobtracker import JobRegistry, JobTracker
 
 
-def wait(**kwargs):
-    while True:
-        if not jobtools.jobs_are_running(verbose=True, **kwargs): return
-        time.sleep(60)
+def run_and_wait(cmd, registry, heldtimeout=3600):
+    ### run a command and wait for all jobs it submitted to finish
+    # note: jobs that are held for longer than heldtimeout seconds are considered as failed.
+    with JobRegistry(registry) as reg:
+        os.system(cmd)
+    jobs = reg.jobs()
+    print('Waiting for {} jobs submitted by "{}"...'.format(len(jobs), cmd))
+    tracker = JobTracker(jobs, heldtimeout=heldtimeout)
+    tracker.wait(verbose=True)
+    failed = tracker.failedJobs()
+    held = tracker.heldJobs()
+    if len(failed)>0:
+        print('WARNING: {} jobs did not finish successfully:'.format(len(failed)))
+        for clusterid, procid in failed:
+            msg = '  - {}.{}'.format(clusterid, procid)
+            if (clusterid, procid) in held: msg += ' (held)'
+            print(msg)
     
 # set output directory
 outputdir = sys.argv[1]
@@ -34,20 +51,17 @@ outputdir = sys.argv[1]
 # run event loop and wait for jobs to finish
 cmd = 'python3 eventloop_loop.py'
 cmd += ' {}'.format(outputdir)
-os.system(cmd)
-wait()
+run_and_wait(cmd, 'chain_jobs_eventloop.txt')
 
 # run data merging
 cmd = 'python3 mergedatatrees_loop.py'
 cmd += ' {}'.format(outputdir)
-os.system(cmd)
-wait()
+run_and_wait(cmd, 'chain_jobs_mergedatatrees.txt')
 
 # run binning and wait for jobs to finish
 cmd = 'python3 binner_loop.py'
 cmd += ' {}'.format(outputdir)
-os.system(cmd)
-wait()
+run_and_wait(cmd, 'chain_jobs_binner.txt')
 
 # run merging folders
 # (run locally!)
@@ -16,8 +16,7 @@ import uproot
 from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
 # import framework modules
 sys.path.append(str(Path(__file__).parents[2]))
-from objectselection.electronselection import electronselection
-from objectselection.muonselection import muonselection
+from objectselection.leptonid import electron_id_bits, muon_id_bits, id_mask
 from objectselection.jetselection import jetselection
 from objectselection.bjetselection import bjetselection
 from objectselection.cleaning import clean_electrons_from_muons
@@ -91,18 +90,22 @@ if __name__=='__main__':
   # calculate object masks
   print('Performing object selection...')
   sys.stdout.flush()
-  muon_loose_mask = muonselection(events.Muon, selectionid='run2ul_loose')
-  muon_fo_mask = muonselection(events.Muon, selectionid='ttwloose_fo')
-  muon_tight_mask = muonselection(events.Muon, selectionid='ttwloose_tight')
+  muon_bits = muon_id_bits(events.Muon,
+    selectionids=['run2ul_loose', 'ttwloose_fo', 'ttwloose_tight'])
+  muon_loose_mask = id_mask(muon_bits, 'muon', 'run2ul_loose')
+  muon_fo_mask = id_mask(muon_bits, 'muon', 'ttwloose_fo')
+  muon_tight_mask = id_mask(muon_bits, 'muon', 'ttwloose_tight')
   electron_cleaning_mask = clean_electrons_from_muons(events.Electron, events.Muon[muon_loose_mask])
-  electron_loose_mask = ( 
-    (electronselection(events.Electron, selectionid='run2ul_loose'))
+  electron_bits = electron_id_bits(events.Electron,
+    selectionids=['run2ul_loose', 'ttwloose_fo', 'ttwloose_tight'])
+  electron_loose_mask = (
+    id_mask(electron_bits, 'electron', 'run2ul_loose')
     & electron_cleaning_mask )
-  electron_fo_mask = ( 
-    (electronselection(events.Electron, selectionid='ttwloose_fo'))
+  electron_fo_mask = (
+    id_mask(electron_bits, 'electron', 'ttwloose_fo')
     & electron_cleaning_mask )
-  electron_tight_mask = ( 
-    (electronselection(events.Electron, selectionid='ttwloose_tight'))
+  electron_tight_mask = (
+    id_mask(electron_bits, 'electron', 'ttwloose_tight')
     & electron_cleaning_mask )
   leptonsforcleaningjets = ak.with_name(ak.concatenate(
     (events.Electron[electron_fo_mask],events.Muon[muon_fo_mask]), axis=1),
@@ -3,6 +3,7 @@ import os
 # import framework modules
 sys.path.append(os.path.abspath('../../'))
 import jobsubmission.condortools as ct
+import jobsubmission.localtools as lt
 from jobsubmission.jobsettings import CMSSW_VERSION
 
 
@@ -37,6 +38,7 @@ if __name__=='__main__':
   #selection_types = ['tight', 'fakerate', 'chargeflips']
   selection_types = ['fakerate']
 
+  localcmds = []
   for f in files:
     for t in selection_types:
       cmds = []
@@ -57,6 +59,10 @@ if __name__=='__main__':
       #cmds.append(cmd)
       # run or submit the commands
       if runmode=='local':
-        for cmd in cmds: os.system(cmd)
+        localcmds.append(cmds)
       elif runmode=='condor':
         ct.submitCommandsAsCondorJob('cjob_cutflow', cmds, cmssw_version=CMSSW_VERSION)
+
+  # run the local jobs in parallel
+  if( runmode=='local' and len(localcmds)>0 ):
+    lt.runCommandSetsLocally('cjob_cutflow', localcmds)
@@ -9,6 +9,9 @@
 #   the output ROOT file has the following folder structure:
 #   <event selection>/<selection type>/<selection systematic>/Events;
 #   the branches of each Events tree hold per-event scalar variables.
+# optionally, the output can be stored in (and taken from) an output cache (see --cachedir),
+#   keyed by the input file, the configuration and the code version,
+#   so that unchanged inputs do not need to be processed again.
 
 
 # import python modules
@@ -21,8 +24,7 @@ import uproot
 from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
 # import framework modules
 sys.path.append(str(Path(__file__).parents[1]))
-from objectselection.electronselection import electronselection
-from objectselection.muonselection import muonselection
+from objectselection.leptonid import electron_id_bits, muon_id_bits, id_mask
 from objectselection.jetselection import jetselection
 from objectselection.bjetselection import bjetselection
 from objectselection.cleaning import clean_electrons_from_muons
@@ -39,9 +41,11 @@ import eventselection.lepton_selection_tools as lst
 import eventselection.sample_selection_tools as sst
 import eventselection.trigger_selection_tools as tst
 import tools.argparsetools as apt
+import tools.outputcache as oc
 from tools.readfakeratetools import readfrmapfromfile
 from tools.readchargefliptools import readcfmapfromfile
 from reweighting.implementation.run2ulreweighter import get_run2ul_reweighter
+from reweighting.btagreweighter import normalization_sample_name
 # import local modules
 sys.path.append(os.path.abspath('eventselections'))
 from eventselections import pass_event_selection
@@ -52,113 +56,16 @@ from systematics_type import systematics_type
 from systematics_tools import get_selection_systematics
 
 
-if __name__=='__main__':
-
-  sys.stderr.write('###starting###\n')
-
+def select_objects(events, year, dtype, skimmed=False):
+  ### calculate additional variables, object masks and lepton cone correction
   # input arguments:
-  parser = argparse.ArgumentParser(description='Perform event selection and calculate analysis variables')
-  parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
-  parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath)
-  parser.add_argument('-n', '--nentries', type=int, default=-1)
-  parser.add_argument('-s', '--eventselection', required=True, nargs='+')
-  parser.add_argument('-t', '--selectiontype', default=['tight'], nargs='+')
-  parser.add_argument('--systematics', default=[], nargs='+')
-  parser.add_argument('--elfrmap', default=None, type=apt.path_or_none)
-  parser.add_argument('--mufrmap', default=None, type=apt.path_or_none)
-  parser.add_argument('--elcfmap', default=None, type=apt.path_or_none)
-  parser.add_argument('--bdt', default=None, type=apt.path_or_none)
-  parser.add_argument('--forcenentries', default=False, action='store_true')
-  parser.add_argument('--skimmed', default=False, action='store_true')
-  args = parser.parse_args()
-
-  # print arguments
-  print('Running with following configuration:')
-  for arg in vars(args):
-    print('  - {}: {}'.format(arg,getattr(args,arg)))
-  sys.stdout.flush()
-
-  # get sample metadata
-  year = year_from_sample_name(args.inputfile)
-  dtype = dtype_from_sample_name(args.inputfile)
-  samplename = os.path.basename(args.inputfile)
-  with uproot.open(args.inputfile) as f:
-    events = f['Events']
-    nevents = events.num_entries
-  print('File paramters:')
-  print('  - year {}'.format(year))
-  print('  - dtype {}'.format(dtype))
-  print('  - available events: {}'.format(nevents))
-
-  # manage systematics
-  if dtype=='data': systematics = []
-  else:
-    if( len(args.systematics)==1 and args.systematics[0]=='all' ):
-      args.systematics = list(systematics_type.keys())
-      print('Systematics:')
-      for systematic in args.systematics: print('  - {}'.format(systematic))
-    else:
-      for systematic in args.systematics:
-        if systematic not in systematics_type.keys():
-          raise Exception('ERROR: systematic {} not recognized.'.format(systematic))
-
-  # manage number of entries
-  if args.nentries>0:
-    if dtype=='data':
-      if not args.forcenentries:
-        print('WARING: partial file processing for data does not make sense,')
-        print('        processing full file instead.')
-        args.nentries = -1
-      else:
-        print('WARING: partial file processing for data does not make sense,')
-        print('        use this only for testing.')
-
-  # make NanoEvents array
-  print('Loading events from input file...')
-  year = year_from_sample_name(args.inputfile)
-  dtype = dtype_from_sample_name(args.inputfile)
-  samplename = os.path.basename(args.inputfile)
-  events = NanoEventsFactory.from_root(
-    args.inputfile,
-    entry_stop=args.nentries if args.nentries>=0 else None,
-    schemaclass=NanoAODSchema,
-    metadata={'year': year, 'samplename': samplename, 'dtype': dtype}
-  ).events()
-  sys.stdout.flush()
-
-  # manage number of entries reweighting
-  nentries_reweight = 1
-  if args.nentries>0:
-    nentries_reweight = nevents / min(args.nentries, nevents)
-    print('Using reweighting factor {} because of partial file processing'.format(nentries_reweight))
-  nevents = min(args.nentries, nevents)
-
-  # make sample generator weights
-  sampleweights = None
-  if( dtype=='sim' ): sampleweights = SampleWeights(args.inputfile)
-
-  # load fake rate maps if needed
-  electronfrmap = None
-  if args.elfrmap is not None:
-    electronfrmap = readfrmapfromfile(args.elfrmap, year, 'electron', verbose=True)
-  muonfrmap = None
-  if args.mufrmap is not None:  
-    muonfrmap = readfrmapfromfile(args.mufrmap, year, 'muon', verbose=True)
-
-  # load charge flip maps if needed
-  electroncfmap = None
-  if args.elcfmap is not None:
-    electroncfmap = readcfmapfromfile(args.elcfmap, year, 'electron', verbose=True)
-
-  # initialize output structure
-  output_trees = {}
-  for eventselection in args.eventselection:
-    output_trees[eventselection] = {}
-    for selectiontype in args.selectiontype:
-      output_trees[eventselection][selectiontype] = {}
-
+  # - events: NanoEvents array (modified in place by preprocessing and cone correction)
+  # - year and dtype: sample metadata
+  # - skimmed: whether the input file is skimmed (i.e. already preprocessed)
+  # returns: a dict with nominal object masks
+  
   # calculate additional variables
-  if args.skimmed: pass
+  if skimmed: pass
   else:
     preprocessor = PreProcessor()
     leptongenvariables = ['isPrompt'] if dtype=='sim' else []
@@ -175,18 +82,23 @@ if __name__=='__main__':
   # calculate object masks
   print('Performing lepton selection...')
   sys.stdout.flush()
-  muon_loose_mask_nominal = muonselection(events.Muon, selectionid='run2ul_loose')
-  muon_fo_mask_nominal = muonselection(events.Muon, selectionid='ttwloose_fo')
-  muon_tight_mask_nominal = muonselection(events.Muon, selectionid='ttwloose_tight')
+  masks = {}
+  muon_bits = muon_id_bits(events.Muon,
+    selectionids=['run2ul_loose', 'ttwloose_fo', 'ttwloose_tight'])
+  muon_loose_mask_nominal = id_mask(muon_bits, 'muon', 'run2ul_loose')
+  muon_fo_mask_nominal = id_mask(muon_bits, 'muon', 'ttwloose_fo')
+  muon_tight_mask_nominal = id_mask(muon_bits, 'muon', 'ttwloose_tight')
   electron_cleaning_mask = clean_electrons_from_muons(events.Electron, events.Muon[muon_loose_mask_nominal])
-  electron_loose_mask_nominal = ( 
-    (electronselection(events.Electron, selectionid='run2ul_loose'))
+  electron_bits = electron_id_bits(events.Electron,
+    selectionids=['run2ul_loose', 'ttwloose_fo', 'ttwloose_tight'])
+  electron_loose_mask_nominal = (
+    id_mask(electron_bits, 'electron', 'run2ul_loose')
     & electron_cleaning_mask )
-  electron_fo_mask_nominal = ( 
-    (electronselection(events.Electron, selectionid='ttwloose_fo'))
+  electron_fo_mask_nominal = (
+    id_mask(electron_bits, 'electron', 'ttwloose_fo')
     & electron_cleaning_mask )
-  electron_tight_mask_nominal = ( 
-    (electronselection(events.Electron, selectionid='ttwloose_tight'))
+  electron_tight_mask_nominal = (
+    id_mask(electron_bits, 'electron', 'ttwloose_tight')
     & electron_cleaning_mask )
   leptonsforcleaningjets = ak.with_name(ak.concatenate(
     (events.Electron[electron_fo_mask_nominal], events.Muon[muon_fo_mask_nominal]), axis=1),
@@ -207,44 +119,74 @@ if __name__=='__main__':
     muon_correctionfactor=muon_cone_correction_factor('ttwloose')
   )
 
-  # make a reweighter
-  if dtype=='sim':
-    print('Initializing reweighter')
-    reweighter = get_run2ul_reweighter(year, sampleweights, dobtagnormalize=True)
-    # note: perhaps this should be done inside the loop over selection systematics,
-    #       for each selection systematic separately.
-    print('Normalizing b-tag reweighter')
-    sys.stdout.flush()
-    btagreweighter = reweighter.reweighters['btagging']
-    jets_for_init = events.Jet[jet_mask_nominal]
-    unctypes_for_init = 'all' if 'btagging' in args.systematics else None
-    btagreweighter.set_normalization(jets_for_init, unctypes=unctypes_for_init)
+  masks['muon_loose'] = muon_loose_mask_nominal
+  masks['muon_fo'] = muon_fo_mask_nominal
+  masks['muon_tight'] = muon_tight_mask_nominal
+  masks['electron_loose'] = electron_loose_mask_nominal
+  masks['electron_fo'] = electron_fo_mask_nominal
+  masks['electron_tight'] = electron_tight_mask_nominal
+  masks['leptonsforcleaningjets'] = leptonsforcleaningjets
+  masks['jet_cleaning'] = jet_cleaning_mask
+  masks['jet'] = jet_mask_nominal
+  masks['bjet_loose'] = bjet_loose_mask_nominal
+  return masks
 
-  # find systematics for which alternative selections are needed
-  if dtype=='data': selection_systematics = {'nominal': ['nominal']}
-  else:
-    print('Finding systematics that need alternative selections')
-    selection_systematics = get_selection_systematics(events, args.systematics, includenominal=True)
-    print('Found following selection systematics:')
-    for selection_systematic, variations in selection_systematics.items():
-      print('  - {}'.format(selection_systematic))
-      if( len(variations)>1 or variations[0]!=selection_systematic ):
-        for variation in variations: print('    - {}'.format(variation))
+
+def process_events(events, masks, args, year, dtype, selection_systematics,
+      reweighter=None, sampleweights=None, nentries_reweight=1,
+      electronfrmap=None, muonfrmap=None, electroncfmap=None):
+  ### perform event selection and calculate variables for all selection systematics
+  # input arguments:
+  # - events: NanoEvents array
+  # - masks: dict of nominal object masks (see select_objects)
+  # - args: command line arguments
+  # - year and dtype: sample metadata
+  # - selection_systematics: dict of selection systematics to variations
+  # - other arguments: see calculate_event_variables and reweighter
+  # returns: a dict of the form {event selection: {selection type: {systematic: tree}}},
+  #          where each tree is a dict of branch names to arrays.
+  
+  # initialize output structure
+  output_trees = {}
+  for eventselection in args.eventselection:
+    output_trees[eventselection] = {}
+    for selectiontype in args.selectiontype:
+      output_trees[eventselection][selectiontype] = {}
+  nevents = len(events)
+
+  # get nominal masks
+  muon_loose_mask_nominal = masks['muon_loose']
+  muon_fo_mask_nominal = masks['muon_fo']
+  muon_tight_mask_nominal = masks['muon_tight']
+  electron_loose_mask_nominal = masks['electron_loose']
+  electron_fo_mask_nominal = masks['electron_fo']
+  electron_tight_mask_nominal = masks['electron_tight']
+  leptonsforcleaningjets = masks['leptonsforcleaningjets']
+  jet_cleaning_mask = masks['jet_cleaning']
+  jet_mask_nominal = masks['jet']
+  bjet_loose_mask_nominal = masks['bjet_loose']
+
+  # initialize caches for quantities that do not depend on the jets or MET
+  # note: the leptons and lepton masks are the same for all selection systematics,
+  #       so the event variables and event selection masks that depend only on them
+  #       are calculated once and reused for all JEC/JER/unclustered energy variations;
+  #       likewise for the weights of reweighters that do not depend on the jets.
+  variables_cache = {}
+  selection_cache = {}
+  jet_independent_reweighters = None
+  if dtype=='sim':
+    jet_independent_reweighters = reweighter.get_reweighters_independent_of(
+      ['jet_mask', 'bjet_mask'])
 
   # loop over selection systematics
-  electrons_nominal = events.Electron
-  muons_nominal = events.Muon
-  jets_nominal = events.Jet
-  met_nominal = events.MET
   for selection_systematic, variations in selection_systematics.items():
     for variation in variations:
       print('Now running on selection systematic {} ({})'.format(selection_systematic, variation))
 
-      # initialize varied collections and masks to nominal ones
-      electrons = electrons_nominal
-      muons = muons_nominal
-      jets = jets_nominal
-      met = met_nominal
+      # initialize varied events and masks to nominal ones
+      # note: varied jets and MET are represented by lazy views (see jetuncs),
+      #       the original events are not modified.
+      varied_events = events
       muon_loose_mask = muon_loose_mask_nominal
       muon_fo_mask = muon_fo_mask_nominal
       muon_tight_mask = muon_tight_mask_nominal
@@ -257,24 +199,21 @@ if __name__=='__main__':
       # recalculate some of the objects and masks depending on systematic
       if(selection_systematic=='jec' or selection_systematic=='jer'):
         print('  Recalculating jets and MET')
-        jets = jetuncs.get_varied_jets(events, variation)
-        events.Jet = jets
-        events['Jet'] = jets
-        met = jetuncs.get_varied_met(events, variation)
-        events.MET = met
-        events['MET'] = met
-        jet_cleaning_mask_ = clean_jets_from_leptons(events.Jet, leptonsforcleaningjets)
+        jets = jetuncs.get_jet_variation_view(events, variation)
+        met = jetuncs.get_met_variation_view(events, variation)
+        varied_events = jetuncs.VariedEvents(events, Jet=jets, MET=met)
+        # note: the jet cleaning mask is not recalculated,
+        #       since the variations only change the jet pt and mass, not the direction.
         jet_mask = (
-          jetselection(events.Jet, selectionid='run2ul_default')
+          jetselection(jets, selectionid='run2ul_default')
           & jet_cleaning_mask )
         bjet_loose_mask = (
           jet_mask
-          & bjetselection(events.Jet, year=year, algo='deepflavor', level='loose') )
+          & bjetselection(jets, year=year, algo='deepflavor', level='loose') )
       elif(selection_systematic=='uncl'):
         print('  Recalculating MET')
-        met = jetuncs.get_varied_met(events, variation)
-        events.MET = met
-        events['MET'] = met
+        met = jetuncs.get_met_variation_view(events, variation)
+        varied_events = jetuncs.VariedEvents(events, MET=met)
       elif(selection_systematic=='nominal'): pass
       else:
         msg = 'ERROR: selection systematic {} not recognized.'.format(selection_systematic)
@@ -283,13 +222,14 @@ if __name__=='__main__':
       # calculate event variables
       print('  Calculating event variables')
       sys.stdout.flush()
-      variables = calculate_event_variables(events,
+      variables = calculate_event_variables(varied_events,
         weights=sampleweights, nentries_reweight=nentries_reweight,
         electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
         electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask,
         jet_mask=jet_mask, bjet_mask=bjet_loose_mask,
         electronfrmap=electronfrmap, muonfrmap=muonfrmap,
-        electroncfmap=electroncfmap)
+        electroncfmap=electroncfmap,
+        cache=variables_cache)
 
       # evaluate the reweighter (only for simulation)
       # note: nominal reweighting factors should be calculated for all selection systematics,
@@ -301,15 +241,22 @@ if __name__=='__main__':
           'jet_mask': jet_mask,
           'bjet_mask': bjet_loose_mask
         })
+        # set the evaluation context of the reweighter,
+        # so the per-reweighter weights are cached for this selection systematic
+        # (and e.g. not recalculated in allweights below);
+        # the weights of reweighters that do not depend on the jets
+        # are carried over from the previous selection systematic.
+        reweighter.set_context(varied_events, keep=jet_independent_reweighters,
+          **reweighter_kwargs)
         # calculate nominal event reweighting factors
         print('  Calculate nominal reweighting factors')
         sys.stdout.flush()
-        variables['reweight_nominal'] = reweighter.weights(events, **reweighter_kwargs)
+        variables['reweight_nominal'] = reweighter.weights(varied_events, **reweighter_kwargs)
         # calculate weight systematics (only for nominal selection)
         if selection_systematic=='nominal':
           weight_systematics = ([systematic for systematic in args.systematics
             if systematics_type[systematic]=='weight'])
-          weights = reweighter.allweights(events, reweighternames=weight_systematics,
+          weights = reweighter.allweights(varied_events, reweighternames=weight_systematics,
             wtype='individual', verbose=True, **reweighter_kwargs)
           for key, val in weights.items():
               if key=='nominal': continue
@@ -322,11 +269,12 @@ if __name__=='__main__':
             eventselection, selectiontype))
           sys.stdout.flush()
           # do event selection
-          events_mask = pass_event_selection(events, eventselection,
+          events_mask = pass_event_selection(varied_events, eventselection,
             selectiontype=selectiontype,
             electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
             electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask,
-            jet_mask=jet_mask, bjet_mask=bjet_loose_mask)
+            jet_mask=jet_mask, bjet_mask=bjet_loose_mask,
+            cache=selection_cache)
           print('  Event selection: {} / {}'.format(eventselection, selectiontype))
           print('    Selected {} out of {} events.'.format(ak.sum(events_mask), nevents))
           sys.stdout.flush()
@@ -339,27 +287,301 @@ if __name__=='__main__':
             systematic_tree_name += '_' + variation
           output_trees[eventselection][selectiontype][systematic_tree_name] = tree
 
-      # reset event objects to nominal
-      events.Electron = electrons_nominal
-      events['Electron'] = electrons_nominal
-      events.Muon = muons_nominal
-      events['Muon'] = muons_nominal
-      events.Jet = jets_nominal
-      events['Jet'] = jets_nominal
-      events.MET = met_nominal
-      events['MET'] = met_nominal
-
-  # write output trees to file
+  # clear the evaluation context of the reweighter
+  if dtype=='sim': reweighter.clear_context()
+
+  return output_trees
+
+
+def write_output_trees(f, output_trees, written=None):
+  ### write output trees to an open uproot file
+  # input arguments:
+  # - f: uproot file opened for writing
+  # - output_trees: dict of output trees (see process_events)
+  # - written: set of tree names that were already written to f in a previous call;
+  #   these trees are extended rather than created (e.g. for chunked processing).
+  #   the set is updated in place with the newly created trees.
+  if written is None: written = set()
+  for eventselection in output_trees.keys():
+    for selectiontype in output_trees[eventselection].keys():
+      for systematic in output_trees[eventselection][selectiontype].keys():
+        print('Writing output for {} / {} / {} ...'.format(
+          eventselection, selectiontype, systematic))
+        sys.stdout.flush()
+        fkey = '{}/{}/{}/Events'.format(eventselection,selectiontype,systematic)
+        tree = output_trees[eventselection][selectiontype][systematic]
+        if fkey in written: f[fkey].extend(tree)
+        else:
+          f[fkey] = tree
+          written.add(fkey)
+
+
+def load_events(inputfile, year, dtype, entry_start=None, entry_stop=None):
+  ### make a NanoEvents array for (a range of entries in) an input file
+  samplename = os.path.basename(inputfile)
+  events = NanoEventsFactory.from_root(
+    inputfile,
+    entry_start=entry_start,
+    entry_stop=entry_stop,
+    schemaclass=NanoAODSchema,
+    metadata={'year': year, 'samplename': samplename, 'dtype': dtype}
+  ).events()
+  return events
+
+
+def get_chunks(nevents, chunksize):
+  ### get list of (entry_start, entry_stop) tuples covering nevents entries
+  return [(start, min(start+chunksize, nevents)) for start in range(0, nevents, chunksize)]
+
+
+# files and directories that determine the output (used as code version for the output cache)
+# note: this includes the data files that are read implicitly by the code
+#       (TOP lepton MVA weights and JEC files), so that changing them invalidates the cache;
+#       the reweighting data are included with the reweighting directory,
+#       and the fake rate and charge flip maps are part of the cache key separately.
+cache_code_paths = ([
+  os.path.join(Path(__file__).parents[1], d) for d in
+  ['objectselection', 'preprocessing', 'samples', 'eventselection', 'reweighting',
+   'tools', 'constants', os.path.join('data', 'leptonmva'), os.path.join('data', 'jec')]
+] + [
+  os.path.join(Path(__file__).parent, d) for d in
+  ['eventloop.py', 'eventselections', 'eventvariables', 'systematics']
+])
+
+
+def get_cache_key(inputfile, eventselection, selectiontype,
+                  systematics=None, nentries=-1, forcenentries=False, skimmed=False,
+                  elfrmap=None, mufrmap=None, elcfmap=None, bdt=None, btagnormfile=None,
+                  checksum=False, codeversion=None):
+  ### get the key of the output of a given configuration in the output cache
+  # input arguments:
+  # - inputfile up to btagnormfile: see the command line arguments below
+  # - checksum: use the checksum of the input file (default: its size and modification time)
+  # - codeversion: hash of the code (default: computed from cache_code_paths)
+  # returns: a tuple (key, config) with the key and the configuration it is based on
+  # note: the chunk size is not part of the key, as it does not affect the output.
+  if codeversion is None: codeversion = oc.code_version(cache_code_paths)
+  config = ({
+    'inputfile': oc.file_signature(inputfile, checksum=checksum),
+    'eventselection': list(eventselection),
+    'selectiontype': list(selectiontype),
+    'systematics': list(systematics) if systematics is not None else [],
+    'nentries': nentries if nentries>0 else -1,
+    'forcenentries': forcenentries,
+    'skimmed': skimmed,
+    'elfrmap': oc.file_checksum(elfrmap) if elfrmap is not None else None,
+    'mufrmap': oc.file_checksum(mufrmap) if mufrmap is not None else None,
+    'elcfmap': oc.file_checksum(elcfmap) if elcfmap is not None else None,
+    'bdt': oc.file_checksum(bdt) if bdt is not None else None,
+    'btagnormfile': oc.file_checksum(btagnormfile) if btagnormfile is not None else None,
+    'codeversion': codeversion
+  })
+  return (oc.make_cache_key(config), config)
+
+
+if __name__=='__main__':
+
+  sys.stderr.write('###starting###\n')
+
+  # input arguments:
+  parser = argparse.ArgumentParser(description='Perform event selection and calculate analysis variables')
+  parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+  parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath)
+  parser.add_argument('-n', '--nentries', type=int, default=-1)
+  parser.add_argument('-s', '--eventselection', required=True, nargs='+')
+  parser.add_argument('-t', '--selectiontype', default=['tight'], nargs='+')
+  parser.add_argument('--systematics', default=[], nargs='+')
+  parser.add_argument('--elfrmap', default=None, type=apt.path_or_none)
+  parser.add_argument('--mufrmap', default=None, type=apt.path_or_none)
+  parser.add_argument('--elcfmap', default=None, type=apt.path_or_none)
+  parser.add_argument('--bdt', default=None, type=apt.path_or_none)
+  parser.add_argument('--forcenentries', default=False, action='store_true')
+  parser.add_argument('--skimmed', default=False, action='store_true')
+  parser.add_argument('--chunksize', default=-1, type=int)
+  parser.add_argument('--btagnormfile', default=None, type=apt.path_or_none)
+  parser.add_argument('--cachedir', default=None, type=apt.path_or_none,
+    help='Directory of the output cache (default: no cache).')
+  parser.add_argument('--cachemaxsize', default=None, type=float,
+    help='Maximum size of the output cache in GB (default: no limit).')
+  parser.add_argument('--cachechecksum', default=False, action='store_true',
+    help='Identify the input file by its checksum rather than by its modification time.')
+  args = parser.parse_args()
+
+  # print arguments
+  print('Running with following configuration:')
+  for arg in vars(args):
+    print('  - {}: {}'.format(arg,getattr(args,arg)))
+  sys.stdout.flush()
+
+  # check the output cache
+  cache = None
+  if args.cachedir is not None:
+    cache = oc.OutputCache(args.cachedir, maxsize=args.cachemaxsize)
+    (cachekey, cacheconfig) = get_cache_key(args.inputfile,
+      args.eventselection, args.selectiontype, systematics=args.systematics,
+      nentries=args.nentries, forcenentries=args.forcenentries, skimmed=args.skimmed,
+      elfrmap=args.elfrmap, mufrmap=args.mufrmap, elcfmap=args.elcfmap,
+      bdt=args.bdt, btagnormfile=args.btagnormfile, checksum=args.cachechecksum)
+    if cache.fetch(cachekey, args.outputfile):
+      print('Output found in cache (key {}), skipping event loop.'.format(cachekey))
+      sys.stderr.write('###done###\n')
+      sys.exit()
+    print('Output not found in cache (key {}).'.format(cachekey))
+
+  # get sample metadata
+  year = year_from_sample_name(args.inputfile)
+  dtype = dtype_from_sample_name(args.inputfile)
+  samplename = os.path.basename(args.inputfile)
+  with uproot.open(args.inputfile) as f:
+    events = f['Events']
+    nevents = events.num_entries
+  print('File paramters:')
+  print('  - year {}'.format(year))
+  print('  - dtype {}'.format(dtype))
+  print('  - available events: {}'.format(nevents))
+
+  # manage systematics
+  if dtype=='data': systematics = []
+  else:
+    if( len(args.systematics)==1 and args.systematics[0]=='all' ):
+      args.systematics = list(systematics_type.keys())
+      print('Systematics:')
+      for systematic in args.systematics: print('  - {}'.format(systematic))
+    else:
+      for systematic in args.systematics:
+        if systematic not in systematics_type.keys():
+          raise Exception('ERROR: systematic {} not recognized.'.format(systematic))
+
+  # manage number of entries
+  if args.nentries>0:
+    if dtype=='data':
+      if not args.forcenentries:
+        print('WARING: partial file processing for data does not make sense,')
+        print('        processing full file instead.')
+        args.nentries = -1
+      else:
+        print('WARING: partial file processing for data does not make sense,')
+        print('        use this only for testing.')
+
+  # manage number of entries reweighting
+  nentries_reweight = 1
+  if args.nentries>0:
+    nentries_reweight = nevents / min(args.nentries, nevents)
+    print('Using reweighting factor {} because of partial file processing'.format(nentries_reweight))
+    nevents = min(args.nentries, nevents)
+
+  # manage chunks
+  # note: in chunked mode, the file is processed in ranges of entries,
+  #       and the output trees are written (extended) after each chunk,
+  #       so the memory usage is proportional to the chunk size rather than the file size.
+  dochunks = (args.chunksize>0 and args.chunksize<nevents)
+  chunks = get_chunks(nevents, args.chunksize) if dochunks else [(0, nevents)]
+  if dochunks: print('Processing file in {} chunks of {} entries'.format(len(chunks), args.chunksize))
+
+  # make sample generator weights
+  sampleweights = None
+  if( dtype=='sim' ): sampleweights = SampleWeights(args.inputfile)
+
+  # load fake rate maps if needed
+  electronfrmap = None
+  if args.elfrmap is not None:
+    electronfrmap = readfrmapfromfile(args.elfrmap, year, 'electron', verbose=True)
+  muonfrmap = None
+  if args.mufrmap is not None:  
+    muonfrmap = readfrmapfromfile(args.mufrmap, year, 'muon', verbose=True)
+
+  # load charge flip maps if needed
+  electroncfmap = None
+  if args.elcfmap is not None:
+    electroncfmap = readcfmapfromfile(args.elcfmap, year, 'electron', verbose=True)
+
+  # make a reweighter
+  reweighter = None
+  if dtype=='sim':
+    print('Initializing reweighter')
+    reweighter = get_run2ul_reweighter(year, sampleweights, dobtagnormalize=True)
+    btagreweighter = reweighter.reweighters['btagging']
+    unctypes_for_init = 'all' if 'btagging' in args.systematics else None
+
+  # load the b-tag reweighter normalization from a precomputed file
+  # (see btagnormalization.py)
+  dobtagnormalize = (dtype=='sim' and args.btagnormfile is None)
+  if( dtype=='sim' and args.btagnormfile is not None ):
+    print('Loading b-tag reweighter normalization from {}'.format(args.btagnormfile))
+    btagreweighter.load_normalization(args.btagnormfile,
+      normalization_sample_name(args.inputfile), year,
+      unctypes=unctypes_for_init)
+  
+  # normalize the b-tag reweighter in a separate first pass over the file
+  # (only needed in chunked mode; else done on the fly below)
+  # note: perhaps this should be done inside the loop over selection systematics,
+  #       for each selection systematic separately.
+  if( dobtagnormalize and dochunks ):
+    print('Normalizing b-tag reweighter (first pass over file)')
+    sys.stdout.flush()
+    btagsums = None
+    for (entry_start, entry_stop) in chunks:
+      print('Now running on entries {} to {}'.format(entry_start, entry_stop))
+      events = load_events(args.inputfile, year, dtype,
+                 entry_start=entry_start, entry_stop=entry_stop)
+      masks = select_objects(events, year, dtype, skimmed=args.skimmed)
+      jets_for_init = events.Jet[masks['jet']]
+      btagsums = btagreweighter.add_normalization_sums(btagsums,
+        btagreweighter.get_normalization_sums(jets_for_init, unctypes=unctypes_for_init))
+    btagreweighter.set_normalization_from_sums(btagsums)
+
+  # prepare output file
   outputdir = os.path.dirname(args.outputfile)
   if not os.path.exists(outputdir): os.makedirs(outputdir)
+  # (remove rather than overwrite an existing file,
+  #  as it might be hard-linked to an entry in the output cache)
+  if os.path.exists(args.outputfile): os.remove(args.outputfile)
+  written = set()
   with uproot.recreate(args.outputfile, compression=uproot.LZMA(9)) as f:
-    for eventselection in output_trees.keys():
-      for selectiontype in output_trees[eventselection].keys():
-        for systematic in output_trees[eventselection][selectiontype].keys():
-          print('Writing output for {} / {} / {} ...'.format(
-            eventselection, selectiontype, systematic))
-          sys.stdout.flush()
-          fkey = '{}/{}/{}/Events'.format(eventselection,selectiontype,systematic)
-          f[fkey] = output_trees[eventselection][selectiontype][systematic]
+
+   # loop over chunks
+   for (entry_start, entry_stop) in chunks:
+    if dochunks: print('Now running on entries {} to {}'.format(entry_start, entry_stop))
+
+    # make NanoEvents array
+    print('Loading events from input file...')
+    events = load_events(args.inputfile, year, dtype,
+               entry_start=entry_start, entry_stop=entry_stop)
+    sys.stdout.flush()
+
+    # calculate additional variables and object masks
+    masks = select_objects(events, year, dtype, skimmed=args.skimmed)
+
+    # normalize the b-tag reweighter
+    if( dobtagnormalize and not dochunks ):
+      print('Normalizing b-tag reweighter')
+      sys.stdout.flush()
+      jets_for_init = events.Jet[masks['jet']]
+      btagreweighter.set_normalization(jets_for_init, unctypes=unctypes_for_init)
+
+    # find systematics for which alternative selections are needed
+    if dtype=='data': selection_systematics = {'nominal': ['nominal']}
+    else:
+      print('Finding systematics that need alternative selections')
+      selection_systematics = get_selection_systematics(events, args.systematics, includenominal=True)
+      print('Found following selection systematics:')
+      for selection_systematic, variations in selection_systematics.items():
+        print('  - {}'.format(selection_systematic))
+        if( len(variations)>1 or variations[0]!=selection_systematic ):
+          for variation in variations: print('    - {}'.format(variation))
+
+    # do event selection and calculate variables
+    output_trees = process_events(events, masks, args, year, dtype, selection_systematics,
+      reweighter=reweighter, sampleweights=sampleweights, nentries_reweight=nentries_reweight,
+      electronfrmap=electronfrmap, muonfrmap=muonfrmap, electroncfmap=electroncfmap)
+
+    # write output trees to file
+    # (extending the trees written for previous chunks)
+    write_output_trees(f, output_trees, written=written)
+
+  # add the output to the cache
+  if cache is not None:
+    print('Adding output to cache (key {})'.format(cachekey))
+    cache.store(cachekey, args.outputfile, metadata=cacheconfig)
 
   sys.stderr.write('###done###\n')
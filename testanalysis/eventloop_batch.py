@@ -12,10 +12,13 @@ sys.path.append(str(Path(__file__).parents[1]))
 from samples.samplelisttools import readsamplelist
 import tools.argparsetools as apt
 import jobsubmission.condortools as ct
+import jobsubmission.localtools as lt
 from jobsubmission.jobsettings import CMSSW_VERSION
 # import local modules
 sys.path.append(os.path.abspath('systematics'))
 from systematics_type import systematics_type
+from eventloop import get_cache_key, cache_code_paths
+import tools.outputcache as oc
 
 
 if __name__=='__main__':
@@ -33,7 +36,15 @@ if __name__=='__main__':
   parser.add_argument('--cfdir', default=None, type=apt.path_or_none)
   parser.add_argument('--bdt', default=None, type=apt.path_or_none)
   parser.add_argument('--skimmed', default=False, action='store_true')
+  parser.add_argument('--chunksize', default=-1, type=int)
+  parser.add_argument('--btagnormfile', default=None, type=apt.path_or_none)
+  parser.add_argument('--cachedir', default=None, type=apt.path_or_none)
+  parser.add_argument('--cachemaxsize', default=None, type=float)
+  parser.add_argument('--cachechecksum', default=False, action='store_true')
   parser.add_argument('--runmode', default='condor', choices=['condor','local'])
+  parser.add_argument('--nworkers', default=None, type=int)
+  parser.add_argument('--maxmem', default=None, type=int)
+  parser.add_argument('--retries', default=0, type=int)
   args = parser.parse_args()
 
   # print arguments
@@ -96,12 +107,34 @@ if __name__=='__main__':
     if not os.path.exists(args.bdt):
       raise Exception('ERROR: BDT file {} does not exist'.format(args.bdt))
 
+  # check b-tag normalization file
+  if( args.btagnormfile is not None ):
+    if not os.path.exists(args.btagnormfile):
+      raise Exception('ERROR: b-tag normalization file {} does not exist'.format(args.btagnormfile))
+
+  # initialize the output cache
+  cache = None
+  if args.cachedir is not None:
+    cache = oc.OutputCache(args.cachedir, maxsize=args.cachemaxsize)
+    codeversion = oc.code_version(cache_code_paths)
+    ncached = 0
+
   # loop over input files and submit jobs
   cmds = []
   for i, sample in enumerate(samples.samples):
     # define input and output file
     inputfile = sample.path
     outputfile = os.path.join(args.outputdir, os.path.basename(inputfile))
+    # check if the output is already in the cache
+    if cache is not None:
+      (cachekey, _) = get_cache_key(inputfile, args.eventselection, args.selectiontype,
+        systematics=args.systematics, nentries=args.nevents, skimmed=args.skimmed,
+        elfrmap=electronfrmap, mufrmap=muonfrmap, elcfmap=electroncfmap,
+        bdt=args.bdt, btagnormfile=args.btagnormfile,
+        checksum=args.cachechecksum, codeversion=codeversion)
+      if cache.fetch(cachekey, outputfile):
+        ncached += 1
+        continue
     # make the command
     cmd = 'python3 eventloop.py'
     cmd += ' -i {}'.format(inputfile)
@@ -115,11 +148,25 @@ if __name__=='__main__':
     if electroncfmap is not None: cmd += ' --elcfmap {}'.format(electroncfmap)
     if args.bdt is not None: cmd += ' --bdt {}'.format(args.bdt)
     if args.skimmed: cmd += ' --skimmed'
+    if args.chunksize > 0: cmd += ' --chunksize {}'.format(args.chunksize)
+    if args.btagnormfile is not None: cmd += ' --btagnormfile {}'.format(args.btagnormfile)
+    if cache is not None:
+      cmd += ' --cachedir {}'.format(args.cachedir)
+      if args.cachemaxsize is not None: cmd += ' --cachemaxsize {}'.format(args.cachemaxsize)
+      if args.cachechecksum: cmd += ' --cachechecksum'
     cmds.append(cmd)
 
+  # print cache summary
+  if cache is not None:
+    print('Found {} out of {} samples in the output cache.'.format(ncached, nsamples))
+    if len(cmds)==0:
+      print('Nothing to submit.')
+      sys.exit()
+
   # submit the jobs
   if args.runmode=='local':
-    for cmd in cmds: os.system(cmd)
+    lt.runCommandsLocally( 'cjob_eventloop', cmds,
+                           nworkers=args.nworkers, mem=args.maxmem, retries=args.retries )
   elif args.runmode=='condor':
     ct.submitCommandsAsCondorCluster( 'cjob_eventloop', cmds,
                                       cmssw_version=CMSSW_VERSION )
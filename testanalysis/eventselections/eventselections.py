@@ -23,6 +23,17 @@ from constants.particlemasses import m_Z
 
 
 def pass_event_selection(events, eventselection, **kwargs):
+    ### check which events pass a given event selection
+    # input arguments:
+    # - events: NanoEvents array
+    # - eventselection: name of the event selection
+    # - kwargs: passed down to the specific event selection function
+    #   (e.g. selectiontype, object masks, cutflow and cache).
+    # note on cache: if a dict is passed as cache argument,
+    #   the masks that depend only on the leptons (and event-level quantities like triggers)
+    #   are stored in it and reused in subsequent calls with the same selection type.
+    #   this is only valid as long as the leptons and lepton masks do not change,
+    #   e.g. for JEC/JER or unclustered energy variations, that only modify the jets and MET.
     if(eventselection=='signalregion_dilepton_inclusive'):
         return pass_signalregion_dilepton_inclusive(events, **kwargs)
     elif(eventselection=='signalregion_trilepton'):
@@ -44,12 +55,22 @@ def pass_event_selection(events, eventselection, **kwargs):
         msg += ' event selection {} not recognized.'.format(eventselection)
         raise Exception(msg)
 
-def pass_signalregion_dilepton_inclusive(events,
+def get_lepton_masks(f, events, selectiontype, cache=None, **kwargs):
+    ### internal helper function: get the lepton masks for an event selection
+    # input arguments:
+    # - f: function calculating the lepton masks (e.g. get_signalregion_dilepton_lepton_masks)
+    # - events, selectiontype and kwargs: passed down to f
+    # - cache: dict to store and look up the lepton masks (see pass_event_selection)
+    # returns: a new dict of masks, that can be extended or modified by the caller
+    if cache is None: return f(events, selectiontype=selectiontype, **kwargs)
+    key = (f.__name__, selectiontype)
+    if key not in cache: cache[key] = f(events, selectiontype=selectiontype, **kwargs)
+    return dict(cache[key])
+
+def get_signalregion_dilepton_lepton_masks(events,
     selectiontype='tight',
     electron_fo_mask=None, muon_fo_mask=None,
-    electron_tight_mask=None, muon_tight_mask=None,
-    jet_mask=None, bjet_mask=None,
-    cutflow=False):
+    electron_tight_mask=None, muon_tight_mask=None):
     # define masks
     metfilter_mask = tst.pass_met_filters(events)
     trigger_mask = tst.pass_any_lepton_trigger(events)
@@ -74,9 +95,6 @@ def pass_signalregion_dilepton_inclusive(events,
     zveto_mask = (
       (ak.sum(electron_fo_mask,axis=1)!=2)
       | (abs(invmass - m_Z) > 10.) )
-    met_mask = ( events.MET.pt > 30. )
-    nbjet_mask = (ak.sum(bjet_mask,axis=1) >= 2)
-    njet_mask = (ak.sum(jet_mask,axis=1) >= 3)
     # aggregate masks
     masks = {
       'MET filters': metfilter_mask,
@@ -88,11 +106,28 @@ def pass_signalregion_dilepton_inclusive(events,
       'pT thresholds': pt_mask,
       'Invariant mass veto': invmass_mask,
       'Same sign': ss_mask,
-      'Electron Z veto': zveto_mask,
-      'MET': met_mask,
-      'b-tagged jets': nbjet_mask,
-      'Jets': njet_mask
+      'Electron Z veto': zveto_mask
     }
+    return masks
+
+def pass_signalregion_dilepton_inclusive(events,
+    selectiontype='tight',
+    electron_fo_mask=None, muon_fo_mask=None,
+    electron_tight_mask=None, muon_tight_mask=None,
+    jet_mask=None, bjet_mask=None,
+    cutflow=False, cache=None):
+    # define masks
+    masks = get_lepton_masks(get_signalregion_dilepton_lepton_masks,
+      events, selectiontype, cache=cache,
+      electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
+      electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask)
+    met_mask = ( events.MET.pt > 30. )
+    nbjet_mask = (ak.sum(bjet_mask,axis=1) >= 2)
+    njet_mask = (ak.sum(jet_mask,axis=1) >= 3)
+    # aggregate masks
+    masks['MET'] = met_mask
+    masks['b-tagged jets'] = nbjet_mask
+    masks['Jets'] = njet_mask
     # return full set of masks for cutflow
     if cutflow: return masks
     # else return only total mask
@@ -195,12 +230,10 @@ def pass_signalregion_dilepton_minus(events,
     for key in maskkeys[1:]: totalmask = totalmask & masks[key]
     return totalmask
 
-def pass_signalregion_trilepton(events,
+def get_signalregion_trilepton_lepton_masks(events,
     selectiontype='tight',
     electron_fo_mask=None, muon_fo_mask=None,
-    electron_tight_mask=None, muon_tight_mask=None,
-    jet_mask=None, bjet_mask=None,
-    cutflow=False):
+    electron_tight_mask=None, muon_tight_mask=None):
     # define masks
     metfilter_mask = tst.pass_met_filters(events)
     trigger_mask = tst.pass_any_lepton_trigger(events)
@@ -215,8 +248,6 @@ def pass_signalregion_trilepton(events,
       electron_mask=electron_fo_mask, muon_mask=muon_fo_mask)
     zreco = ZReco(events, halfwindow=10., electron_mask=electron_fo_mask, muon_mask=muon_fo_mask)
     zveto_mask = ~zreco.has_ztoll_candidate()
-    nbjet_mask = (ak.sum(bjet_mask,axis=1) >= 2)
-    njet_mask = (ak.sum(jet_mask,axis=1) >= 3)
     # aggregate masks
     masks = {
       'MET filters': metfilter_mask,
@@ -226,10 +257,26 @@ def pass_signalregion_trilepton(events,
       'Photon overlap': photon_mask,
       '3 tight leptons': tight_mask,
       'pT thresholds': pt_mask,
-      'Z veto': zveto_mask,
-      'b-tagged jets': nbjet_mask,
-      'Jets': njet_mask
+      'Z veto': zveto_mask
     }
+    return masks
+
+def pass_signalregion_trilepton(events,
+    selectiontype='tight',
+    electron_fo_mask=None, muon_fo_mask=None,
+    electron_tight_mask=None, muon_tight_mask=None,
+    jet_mask=None, bjet_mask=None,
+    cutflow=False, cache=None):
+    # define masks
+    masks = get_lepton_masks(get_signalregion_trilepton_lepton_masks,
+      events, selectiontype, cache=cache,
+      electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
+      electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask)
+    nbjet_mask = (ak.sum(bjet_mask,axis=1) >= 2)
+    njet_mask = (ak.sum(jet_mask,axis=1) >= 3)
+    # aggregate masks
+    masks['b-tagged jets'] = nbjet_mask
+    masks['Jets'] = njet_mask
     # return full set of masks for cutflow
     if cutflow: return masks
     # else return only total mask
@@ -238,12 +285,10 @@ def pass_signalregion_trilepton(events,
     for key in maskkeys[1:]: totalmask = totalmask & masks[key]
     return totalmask
 
-def pass_trileptoncontrolregion(events,
+def get_trileptoncontrolregion_lepton_masks(events,
     selectiontype='tight',
     electron_fo_mask=None, muon_fo_mask=None,
-    electron_tight_mask=None, muon_tight_mask=None,
-    jet_mask=None, bjet_mask=None,
-    cutflow=False):
+    electron_tight_mask=None, muon_tight_mask=None):
     # define masks
     metfilter_mask = tst.pass_met_filters(events)
     trigger_mask = tst.pass_any_lepton_trigger(events)
@@ -269,6 +314,19 @@ def pass_trileptoncontrolregion(events,
       'pT thresholds': pt_mask,
       '3 candidate': z_mask
     }
+    return masks
+
+def pass_trileptoncontrolregion(events,
+    selectiontype='tight',
+    electron_fo_mask=None, muon_fo_mask=None,
+    electron_tight_mask=None, muon_tight_mask=None,
+    jet_mask=None, bjet_mask=None,
+    cutflow=False, cache=None):
+    # define masks
+    masks = get_lepton_masks(get_trileptoncontrolregion_lepton_masks,
+      events, selectiontype, cache=cache,
+      electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
+      electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask)
     # return full set of masks for cutflow
     if cutflow: return masks
     # else return only total mask
@@ -277,12 +335,10 @@ def pass_trileptoncontrolregion(events,
     for key in maskkeys[1:]: totalmask = totalmask & masks[key]
     return totalmask
 
-def pass_fourleptoncontrolregion(events,
+def get_fourleptoncontrolregion_lepton_masks(events,
     selectiontype='tight',
     electron_fo_mask=None, muon_fo_mask=None,
-    electron_tight_mask=None, muon_tight_mask=None,
-    jet_mask=None, bjet_mask=None,
-    cutflow=False):
+    electron_tight_mask=None, muon_tight_mask=None):
     # define masks
     metfilter_mask = tst.pass_met_filters(events)
     trigger_mask = tst.pass_any_lepton_trigger(events)
@@ -305,6 +361,19 @@ def pass_fourleptoncontrolregion(events,
       'pT thresholds': pt_mask,
       'Z candidate': z_mask
     }
+    return masks
+
+def pass_fourleptoncontrolregion(events,
+    selectiontype='tight',
+    electron_fo_mask=None, muon_fo_mask=None,
+    electron_tight_mask=None, muon_tight_mask=None,
+    jet_mask=None, bjet_mask=None,
+    cutflow=False, cache=None):
+    # define masks
+    masks = get_lepton_masks(get_fourleptoncontrolregion_lepton_masks,
+      events, selectiontype, cache=cache,
+      electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
+      electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask)
     # return full set of masks for cutflow
     if cutflow: return masks
     # else return only total mask
@@ -342,12 +411,10 @@ def pass_npcontrolregion_lownjets_dilepton_inclusive(events,
     for key in maskkeys[1:]: totalmask = totalmask & masks[key]
     return totalmask
 
-def pass_cfcontrolregion_inclusivejets(events,
+def get_cfcontrolregion_lepton_masks(events,
     selectiontype='tight',
     electron_fo_mask=None, muon_fo_mask=None,
-    electron_tight_mask=None, muon_tight_mask=None,
-    jet_mask=None, bjet_mask=None,
-    cutflow=False):
+    electron_tight_mask=None, muon_tight_mask=None):
     # define masks
     metfilter_mask = tst.pass_met_filters(events)
     trigger_mask = tst.pass_any_lepton_trigger(events)
@@ -377,6 +444,19 @@ def pass_cfcontrolregion_inclusivejets(events,
       'Same sign': ss_mask,
       'Z candidate': z_mask
     }
+    return masks
+
+def pass_cfcontrolregion_inclusivejets(events,
+    selectiontype='tight',
+    electron_fo_mask=None, muon_fo_mask=None,
+    electron_tight_mask=None, muon_tight_mask=None,
+    jet_mask=None, bjet_mask=None,
+    cutflow=False, cache=None):
+    # define masks
+    masks = get_lepton_masks(get_cfcontrolregion_lepton_masks,
+      events, selectiontype, cache=cache,
+      electron_fo_mask=electron_fo_mask, muon_fo_mask=muon_fo_mask,
+      electron_tight_mask=electron_tight_mask, muon_tight_mask=muon_tight_mask)
     # return full set of masks for cutflow
     if cutflow: return masks
     # else return only total mask
@@ -15,14 +15,19 @@ from tools.readfakeratetools import fakerateweight
 from tools.readchargefliptools import chargeflipweight
 from eventreconstruction.zreco import ZReco
 
-def calculate_event_variables(events,
+def calculate_lepton_variables(events,
     weights=None, nentries_reweight=1,
     electron_fo_mask=None, muon_fo_mask=None,
     electron_tight_mask=None, muon_tight_mask=None,
-    jet_mask=None, bjet_mask=None,
     electronfrmap=None, muonfrmap=None,
     electroncfmap=None ):
-    ### calculate event variables
+    ### calculate the event variables that do not depend on jets or MET
+    # returns: a dict with the following keys:
+    # - 'variables': dict of output variables that come first in the output
+    #   (event identifiers, generator weights, fake rate and charge flip weights)
+    # - 'nMuons' and 'nElectrons': number of FO leptons
+    # - 'leptonptsum': scalar sum of FO lepton pt (for LT)
+    # - 'nz': number of Z boson candidates
     res = {}
     # initializations
     nevents = ak.count(events.event)
@@ -59,6 +64,46 @@ def calculate_event_variables(events,
     # get object collections
     electrons = events.Electron[electron_fo_mask]
     muons = events.Muon[muon_fo_mask]
+    # number of Z boson candidates
+    nz = zreco.n_ztoll_candidates()
+    return {
+      'variables': res,
+      'nMuons': ak.sum(muon_fo_mask, axis=1),
+      'nElectrons': ak.sum(electron_fo_mask, axis=1),
+      'leptonptsum': ak.sum(ak.concatenate((electrons.pt, muons.pt), axis=1), axis=1),
+      'nz': nz
+    }
+
+def calculate_event_variables(events,
+    weights=None, nentries_reweight=1,
+    electron_fo_mask=None, muon_fo_mask=None,
+    electron_tight_mask=None, muon_tight_mask=None,
+    jet_mask=None, bjet_mask=None,
+    electronfrmap=None, muonfrmap=None,
+    electroncfmap=None,
+    cache=None ):
+    ### calculate event variables
+    # note: if a dict is passed as cache argument,
+    #   the variables that do not depend on jets or MET (see calculate_lepton_variables)
+    #   are stored in it and reused in subsequent calls.
+    #   this is only valid as long as the leptons and lepton masks do not change,
+    #   e.g. for JEC/JER or unclustered energy variations, that only modify the jets and MET.
+    lepton_kwargs = ({
+      'weights': weights, 'nentries_reweight': nentries_reweight,
+      'electron_fo_mask': electron_fo_mask, 'muon_fo_mask': muon_fo_mask,
+      'electron_tight_mask': electron_tight_mask, 'muon_tight_mask': muon_tight_mask,
+      'electronfrmap': electronfrmap, 'muonfrmap': muonfrmap,
+      'electroncfmap': electroncfmap
+    })
+    if cache is None: leptonvariables = calculate_lepton_variables(events, **lepton_kwargs)
+    else:
+        if 'leptonvariables' not in cache.keys():
+            cache['leptonvariables'] = calculate_lepton_variables(events, **lepton_kwargs)
+        leptonvariables = cache['leptonvariables']
+    res = dict(leptonvariables['variables'])
+    # initializations
+    nevents = ak.count(events.event)
+    # get object collections
     jets = events.Jet[jet_mask]
     bjets = events.Jet[bjet_mask]
     # number of jets
@@ -85,15 +130,14 @@ def calculate_event_variables(events,
     res['MET_pt'] = events.MET.pt
     res['MET_phi'] = events.MET.phi
     # number of muons
-    res['nMuons'] = ak.sum(muon_fo_mask, axis=1)
+    res['nMuons'] = leptonvariables['nMuons']
     # number of electrons
-    res['nElectrons'] = ak.sum(electron_fo_mask, axis=1)
+    res['nElectrons'] = leptonvariables['nElectrons']
     # scalar pt sums
     res['HT'] = ak.sum(jets.pt, axis=1)
-    res['LT'] = (ak.sum(ak.concatenate((electrons.pt, muons.pt), axis=1), axis=1)
-                  + events.MET.pt)
+    res['LT'] = leptonvariables['leptonptsum'] + events.MET.pt
     # number of Z boson candidates
-    nz = zreco.n_ztoll_candidates()
+    nz = leptonvariables['nz']
     # custom categorization variable for jets and b-jets
     njnb = -np.ones(nevents)
     njnb = ak.where(nbjets==0, np.clip(njets,0,4), njnb)
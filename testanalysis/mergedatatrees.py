@@ -12,23 +12,27 @@ from __future__ import annotations
 
 # Adapted from here (for NanoAOD files):
 # https://github.com/GhentAnalysis/nanoSkimming/blob/main/merging/haddnanodata.py
+# Duplicate events are identified by their (run, luminosityBlock, event) triplet,
+# packed into a single 64-bit integer key if the values allow it (else a 128-bit key).
+# The keys of all events written so far are kept in a set of sorted arrays
+# (see EventKeySet), in which new keys are looked up with np.searchsorted.
+# The trees (one per event selection, selection type and systematic) are processed
+# in parallel threads, each input file being opened only once;
+# the chunks to write are passed to the main thread (see hadddata).
 
 import sys
 import os
-import math
-from functools import partial
+import time
+import queue
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from typing import List
 import numpy as np
 import awkward as ak
 import uproot
 
-try:
-    import tqdm
-    HAS_TQDM = True
-except ImportError:
-    HAS_TQDM = False
-
 
 def find_tree_names(
     input_paths: List[str]
@@ -49,12 +53,96 @@ def find_tree_names(
     return treenames
 
 
+def get_key_layout(
+    trees: List[Any],
+    step_size: int = 100000
+    ) -> List[int] | None:
+    ### determine how to pack (run, luminosityBlock, event) into a single key
+    # returns: the number of bits for run, luminosityBlock and event
+    #          if they fit in a 64-bit key, else None (meaning a 128-bit key is used).
+    # note: the maximum values are determined from all trees,
+    #       so that the keys of all trees are consistent.
+    maxvalues = [0, 0, 0]
+    columns = ["run", "luminosityBlock", "event"]
+    for tree in trees:
+        if tree.num_entries==0: continue
+        for chunk in tree.iterate(columns, step_size=step_size, library='np'):
+            for idx, column in enumerate(columns):
+                maxvalues[idx] = max(maxvalues[idx], int(np.max(chunk[column])))
+    bits = [max(1, maxvalue.bit_length()) for maxvalue in maxvalues]
+    if sum(bits) > 64: return None
+    return bits
+
+
+def make_event_keys(
+    run: np.ndarray,
+    lumi: np.ndarray,
+    event: np.ndarray,
+    layout: List[int] | None
+    ) -> np.ndarray:
+    ### pack (run, luminosityBlock, event) triplets into a single key per event
+    # input arguments:
+    # - run, lumi, event: arrays of run, luminosity block and event numbers
+    # - layout: output of get_key_layout
+    # returns: an array of uint64 keys (if layout is not None)
+    #          or of 16-byte keys (run and luminosity block in the first 8 bytes,
+    #          event number in the last 8 bytes, big-endian so that the byte order
+    #          used for sorting and searching is consistent).
+    run = np.asarray(run).astype(np.uint64)
+    lumi = np.asarray(lumi).astype(np.uint64)
+    event = np.asarray(event).astype(np.uint64)
+    if layout is not None:
+        (_, lumibits, eventbits) = layout
+        return ( (run << np.uint64(lumibits+eventbits))
+                 | (lumi << np.uint64(eventbits))
+                 | event )
+    keys = np.empty(len(run), dtype=[('hi', '>u8'), ('lo', '>u8')])
+    keys['hi'] = (run << np.uint64(32)) | lumi
+    keys['lo'] = event
+    return keys.view('V16')
+
+
+class EventKeySet(object):
+    ### set of event keys with fast insertion and lookup
+    # the keys are stored in a small number of sorted arrays of decreasing size;
+    # new keys are added as a new array, after which the last arrays are merged
+    # as long as they have similar sizes.
+    # this keeps the number of arrays logarithmic in the number of keys,
+    # with amortized O(log n) cost per inserted key
+    # (rather than re-sorting or concatenating the full set for every chunk).
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum([len(run) for run in self.runs])
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        ### return a boolean mask of which keys are in the set
+        mask = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            idx = np.searchsorted(run, keys)
+            idx[idx==len(run)] = 0
+            mask |= (run[idx]==keys)
+        return mask
+
+    def add(self, keys: np.ndarray) -> None:
+        ### add keys to the set
+        if len(keys)==0: return
+        self.runs.append(np.sort(keys))
+        while( len(self.runs)>1 and 2*len(self.runs[-1]) >= len(self.runs[-2]) ):
+            last = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate((self.runs[-1], last)))
+
+
 def hadddata(
     output_path: str,
     input_paths: List[str],
     force: bool = False,
     keep_branches: List[str] | None = None,
     step_size: int = 100000,
+    nthreads: int = 4,
+    max_queue_size: int = 16,
     verbose: bool = False,
 ) -> None:
 
@@ -91,81 +179,160 @@ def hadddata(
             msg = 'WARNING: overwriting existing file {}...'.format(output_path)
             print(msg)
             os.remove(output_path)
-    output_file = uproot.create(output_path)
 
-    # loop over tree names
+    # open all input files once
+    # note: the files are kept open for all trees, and closed at the end.
     treenames = sorted(find_tree_names(input_paths))
     if verbose:
         print('Found following tree names in input files:')
-        for treename in treenames: print('  - {}'.format(treenames))
-    for treename in treenames:
-        if verbose: print('Now running on tree {}'.format(treename))
-
-        # get trees from input files
-        # note: it is convenient to make sure that the first tree in the list is not empty
-        #       in order to correctly initialize the output tree and safely use extend.
-        # note: remaining problem: if all trees are empty, the output tree is not written.
-        trees = [uproot.open(input_path)[treename] for input_path in input_paths]
-        temp = [tree.num_entries for tree in trees]
-        sorted_ids = np.argsort(temp)[::-1]
+        for treename in treenames: print('  - {}'.format(treename))
+    nthreads = max(1, min(nthreads, len(treenames)))
+    if verbose: print('Merging {} trees using {} threads'.format(len(treenames), nthreads))
+    start_time = time.time()
+    with contextlib.ExitStack() as stack:
+        input_files = [stack.enter_context(uproot.open(input_path)) for input_path in input_paths]
+        output_file = stack.enter_context(uproot.create(output_path))
+
+        # read the trees in parallel and write them in the main thread
+        # note: uproot writing is not thread-safe, so all chunks to write are passed
+        #       to the main thread through a queue; the queue is bounded
+        #       to limit the memory used by chunks waiting to be written.
+        # note: if writing fails in the main thread, the worker threads are cancelled
+        #       and the queue is drained until they have finished,
+        #       since otherwise they could block forever on the full queue.
+        chunk_queue = queue.Queue(maxsize=max_queue_size)
+        cancel = threading.Event()
+        stats = {}
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            futures = [executor.submit(read_tree, treename,
+                         [f[treename] for f in input_files], chunk_queue,
+                         step_size=step_size, keep_branches=keep_branches,
+                         cancel=cancel)
+                       for treename in treenames]
+            try:
+                ndone = 0
+                while ndone < len(treenames):
+                    (treename, chunk, treestats) = chunk_queue.get()
+                    # end of a tree
+                    if chunk is None:
+                        ndone += 1
+                        if treestats is None: continue
+                        stats[treename] = treestats
+                        if verbose: print_tree_stats(treename, treestats, ndone, len(treenames))
+                        continue
+                    # write the chunk
+                    if treename in stats: output_file[treename].extend(chunk)
+                    else:
+                        output_file[treename] = chunk
+                        stats[treename] = None
+            except BaseException:
+                cancel.set()
+                while not all([future.done() for future in futures]):
+                    try: chunk_queue.get(timeout=0.1)
+                    except queue.Empty: pass
+                raise
+            # raise exceptions from the worker threads (if any)
+            for future in futures: future.result()
+
+    # print summary
+    if verbose:
+        duration = time.time() - start_time
+        nread = sum([s['n_read'] for s in stats.values() if s is not None])
+        print('Merged {} trees ({} events read) in {:.1f} seconds ({:.0f} events/s)'.format(
+          len(treenames), nread, duration, nread/max(duration, 1e-6)))
+
+
+def read_tree(
+    treename: str,
+    trees: List[Any],
+    chunk_queue: queue.Queue,
+    step_size: int = 100000,
+    keep_branches: List[str] | None = None,
+    cancel: threading.Event | None = None
+    ) -> None:
+    ### read chunks of the same tree from all input files and remove duplicate events
+    # the chunks to write are put in the queue as (treename, chunk, None) tuples,
+    # followed by a (treename, None, stats) tuple at the end of the tree
+    # (stats is None in case of an error).
+    # if cancel is set (e.g. because writing failed), reading stops
+    # and nothing more is put in the queue.
+    # note: the trees are processed in order of decreasing number of entries,
+    #       so that the first chunk is not empty and the output tree is initialized
+    #       correctly (if all trees are empty, the output tree is not written).
+    stats = None
+    try:
+        start_time = time.time()
+        sorted_ids = np.argsort([tree.num_entries for tree in trees])[::-1]
         trees = [trees[idx] for idx in sorted_ids]
-        tree1 = trees[0]
 
-        # read index columns over the full reference file
-        index = tree1.arrays(index_columns)
+        # determine how to pack the index columns into keys
+        layout = get_key_layout(trees, step_size=step_size)
+        seen = EventKeySet()
 
         # prepare counts
+        n_read = 0
         n_written = 0
         n_overlap = 0
 
-        # iteration helper
-        def iterate(tree, ntree, ntrees):
-            if verbose:
-                print(f"  Iterating through tree {ntree}/{ntrees} with {tree.num_entries} events")
-            # safety for empty trees
-            if tree.num_entries==0:
-                #chunk = {}
-                #for key in tree.keys(): chunk[key] = np.zeros(0)
-                #chunk = ak.Array(chunk)
-                #return [chunk]
-                return []
-            progress = (
-                partial(tqdm.tqdm, total=int(math.ceil(tree.num_entries / step_size)))
-                if( verbose and HAS_TQDM ) else (lambda gen: gen) )
-            return progress(tree.iterate(step_size=step_size, filter_name=keep_branches))
-
-        # fill chunks of the first tree
-        for chunk in iterate(tree1, 1, len(trees)):
-            # update counts
-            n_written += len(chunk)
-            # extend the output tree
-            chunk = dict(zip(chunk.fields, ak.unzip(chunk)))
-            output_keys = [key.split(';')[0] for key in output_file.keys()]
-            if treename in output_keys: output_file[treename].extend(chunk)
-            else: output_file[treename] = chunk
-
-        # fill chunks of the other trees
-        for idx, tree in enumerate(trees[1:]):
-            for chunk in iterate(tree, idx+2, len(trees)):
-                # determine a mask of events in tree that are also in tree1
-                mask = np.isin(chunk[index_columns], index, assume_unique=True)
-                chunk = chunk[~mask]
-                # update counts
-                n_written += len(chunk)
-                n_overlap += ak.sum(mask)
+        # loop over trees and chunks
+        for tree in trees:
+            if tree.num_entries==0: continue
+            for chunk in tree.iterate(step_size=step_size, filter_name=keep_branches):
+                if cancel is not None and cancel.is_set(): return
+                n_read += len(chunk)
+                # determine a mask of events that were already written
+                keys = make_event_keys(
+                  chunk["run"], chunk["luminosityBlock"], chunk["event"], layout)
+                mask = seen.contains(keys)
+                n_overlap += int(np.sum(mask))
                 # skip the chunk if all events are overlapping
-                if ak.all(mask): continue
-                # extend the output tree
-                chunk = dict(zip(chunk.fields, ak.unzip(chunk)))
-                output_file[treename].extend(chunk)
+                if np.all(mask): continue
+                if np.any(mask): chunk = chunk[~mask]
+                n_written += len(chunk)
                 # update the index
-                chunkindex = {key: chunk[key] for key in index_columns}
-                chunkindex = ak.Array(chunkindex)
-                index = ak.concatenate((index, chunkindex))
+                seen.add(keys[~mask])
+                # pass the chunk to the writer
+                chunk = dict(zip(chunk.fields, ak.unzip(chunk)))
+                if not put_in_queue(chunk_queue, (treename, chunk, None), cancel): return
+
+        stats = ({
+          'n_read': n_read,
+          'n_written': n_written,
+          'n_overlap': n_overlap,
+          'time': time.time() - start_time
+        })
+    finally:
+        put_in_queue(chunk_queue, (treename, None, stats), cancel)
+
+
+def put_in_queue(
+    chunk_queue: queue.Queue,
+    item: Any,
+    cancel: threading.Event | None = None,
+    timeout: float = 0.1
+    ) -> bool:
+    ### put an item in a bounded queue, unless cancel is set while waiting
+    # returns: whether the item was put in the queue
+    while True:
+        if cancel is not None and cancel.is_set(): return False
+        try:
+            chunk_queue.put(item, timeout=timeout)
+            return True
+        except queue.Full: continue
 
-        if verbose:
-            print(f"  Written {n_written} and found {n_overlap} overlapping event(s)")
 
+def print_tree_stats(
+    treename: str,
+    stats: dict,
+    ndone: int,
+    ntrees: int
+    ) -> None:
+    ### print counts and throughput for a merged tree
+    rate = stats['n_read'] / max(stats['time'], 1e-6)
+    print('  [{}/{}] {}: read {}, written {}, overlapping {} events'.format(
+      ndone, ntrees, treename, stats['n_read'], stats['n_written'], stats['n_overlap'])
+      + ' in {:.1f} seconds ({:.0f} events/s)'.format(stats['time'], rate))
+    sys.stdout.flush()
 
 if __name__ == "__main__":
    
@@ -181,8 +348,10 @@ if __name__ == "__main__":
         help="Whether to overwrite output file if it already exists")
     parser.add_argument("--step-size", "-s", type=int, default=100000,
         help="step size for iterations; default: 100000")
+    parser.add_argument("--nthreads", "-j", type=int, default=4,
+        help="number of trees to process in parallel; default: 4")
     parser.add_argument("--verbose", "-v", default=False, action="store_true",
-        help="verbose output, potentially with tqdm if installed")
+        help="verbose output, including throughput per tree")
     args = parser.parse_args()
 
     # print arguments
@@ -199,4 +368,5 @@ if __name__ == "__main__":
         force=args.force,
         keep_branches=keep_branches,
         step_size=args.step_size,
+        nthreads=args.nthreads,
         verbose=args.verbose )
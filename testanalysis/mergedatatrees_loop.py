@@ -8,6 +8,7 @@ from pathlib import Path
 # import framework modules
 sys.path.append(str(Path(__file__).parents[1]))
 import jobsubmission.condortools as ct
+import jobsubmission.localtools as lt
 from jobsubmission.jobsettings import CMSSW_VERSION
 
 
@@ -50,7 +51,7 @@ if __name__=='__main__':
 
   # run the commands or submit the jobs
   if runmode=='local':
-    for cmd in cmds: os.system(cmd)
+    lt.runCommandsLocally( 'cjob_mergedatatrees', cmds )
   elif runmode=='condor':
     ct.submitCommandsAsCondorCluster( 'cjob_mergedatatrees', cmds,
                                       cmssw_version=CMSSW_VERSION )
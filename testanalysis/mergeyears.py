@@ -5,10 +5,14 @@
 #       taking into account systematics and correlations to be implemented later
 #       using combine tools.
 # Note: should be run after mergehists_submit.py.
+# Note: the histograms are summed in memory (see tools/histmerger.py),
+#       so no ROOT installation (hadd) is needed.
 
 import sys
 import os
 import argparse
+sys.path.append('../tools')
+import histmerger as hm
 
 if __name__=='__main__':
 
@@ -16,6 +20,8 @@ if __name__=='__main__':
   parser = argparse.ArgumentParser(description='Merge years')
   parser.add_argument('--directory', required=True, type=os.path.abspath)
   parser.add_argument('--filemode', default='combined', choices=['combined','split'])
+  parser.add_argument('--nworkers', default=1, type=int,
+    help='Number of processes to use for reading and summing histograms')
   args = parser.parse_args()
 
   # print arguments
@@ -33,7 +39,8 @@ if __name__=='__main__':
   if args.filemode=='split': 
     regions = os.listdir(os.path.join(args.directory,years[0]))
 
-  # loop over combinations
+  # find all combinations to merge
+  merges = []
   for region in regions:
     for npmode in npmodes:
       for cfmode in cfmodes:
@@ -51,9 +58,12 @@ if __name__=='__main__':
         if not allfiles: continue
         # define output file
         outdir = os.path.join(args.directory,'run2',region,'merged_{}_{}'.format(npmode,cfmode))
-        if not os.path.exists(outdir): os.makedirs(outdir)
         outf = os.path.join(outdir,'merged.root')
-        # do hadd
-        cmd = 'hadd -f {}'.format(outf)
-        for f in hfiles: cmd += ' {}'.format(f)
-        os.system(cmd)
+        merges.append((hfiles, outf))
+
+  # do the merging
+  for idx, (hfiles, outf) in enumerate(merges):
+    print('Merging {}/{}: {}'.format(idx+1, len(merges), outf))
+    sys.stdout.flush()
+    nhists = hm.merge_histograms(hfiles, outf, nworkers=args.nworkers)
+    print('  - wrote {} histograms'.format(nhists))
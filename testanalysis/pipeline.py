@@ -0,0 +1,282 @@
+#############################################################
+# Run the full analysis chain with incremental re-execution #
+#############################################################
+# Alternative to chain.py: the steps of the chain
+# (eventloop -> mergedatatrees -> binner -> mergedatasim -> mergehists)
+# are modeled as a pipeline of tasks with explicit inputs, outputs and configuration,
+# see tools/pipelinetools.py.
+# The eventloop and binner steps are split into one task per sample,
+# the mergedatatrees step into one task per data-taking era,
+# and the mergehists step into one task per region and background mode,
+# so that independent tasks can run in parallel
+# and only the tasks affected by a change are re-executed.
+# Invalidation is based on the commands and on the content of the configuration files
+# (e.g. the variable json file, the systematics definitions and the fake rate maps).
+# The sample lists enter through the per-sample commands
+# (sample name, cross-section and process), so adding a sample or changing its
+# cross-section only re-runs the tasks for that sample and the merging steps downstream.
+# How to use:
+# - check the settings below (same as in the separate *_loop.py scripts).
+# - run "python3 pipeline.py -o <output directory> --dry-run" to see which tasks would run.
+# - run "python3 pipeline.py -o <output directory>" to run them
+#   (see chain.py for how to run in the background).
+# - use "--force <name>" to re-run tasks anyway (e.g. after changing the code),
+#   where <name> is a task name or a prefix (e.g. "binner" for all binner tasks).
+# Note: the state of the pipeline is stored in <output directory>/pipeline_state.json,
+#       and the log of each task in <output directory>/pipeline_state_logs.
+
+# import python modules
+import sys
+import os
+import argparse
+import functools
+import threading
+from pathlib import Path
+# import framework modules
+sys.path.append(str(Path(__file__).parents[1]))
+from samples.samplelisttools import readsamplelist
+from constants.luminosities import lumidict
+from tools.pipelinetools import Pipeline, Task, run_task_locally
+import jobsubmission.condortools as ct
+from jobsubmission.jobtracker import JobTracker
+from jobsubmission.jobsettings import CMSSW_VERSION
+# import local modules
+from mergedatasim import mergefolders
+
+
+# settings for the eventloop step (see eventloop_loop.py)
+regions = ([
+  'signalregion_dilepton_inclusive',
+  'signalregion_trilepton',
+  'trileptoncontrolregion',
+  'fourleptoncontrolregion',
+  'npcontrolregion_met_dilepton_inclusive',
+  'npcontrolregion_lownjets_dilepton_inclusive',
+  'cfcontrolregion_inclusivejets',
+  'cfcontrolregion_highnjets'
+])
+years = ['2018']
+selectiontypes = ['tight', 'fakerate', 'chargeflips', 'irreducible']
+dtypes = ['sim', 'data']
+inputdir = '/pnfs/iihe/cms/store/user/llambrec/nanoaodskims_merged'
+frdir = '../data/fakerates/fakeRateMaps_v20220912_tttt'
+cfdir = '../data/chargefliprates/chargeFlipMaps_v20221109'
+samplelistdir = 'samplelists'
+samplelistbase = {'sim': 'samplelist_ttw_{}_sim.txt',
+                  'data': 'samplelist_ttw_{}_datasplit.txt',
+                  'datamerged': 'samplelist_ttw_{}_datamerged.txt'}
+bdtfile = None
+nevents = 1e5
+skimmed = True
+systematics = ['all']
+systematicsfile = 'systematics/systematics_type.py'
+
+# settings for the binner step (see binner_loop.py)
+variables = 'variables/variables_test.json'
+
+# settings for the mergehists step (see mergehists_loop.py)
+npmodes = ['npfromdata']
+cfmodes = ['cffromdata']
+rename = 'processes/rename_processes.json'
+renamemode = 'fast'
+decorrelate = 'correlations/correlations.json'
+decorrelatemode = 'fast'
+selectmode = 'noselect'
+doclip = True
+
+
+def read_samples(year, listtype):
+  ### read the samples in a sample list
+  # note: the sample paths are not checked here, as they may not exist yet.
+  samplelist = os.path.join(samplelistdir, samplelistbase[listtype].format(year))
+  return readsamplelist(samplelist, sampledir=None, doyear=True).get_samples()
+
+def add_eventloop_tasks(pipeline, outputdir, year, dtype):
+  ### add one eventloop task per sample
+  treedir = os.path.join(outputdir, '{}_{}_trees'.format(year, dtype))
+  configfiles = [systematicsfile]
+  muonfrmap = None
+  electronfrmap = None
+  electroncfmap = None
+  if 'fakerate' in selectiontypes:
+    muonfrmap = os.path.abspath(os.path.join(frdir, 'fakeRateMap_data_muon_'+year+'_mT.root'))
+    electronfrmap = os.path.abspath(os.path.join(frdir, 'fakeRateMap_data_electron_'+year+'_mT.root'))
+    configfiles += [muonfrmap, electronfrmap]
+  if 'chargeflips' in selectiontypes:
+    electroncfmap = os.path.abspath(os.path.join(cfdir, 'chargeFlipMap_MC_electron_'+year+'.root'))
+    configfiles.append(electroncfmap)
+  if bdtfile is not None: configfiles.append(bdtfile)
+  for sample in read_samples(year, dtype):
+    inputfile = os.path.join(inputdir, sample.name)
+    outputfile = os.path.join(treedir, sample.name)
+    cmd = 'mkdir -p {} &&'.format(treedir)
+    cmd += ' python3 eventloop.py'
+    cmd += ' -i {}'.format(inputfile)
+    cmd += ' -o {}'.format(outputfile)
+    cmd += ' -s {}'.format(' '.join(regions))
+    cmd += ' -t {}'.format(' '.join(selectiontypes))
+    if( nevents is not None and nevents > 0 ): cmd += ' -n {}'.format(int(nevents))
+    if len(systematics) > 0: cmd += ' --systematics {}'.format(' '.join(systematics))
+    if muonfrmap is not None: cmd += ' --mufrmap {}'.format(muonfrmap)
+    if electronfrmap is not None: cmd += ' --elfrmap {}'.format(electronfrmap)
+    if electroncfmap is not None: cmd += ' --elcfmap {}'.format(electroncfmap)
+    if bdtfile is not None: cmd += ' --bdt {}'.format(os.path.abspath(bdtfile))
+    if skimmed: cmd += ' --skimmed'
+    pipeline.add_task(Task('eventloop/{}_{}/{}'.format(year, dtype, sample.name), cmd,
+      outputs=[outputfile], configfiles=configfiles))
+
+def add_mergedatatrees_tasks(pipeline, outputdir, year):
+  ### add one mergedatatrees task per data-taking era
+  # note: same grouping as in mergedatatrees_loop.py
+  treedir = os.path.join(outputdir, '{}_data_trees'.format(year))
+  dfiles = [sample.name for sample in read_samples(year, 'data')]
+  eras = sorted(list(set([f.split('_')[-1].replace('.root','') for f in dfiles])))
+  for era in eras:
+    outputfile = os.path.join(treedir, 'Data_{}.root'.format(era))
+    inputfiles = [os.path.join(treedir, f) for f in dfiles if era in f]
+    cmd = 'python3 mergedatatrees.py'
+    cmd += ' -o {}'.format(outputfile)
+    cmd += ' -i {}'.format(' '.join(inputfiles))
+    cmd += ' -f -v'
+    pipeline.add_task(Task('mergedatatrees/{}/{}'.format(year, era), cmd,
+      inputs=inputfiles, outputs=[outputfile]))
+
+def add_binner_tasks(pipeline, outputdir, year, dtype):
+  ### add one binner task per sample
+  # note: the binner output is split in folders per region and selection type,
+  #       which are not known in advance, so no outputs are declared.
+  treedir = os.path.join(outputdir, '{}_{}_trees'.format(year, dtype))
+  binneddir = treedir.replace('_trees', '_binned')
+  listtype = 'datamerged' if dtype=='data' else dtype
+  for sample in read_samples(year, listtype):
+    inputfile = os.path.join(treedir, sample.name)
+    outputfile = os.path.join(binneddir, sample.name.replace('.root', '_binned.root'))
+    cmd = 'python3 binner.py'
+    cmd += ' -i {}'.format(inputfile)
+    cmd += ' -o {}'.format(outputfile)
+    cmd += ' -v {}'.format(os.path.abspath(variables))
+    cmd += ' -s auto -t auto --systematics auto'
+    cmd += ' --xsec {}'.format(sample.xsec)
+    cmd += ' --lumi {}'.format(lumidict[year])
+    cmd += ' --process {}'.format(sample.process)
+    cmd += ' --split'
+    pipeline.add_task(Task('binner/{}_{}/{}'.format(year, dtype, sample.name), cmd,
+      inputs=[inputfile], configfiles=[variables]))
+
+def add_mergedatasim_task(pipeline, outputdir, year):
+  ### add a task for merging the simulation and data folders
+  # note: the original folders are kept (hard links are used),
+  #       so that the binner tasks do not need to be re-run.
+  deps = [name for name in pipeline.tasks.keys()
+          if name.startswith('binner/{}_'.format(year))]
+  pipeline.add_task(Task('mergedatasim/{}'.format(year),
+    functools.partial(mergefolders, outputdir, [year], False),
+    outputs=[os.path.join(outputdir, '{}_binned'.format(year))],
+    deps=deps, configvalues={'remove': False}))
+
+def add_mergehists_tasks(pipeline, outputdir, year):
+  ### add one mergehists task per region and background mode
+  # note: same settings as in mergehists_loop.py
+  yeardir = os.path.join(outputdir, '{}_binned'.format(year))
+  configfiles = [f for f in [rename, decorrelate] if f is not None]
+  for region in regions:
+    for npmode in npmodes:
+      for cfmode in cfmodes:
+        regiondir = os.path.join(yeardir, region)
+        outputfile = os.path.join(regiondir, 'merged_{}_{}'.format(npmode,cfmode), 'merged.root')
+        cmd = 'python3 mergehists.py'
+        cmd += ' -d '+regiondir
+        cmd += ' -o '+outputfile
+        cmd += ' --npmode '+npmode
+        cmd += ' --cfmode '+cfmode
+        cmd += ' --split'
+        if rename is not None:
+          cmd += ' --rename '+os.path.abspath(rename)
+          cmd += ' --renamemode '+renamemode
+        if decorrelate is not None:
+          cmd += ' --decorrelate '+os.path.abspath(decorrelate)
+          cmd += ' --decorrelatemode '+decorrelatemode
+          cmd += ' --decorrelateyear '+year
+        cmd += ' --selectmode '+selectmode
+        if doclip: cmd += ' --doclip'
+        cmd += ' --runmode local'
+        pipeline.add_task(Task('mergehists/{}/{}/{}_{}'.format(year, region, npmode, cfmode),
+          cmd, outputs=[outputfile], deps=['mergedatasim/{}'.format(year)],
+          configfiles=configfiles))
+
+def make_pipeline(outputdir):
+  ### make the full pipeline
+  pipeline = Pipeline(os.path.join(outputdir, 'pipeline_state.json'))
+  for year in years:
+    for dtype in dtypes: add_eventloop_tasks(pipeline, outputdir, year, dtype)
+    if 'data' in dtypes: add_mergedatatrees_tasks(pipeline, outputdir, year)
+    for dtype in dtypes: add_binner_tasks(pipeline, outputdir, year, dtype)
+    add_mergedatasim_task(pipeline, outputdir, year)
+    add_mergehists_tasks(pipeline, outputdir, year)
+  pipeline.resolve()
+  return pipeline
+
+
+submitlock = threading.Lock()
+
+# time in seconds after which held condor jobs are considered as failed
+HELD_TIMEOUT = 3600
+
+def run_task_on_condor(task, logfile):
+  ### submit a task as a condor job and wait for it to finish
+  # note: python callables are run locally.
+  if not isinstance(task.command, str): return run_task_locally(task, logfile)
+  name = 'cjob_pipeline_{}'.format(task.name.replace('/','_'))
+  with submitlock:
+    clusterid = ct.submitCommandAsCondorJob(name, task.command, cmssw_version=CMSSW_VERSION)
+  if clusterid is None: return 1
+  log = '{}_log_{}_0'.format(name, clusterid)
+  with open(logfile, 'w') as f:
+    f.write('Submitted as condor job {}.0, see {}\n'.format(clusterid, log))
+  # note: a job that is held for longer than the grace period is considered as failed.
+  tracker = JobTracker([{'clusterid': clusterid, 'procid': 0, 'log': log}],
+              heldtimeout=HELD_TIMEOUT)
+  tracker.wait(interval=30)
+  if len(tracker.heldJobs())>0:
+    with open(logfile, 'a') as f:
+      f.write('Condor job {}.0 was held for more than {} seconds,'.format(clusterid, HELD_TIMEOUT)
+              + ' considering it as failed.\n')
+  returnvalue = tracker.jobs[(clusterid, 0)]['returnvalue']
+  return returnvalue if returnvalue is not None else 1
+
+
+if __name__=='__main__':
+
+  # parse arguments
+  parser = argparse.ArgumentParser(description='Run the analysis chain incrementally')
+  parser.add_argument('-o', '--outputdir', required=True, type=os.path.abspath)
+  parser.add_argument('-j', '--nworkers', default=None, type=int,
+    help='Maximum number of tasks to run simultaneously'
+        +' (default: number of cores in local mode, unlimited in condor mode).')
+  parser.add_argument('--runmode', default='condor', choices=['condor','local'])
+  parser.add_argument('--force', default=[], nargs='+',
+    help='Names (or prefixes of names) of tasks to re-run anyway.')
+  parser.add_argument('--dry-run', default=False, action='store_true')
+  args = parser.parse_args()
+
+  # print arguments
+  print('Running with following configuration:')
+  for arg in vars(args):
+    print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+  # make the pipeline
+  if not os.path.exists(args.outputdir): os.makedirs(args.outputdir)
+  pipeline = make_pipeline(args.outputdir)
+
+  # set the executor
+  executor = run_task_locally
+  nworkers = args.nworkers
+  if args.runmode=='condor':
+    executor = run_task_on_condor
+    if nworkers is None: nworkers = len(pipeline.tasks)
+  if nworkers is None: nworkers = os.cpu_count()
+
+  # run the pipeline
+  status = pipeline.run(executor=executor, nworkers=nworkers,
+             force=args.force, dryrun=args.dry_run)
+  if any([s in ['failed', 'skipped'] for s in status.values()]): sys.exit(1)
@@ -0,0 +1,58 @@
+###########################################
+# Test the I/O profile of binner.py input #
+###########################################
+# Synthetic input trees are written both as TTree and as RNTuple
+# (the format written by recent uproot versions, e.g. for the output of eventloop.py),
+# and the byte counts from binner.get_io_profile are checked for both.
+
+# imports
+import sys
+import os
+import tempfile
+import numpy as np
+import uproot
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]/'testanalysis'))
+from binner import get_io_profile
+
+
+def check(condition, msg):
+    if not condition: raise Exception('ERROR: {}'.format(msg))
+    print('  - OK: {}'.format(msg))
+
+
+if __name__=='__main__':
+
+    nevents = 10000
+    rng = np.random.default_rng(seed=1)
+    data = {
+      'eventWeight': rng.normal(size=nevents),
+      'nJets': rng.integers(0, 10, size=nevents).astype(np.int32),
+      'leptonPt': rng.exponential(30., size=nevents).astype(np.float32)
+    }
+    # expected number of uncompressed bytes per field (for RNTuple)
+    nbytes = {key: val.nbytes for key, val in data.items()}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputfile = os.path.join(tmpdir, 'input.root')
+        with uproot.recreate(inputfile) as f:
+            f.mktree('ttree/Events', {key: val.dtype for key, val in data.items()})
+            f['ttree/Events'].extend(data)
+            f['rntuple/Events'] = data
+        with uproot.open(inputfile) as f:
+            for name in ['ttree', 'rntuple']:
+                print('Testing I/O profile for {}:'.format(name))
+                tree = f[name]['Events']
+                profile = get_io_profile(tree, ['nJets', 'leptonPt'])
+                check(profile['total_compressed']>0 and profile['total_uncompressed']>0,
+                      'non-zero total size')
+                check(0 < profile['read_compressed'] < profile['total_compressed']
+                      and 0 < profile['read_uncompressed'] < profile['total_uncompressed'],
+                      'read size smaller than total size')
+                profile = get_io_profile(tree, tree.keys())
+                check(profile['read_compressed']==profile['total_compressed']
+                      and profile['read_uncompressed']==profile['total_uncompressed'],
+                      'read size equal to total size when reading all branches')
+                if name=='rntuple':
+                    check(profile['total_uncompressed']==sum(nbytes.values()),
+                          'uncompressed size equal to size of the data')
+    print('All checks passed.')
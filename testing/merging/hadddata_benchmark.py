@@ -0,0 +1,144 @@
+##########################################################
+# Benchmark duplicate removal in mergedatatrees.hadddata #
+##########################################################
+# Synthetic trees are made that mimic the eventloop output of overlapping
+# primary datasets (i.e. a fraction of the events is present in multiple files).
+# The duplicate removal is timed for:
+#   - the old approach: np.isin on awkward record arrays of (event, run, luminosityBlock),
+#     growing the index with ak.concatenate after every chunk,
+#   - the current approach: packed event keys in an EventKeySet (see mergedatatrees.py).
+# Both are run on the same in-memory chunks (without file I/O),
+# and the full hadddata function is run on the synthetic files
+# to check the number of written events.
+# Note: the old approach is only run if the number of events is small enough,
+#       since it scales quadratically.
+
+# imports
+import sys
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import awkward as ak
+import uproot
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]/'testanalysis'))
+from mergedatatrees import hadddata, make_event_keys, EventKeySet
+
+
+def make_datasets(nevents, ndatasets, overlap, rng):
+    ### make synthetic index columns for overlapping primary datasets
+    # returns: a list of dicts of numpy arrays (one per dataset)
+    # note: a fraction overlap of the events in each dataset is also in another dataset.
+    nunique = int(nevents*ndatasets*(1-overlap/2))
+    run = rng.integers(315000, 326000, size=nunique).astype(np.uint32)
+    lumi = rng.integers(1, 3000, size=nunique).astype(np.uint32)
+    event = rng.integers(0, 2**33, size=nunique).astype(np.uint64)
+    datasets = []
+    for _ in range(ndatasets):
+        ids = np.sort(rng.choice(nunique, size=nevents, replace=False))
+        datasets.append({'run': run[ids], 'luminosityBlock': lumi[ids], 'event': event[ids],
+                         'value': rng.normal(size=nevents).astype(np.float32)})
+    return datasets
+
+def get_chunks(dataset, step_size):
+    ### split a dataset in chunks
+    n = len(dataset['event'])
+    return [ak.Array({key: val[start:start+step_size] for key, val in dataset.items()})
+            for start in range(0, n, step_size)]
+
+def dedup_old(chunks_per_dataset, index_columns):
+    ### old approach (see the history of mergedatatrees.py)
+    index = ak.concatenate([chunk[index_columns] for chunk in chunks_per_dataset[0]])
+    nwritten = len(index)
+    for chunks in chunks_per_dataset[1:]:
+        for chunk in chunks:
+            mask = np.isin(chunk[index_columns], index, assume_unique=True)
+            chunk = chunk[~mask]
+            nwritten += len(chunk)
+            if ak.all(mask): continue
+            chunkindex = ak.Array({key: chunk[key] for key in index_columns})
+            index = ak.concatenate((index, chunkindex))
+    return nwritten
+
+def dedup_new(chunks_per_dataset, layout):
+    ### current approach
+    seen = EventKeySet()
+    nwritten = 0
+    for idx, chunks in enumerate(chunks_per_dataset):
+        for chunk in chunks:
+            keys = make_event_keys(chunk['run'], chunk['luminosityBlock'], chunk['event'], layout)
+            if idx==0: mask = np.zeros(len(keys), dtype=bool)
+            else: mask = seen.contains(keys)
+            nwritten += int(np.sum(~mask))
+            seen.add(keys[~mask])
+    return nwritten
+
+
+if __name__=='__main__':
+
+    # input arguments:
+    parser = argparse.ArgumentParser(description='Benchmark duplicate removal in hadddata')
+    parser.add_argument('-n', '--nevents', type=int, default=200000,
+      help='Number of events per dataset')
+    parser.add_argument('-d', '--ndatasets', type=int, default=3)
+    parser.add_argument('--overlap', type=float, default=0.3)
+    parser.add_argument('-s', '--step_size', type=int, default=20000)
+    parser.add_argument('--maxold', type=int, default=1000000,
+      help='Maximum total number of events to run the old approach on')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make datasets
+    rng = np.random.default_rng(seed=1)
+    datasets = make_datasets(args.nevents, args.ndatasets, args.overlap, rng)
+    chunks_per_dataset = [get_chunks(dataset, args.step_size) for dataset in datasets]
+    allkeys = make_event_keys(
+      np.concatenate([d['run'] for d in datasets]),
+      np.concatenate([d['luminosityBlock'] for d in datasets]),
+      np.concatenate([d['event'] for d in datasets]), None)
+    nunique = len(np.unique(allkeys))
+    print('Number of unique events: {} (out of {})'.format(nunique, len(allkeys)))
+
+    # new approach (both with 64-bit and 128-bit keys)
+    for layout, name in [([19, 12, 33], '64-bit keys'), (None, '128-bit keys')]:
+        start_time = time.time()
+        nwritten = dedup_new(chunks_per_dataset, layout)
+        print('Current approach ({}): {:.3f} seconds'.format(name, time.time()-start_time))
+        if nwritten!=nunique:
+            raise Exception('ERROR: wrong number of written events: {}'.format(nwritten))
+
+    # old approach
+    if args.nevents*args.ndatasets <= args.maxold:
+        start_time = time.time()
+        try:
+            nwritten = dedup_old(chunks_per_dataset, ['event', 'run', 'luminosityBlock'])
+            print('Old approach: {:.3f} seconds'.format(time.time()-start_time))
+            if nwritten!=nunique:
+                print('WARNING: old approach wrote {} events (expected {})'.format(nwritten, nunique))
+        except Exception as e:
+            print('Old approach failed after {:.3f} seconds: {}'.format(time.time()-start_time, e))
+    else: print('Skipping old approach (too many events).')
+
+    # full merging of files
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputfiles = []
+        for idx, dataset in enumerate(datasets):
+            inputfile = os.path.join(tmpdir, 'dataset{}.root'.format(idx))
+            with uproot.recreate(inputfile) as f:
+                f['sr/tight/nominal/Events'] = dataset
+            inputfiles.append(inputfile)
+        outputfile = os.path.join(tmpdir, 'merged.root')
+        start_time = time.time()
+        hadddata(outputfile, inputfiles, step_size=args.step_size)
+        print('Full hadddata: {:.3f} seconds'.format(time.time()-start_time))
+        with uproot.open(outputfile) as f:
+            nwritten = f['sr/tight/nominal/Events'].num_entries
+        if nwritten!=nunique:
+            raise Exception('ERROR: wrong number of merged events: {}'.format(nwritten))
+        print('Merged file contains the expected number of events.')
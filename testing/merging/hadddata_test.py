@@ -0,0 +1,76 @@
+##########################################################
+# Test error handling in mergedatatrees.hadddata writing #
+##########################################################
+# Synthetic files with many trees are merged with a writer that fails,
+# using a small queue and multiple threads (so that the reading threads
+# are blocked on the full queue when the writing fails).
+# The error must be raised in the main thread instead of hanging forever.
+
+# imports
+import sys
+import os
+import tempfile
+import threading
+import numpy as np
+import uproot
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]/'testanalysis'))
+import mergedatatrees
+from mergedatatrees import hadddata
+
+
+class FailingWriter(object):
+    ### wrapper around an uproot output file that fails on writing a new tree
+    def __init__(self, f): self.f = f
+    def __enter__(self): return self
+    def __exit__(self, *args): return self.f.__exit__(*args)
+    def __getitem__(self, key): return self.f[key]
+    def __setitem__(self, key, value):
+        raise Exception('ERROR: writing of {} failed on purpose.'.format(key))
+
+def check(condition, msg):
+    if not condition: raise Exception('ERROR: {}'.format(msg))
+    print('  - OK: {}'.format(msg))
+
+
+if __name__=='__main__':
+
+    nfiles = 2
+    ntrees = 20
+    nevents = 1000
+    rng = np.random.default_rng(seed=1)
+    print('Testing failing writer in hadddata:')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputfiles = []
+        for fidx in range(nfiles):
+            inputfile = os.path.join(tmpdir, 'input{}.root'.format(fidx))
+            with uproot.recreate(inputfile) as f:
+                for tidx in range(ntrees):
+                    f['tree{}/Events'.format(tidx)] = {
+                      'run': np.ones(nevents, dtype=np.uint32),
+                      'luminosityBlock': np.ones(nevents, dtype=np.uint32),
+                      'event': rng.integers(0, 2**33, size=nevents).astype(np.uint64),
+                      'value': rng.normal(size=nevents)}
+            inputfiles.append(inputfile)
+        outputfile = os.path.join(tmpdir, 'merged.root')
+
+        # replace the output file by a failing writer
+        create = mergedatatrees.uproot.create
+        mergedatatrees.uproot.create = lambda path: FailingWriter(create(path))
+        result = {}
+        def run():
+            try:
+                hadddata(outputfile, inputfiles, step_size=100,
+                         nthreads=4, max_queue_size=4)
+                result['error'] = None
+            except Exception as e: result['error'] = e
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=60)
+        mergedatatrees.uproot.create = create
+
+        check(not thread.is_alive(), 'hadddata returns after a writing error')
+        check(result.get('error') is not None
+              and 'failed on purpose' in str(result['error']),
+              'writing error is raised')
+    print('All checks passed.')
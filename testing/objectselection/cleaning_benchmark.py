@@ -0,0 +1,131 @@
+#############################################
+# Benchmark the delta R cleaning of objects #
+#############################################
+# Synthetic events with a high jet multiplicity and a few leptons are made,
+# and the cleaning masks of objectselection/cleaning.py are timed for:
+#   - the old approach: coffea's nearest function (building the cartesian product),
+#   - the current approach: without cache (i.e. the delta R kernel itself,
+#     both the numpy implementation and the numba kernel if available)
+#     and with cache (i.e. repeated cleaning of the same objects,
+#     as for jet variations that do not change the jet direction).
+# The masks of all approaches are checked to be identical.
+
+# imports
+import sys
+import time
+import argparse
+import numpy as np
+import awkward as ak
+from pathlib import Path
+from coffea.nanoevents.methods import candidate
+
+# local imports
+sys.path.append(str(Path(__file__).parents[2]))
+import objectselection.cleaning as cleaning
+
+
+def make_objects(nevents, multiplicity, rng):
+    ### make a synthetic collection of objects
+    counts = rng.poisson(multiplicity, size=nevents)
+    n = int(np.sum(counts))
+    variables = {
+      'pt': rng.exponential(40., size=n)+10.,
+      'eta': rng.uniform(-2.5, 2.5, size=n),
+      'phi': rng.uniform(-np.pi, np.pi, size=n),
+      'mass': np.zeros(n),
+      'charge': np.zeros(n)
+    }
+    variables = {key: ak.unflatten(val.astype(np.float32), counts)
+                 for key, val in variables.items()}
+    return ak.zip(variables, with_name='PtEtaPhiMCandidate', behavior=candidate.behavior)
+
+def add_overlaps(jets, leptons, rng):
+    ### move the first jet in most events close to the first lepton
+    # (to have a sizeable number of jets removed by the cleaning)
+    eta = ak.to_numpy(ak.flatten(jets.eta)).copy()
+    phi = ak.to_numpy(ak.flatten(jets.phi)).copy()
+    starts = ak.to_numpy(ak.num(jets)).cumsum() - ak.to_numpy(ak.num(jets))
+    select = ak.to_numpy((ak.num(jets) > 0) & (ak.num(leptons) > 0))
+    select = select & (rng.uniform(size=len(select)) < 0.8)
+    lepeta = ak.to_numpy(ak.firsts(leptons.eta)[select])
+    lepphi = ak.to_numpy(ak.firsts(leptons.phi)[select])
+    eta[starts[select]] = lepeta + rng.normal(scale=0.3, size=len(lepeta)).astype(np.float32)
+    phi[starts[select]] = lepphi + rng.normal(scale=0.3, size=len(lepphi)).astype(np.float32)
+    jets = ak.with_field(jets, ak.unflatten(eta, ak.num(jets)), 'eta')
+    jets = ak.with_field(jets, ak.unflatten(phi, ak.num(jets)), 'phi')
+    return jets
+
+def clean_old(toclean, cleanfrom, conesize):
+    ### old approach (see the history of objectselection/cleaning.py)
+    dr = toclean.nearest(cleanfrom, return_metric=True)[1]
+    mask = (dr > conesize)
+    mask = ak.fill_none(mask, True)
+    return mask
+
+
+if __name__=='__main__':
+
+    # input arguments:
+    parser = argparse.ArgumentParser(description='Benchmark delta R cleaning')
+    parser.add_argument('-n', '--nevents', type=int, default=200000)
+    parser.add_argument('--njets', type=float, default=12.,
+      help='Average number of jets per event')
+    parser.add_argument('--nleptons', type=float, default=3.,
+      help='Average number of leptons per event')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+      help='Number of repeated cleanings (e.g. number of jet variations)')
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    # make objects
+    rng = np.random.default_rng(seed=1)
+    leptons = make_objects(args.nevents, args.nleptons, rng)
+    jets = add_overlaps(make_objects(args.nevents, args.njets, rng), leptons, rng)
+    muons = make_objects(args.nevents, 1., rng)
+    print('Number of jets: {}, leptons: {}'.format(
+      int(ak.sum(ak.num(jets))), int(ak.sum(ak.num(leptons)))))
+
+    for name, toclean, cleanfrom, conesize in [
+      ('jets from leptons', jets, leptons, 0.4),
+      ('leptons from muons', leptons, muons, 0.05),
+      ('leptons from jets', leptons, jets, 0.4)]:
+        print('Cleaning {}:'.format(name))
+
+        # old approach
+        start_time = time.time()
+        for _ in range(args.repeat): oldmask = clean_old(toclean, cleanfrom, conesize)
+        print('  Old approach: {:.3f} seconds'.format(time.time()-start_time))
+
+        # current approach without cache
+        newmasks = []
+        for use_numba in [False] + ([True] if cleaning.numba is not None else []):
+            # (run once before timing to exclude the compilation of the kernel)
+            cleaning.clean(toclean, cleanfrom, conesize, use_cache=False, use_numba=use_numba)
+            start_time = time.time()
+            for _ in range(args.repeat):
+                newmask = cleaning.clean(toclean, cleanfrom, conesize,
+                                         use_cache=False, use_numba=use_numba)
+            print('  Current approach ({}, no cache): {:.3f} seconds'.format(
+              'numba' if use_numba else 'numpy', time.time()-start_time))
+            newmasks.append(newmask)
+
+        # current approach with cache
+        cleaning.clear_cache()
+        start_time = time.time()
+        for _ in range(args.repeat):
+            cachedmask = cleaning.clean(toclean, cleanfrom, conesize,
+                                        use_cache=True, use_numba=False)
+        print('  Current approach (numpy, cache): {:.3f} seconds'.format(time.time()-start_time))
+
+        # compare masks
+        for mask in newmasks + [cachedmask]:
+            if not ak.all(ak.num(oldmask)==ak.num(mask)):
+                raise Exception('ERROR: masks have different structure.')
+            if not np.array_equal(ak.flatten(oldmask).to_numpy(), ak.flatten(mask).to_numpy()):
+                raise Exception('ERROR: masks are different.')
+        print('  Masks are identical (fraction of cleaned objects: {:.3f}).'.format(
+          1 - np.mean(ak.flatten(newmask).to_numpy())))
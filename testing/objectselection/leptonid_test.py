@@ -0,0 +1,123 @@
+###############################
+# Test the lepton ID bitmasks #
+###############################
+# Synthetic electron and muon collections (float32 variables as in NanoAOD,
+# including values exactly at the thresholds of the selections)
+# are used to compare the bitmasks from objectselection/leptonid.py
+# to the masks from electronselection and muonselection for every selection ID.
+# It is also checked that each ID is evaluated only once
+# (i.e. looser IDs are not evaluated again for the IDs built on them).
+
+import sys
+import time
+import numpy as np
+import awkward as ak
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]))
+import objectselection.leptonid as lid
+import objectselection.electronselection as elsel
+import objectselection.muonselection as musel
+from objectselection.electronselection import electronselection
+from objectselection.muonselection import muonselection
+
+
+def make_leptons(nevents, flavour, rng):
+    ### make a synthetic lepton collection
+    counts = rng.poisson(2., size=nevents)
+    n = int(np.sum(counts))
+    def floats(values, thresholds):
+        # replace a fraction of the values by the thresholds themselves
+        values = np.asarray(values, dtype=np.float32)
+        edge = rng.uniform(size=n) < 0.1
+        values[edge] = rng.choice(np.array(thresholds, dtype=np.float32), size=int(np.sum(edge)))
+        return values
+    def bools(p=0.8): return (rng.uniform(size=n) < p)
+    variables = {
+      'pt': floats(rng.exponential(20., size=n)+5., [10., 30.]),
+      'eta': floats(rng.uniform(-3., 3., size=n), [2.4, -2.4, 2.5, -2.5, 1.5]),
+      'dxy': floats(rng.normal(scale=0.04, size=n), [0.05, -0.05]),
+      'dz': floats(rng.normal(scale=0.08, size=n), [0.1, -0.1]),
+      'sip3d': floats(rng.exponential(6., size=n), [8., 15.]),
+      'miniPFRelIso_all': floats(rng.exponential(0.4, size=n), [0.4, 1.]),
+      'mvaTOP': floats(rng.uniform(-1., 1., size=n), [0.64, 0.81]),
+      'jetBTagDeepFlavor': floats(rng.uniform(0., 0.3, size=n), [0.025, 0.1]),
+      'jetPtRatio': floats(rng.uniform(0., 1., size=n), [0.4, 0.45]),
+      'isPFcand': bools()
+    }
+    if flavour=='electron':
+        variables.update({
+          'deltaEtaSC': floats(rng.normal(scale=0.05, size=n), [0.]),
+          'lostHits': rng.integers(0, 3, size=n).astype(np.uint8),
+          'convVeto': bools(),
+          'tightCharge': rng.integers(0, 3, size=n).astype(np.int32),
+          'mvaFall17V2noIso_WPL': bools()
+        })
+    else:
+        variables.update({
+          'isTracker': bools(),
+          'isGlobal': bools(),
+          'mediumId': bools()
+        })
+    return ak.zip({key: ak.unflatten(val, counts) for key, val in variables.items()})
+
+def count_calls(module, prefix):
+    ### wrap all ID functions in a module to count how often they are called
+    calls = {}
+    for name in dir(module):
+        if not name.startswith(prefix): continue
+        def wrapped(*args, _name=name, _func=getattr(module, name), **kwargs):
+            calls[_name] = calls.get(_name, 0) + 1
+            return _func(*args, **kwargs)
+        setattr(module, name, wrapped)
+    return calls
+
+def check(condition, msg):
+    if not condition: raise Exception('ERROR: {}'.format(msg))
+    print('  - OK: {}'.format(msg))
+
+
+if __name__=='__main__':
+
+    rng = np.random.default_rng(seed=1)
+    nevents = 100000
+    for flavour, selection, ids, module in [
+      ('electron', electronselection, lid.electron_ids, elsel),
+      ('muon', muonselection, lid.muon_ids, musel)]:
+        leptons = make_leptons(nevents, flavour, rng)
+        print('Testing {} IDs:'.format(flavour))
+        start_time = time.time()
+        refmasks = {sid: selection(leptons, selectionid=sid) for sid in ids}
+        print('  Separate selections: {:.3f} seconds'.format(time.time()-start_time))
+        start_time = time.time()
+        bits = lid.lepton_id_bits(leptons, flavour)
+        print('  Bitmask: {:.3f} seconds'.format(time.time()-start_time))
+        for sid in ids:
+            mask = lid.id_mask(bits, flavour, sid)
+            check(ak.all(ak.num(mask)==ak.num(refmasks[sid]))
+                  and np.array_equal(ak.flatten(mask).to_numpy(),
+                                     ak.flatten(refmasks[sid]).to_numpy()),
+                  sid)
+        # each ID is evaluated once
+        calls = count_calls(module, '{}id_'.format(flavour))
+        lid.lepton_id_bits(leptons, flavour)
+        check(len(calls)==len(ids) and all(n==1 for n in calls.values()),
+              'each ID evaluated once')
+        calls.clear()
+        lid.lepton_id_bits(leptons, flavour, selectionids=['ttwloose_tight'])
+        check(calls=={'{}id_{}'.format(flavour, sid): 1
+                      for sid in ['run2ul_loose', 'ttwloose_fo', 'ttwloose_tight']},
+              'looser IDs evaluated once for a subset of IDs')
+        # subset of IDs
+        bits = lid.lepton_id_bits(leptons, flavour, selectionids=['ttwloose_tight'])
+        check(np.array_equal(ak.flatten(bits).to_numpy()!=0,
+                             ak.flatten(refmasks['ttwloose_tight']).to_numpy()),
+              'only requested bits are set')
+        # IDs for which not all variables are present are skipped by default
+        bits = lid.lepton_id_bits(leptons[['pt', 'eta']], flavour)
+        check(np.all(ak.flatten(bits).to_numpy() <= 3), 'default IDs for reduced collection')
+        # requested IDs for which not all variables are present raise an error
+        try:
+            lid.lepton_id_bits(leptons[['pt', 'eta']], flavour, selectionids=['ttwloose_fo'])
+            raise Exception('ERROR: missing variables did not raise an error.')
+        except AttributeError: check(True, 'error for missing variables')
+    print('All checks passed.')
@@ -0,0 +1,62 @@
+######################################################
+# Test vectorized histogram filling against TH1::Fill #
+######################################################
+
+import sys
+import os
+import numpy as np
+import ROOT
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]))
+import tools.histtools as ht
+from tools.variabletools import HistogramVariable
+
+
+def compare(variable, values, weights):
+    ### fill a histogram in both ways and check that the results are identical
+    hist_loop = variable.initialize_histogram(histname='loop')
+    for val, weight in zip(values, weights): hist_loop.Fill(val, weight)
+    hist_vec = variable.initialize_histogram(histname='vectorized')
+    ht.fillhistogram(hist_vec, values, weights)
+    nbins = hist_loop.GetNbinsX()
+    for i in range(nbins+2):
+        if hist_loop.GetBinContent(i)!=hist_vec.GetBinContent(i):
+            raise Exception('ERROR: bin contents differ in bin {}'.format(i))
+        if hist_loop.GetSumw2()[i]!=hist_vec.GetSumw2()[i]:
+            raise Exception('ERROR: sumw2 differs in bin {}'.format(i))
+    stats_loop = np.zeros(4)
+    hist_loop.GetStats(stats_loop)
+    stats_vec = np.zeros(4)
+    hist_vec.GetStats(stats_vec)
+    if not np.array_equal(stats_loop, stats_vec):
+        raise Exception('ERROR: statistics differ: {} vs {}'.format(stats_loop, stats_vec))
+    if hist_loop.GetEntries()!=hist_vec.GetEntries():
+        raise Exception('ERROR: number of entries differ')
+    print('  - {}: identical'.format(variable.name))
+
+
+if __name__=='__main__':
+
+    nevents = 100000
+    if len(sys.argv)>1: nevents = int(sys.argv[1])
+
+    # make random values and weights
+    rng = np.random.default_rng(seed=1)
+    values = rng.normal(loc=5, scale=4, size=nevents).astype(np.float32)
+    weights = rng.normal(loc=1, scale=0.5, size=nevents)
+
+    # define variables with fixed and variable bin width
+    variables = ([
+      HistogramVariable('fixed', 'x', 7, 0, 10),
+      HistogramVariable('variable', 'x', 5, 0, 10, bins=[0, 0.3, 1, 2.5, 7, 10])
+    ])
+
+    # compare with and without clipping
+    print('Comparing histograms:')
+    for variable in variables:
+        compare(variable, values, weights)
+        hist = variable.initialize_histogram()
+        nbins = hist.GetNbinsX()
+        minvalue = hist.GetBinLowEdge(1) + hist.GetBinWidth(1)/2.
+        maxvalue = hist.GetBinLowEdge(nbins) + hist.GetBinWidth(nbins)/2.
+        compare(variable, np.clip(values, minvalue, maxvalue), weights)
@@ -0,0 +1,114 @@
+######################################
+# Test single-pass histogram merging #
+######################################
+# Synthetic binner output files (two simulated processes with systematics
+# and data without systematics) are merged with the transform chain
+# as used in mergehists.py, and the result is compared to the expected
+# histogram names and contents.
+
+import sys
+import os
+import tempfile
+import numpy as np
+import uproot
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]))
+import tools.histmerger as hm
+
+
+def write_file(path, hists):
+    ### write a dict of name -> values (including under/overflow) to a file
+    edges = np.linspace(0., 1., 4)
+    with uproot.recreate(path) as f:
+        for name, values in hists.items():
+            f[name] = (np.array(values[1:-1], dtype=float), edges)
+
+def read_file(path):
+    ### read all histograms in a file into a dict of name -> values
+    with uproot.open(path) as f:
+        return {name: f[name].values(flow=True) for name in hm.get_histogram_names(path)}
+
+def check(condition, msg):
+    if not condition: raise Exception('ERROR: {}'.format(msg))
+    print('  - OK: {}'.format(msg))
+
+
+if __name__=='__main__':
+
+    nominal = [0., 1., -2., 3., 0.]
+    up = [0., 2., 2., 2., 0.]
+    systematics = ['nominal', 'fooUp', 'fooDown', 'bar_njetsUp', 'bar_njetsDown']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputfiles = []
+        # simulation: processes A and B (B is renamed to A)
+        for pname in ['A', 'B']:
+            hists = {}
+            for selectiontype in ['tight', 'other']:
+                for s in systematics:
+                    values = nominal if s=='nominal' else up
+                    hists['{}_sr_{}_var_{}'.format(pname, selectiontype, s)] = values
+            inputfiles.append(os.path.join(tmpdir, '{}.root'.format(pname)))
+            write_file(inputfiles[-1], hists)
+        # data: nominal only
+        inputfiles.append(os.path.join(tmpdir, 'data.root'))
+        write_file(inputfiles[-1], {'Data_sr_tight_var_nominal': [0., 5., 5., 5., 0.]})
+
+        systematics = hm.find_systematics(inputfiles)
+        print('Testing histogram merging:')
+        check(systematics==sorted(['fooUp', 'fooDown', 'bar_njetsUp', 'bar_njetsDown']),
+              'found systematics {}'.format(systematics))
+        transforms = [
+          hm.FillSystematics(systematics),
+          hm.RenameProcesses({'B': 'A'}),
+          hm.DecorrelateSystematics({'decorrelate_years': ['_foo'],
+                                     'decorrelate_processes': ['_njets']},
+                                    year='2017', allyears=['2017', '2018']),
+          hm.SelectHistograms(['_tight_'])
+        ]
+        outputfile = os.path.join(tmpdir, 'merged.root')
+        hm.merge_histograms(inputfiles, outputfile,
+          transforms=transforms, histtransforms=[hm.clip_histogram])
+        merged = read_file(outputfile)
+
+        expected = sorted(['A_sr_var_nominal',
+          'A_sr_var_foo2017Up', 'A_sr_var_foo2017Down',
+          'A_sr_var_foo2018Up', 'A_sr_var_foo2018Down',
+          'A_sr_var_bar_njetsAUp', 'A_sr_var_bar_njetsADown',
+          'Data_sr_var_nominal',
+          'Data_sr_var_foo2017Up', 'Data_sr_var_foo2017Down',
+          'Data_sr_var_foo2018Up', 'Data_sr_var_foo2018Down',
+          'Data_sr_var_bar_njetsDataUp', 'Data_sr_var_bar_njetsDataDown'])
+        check(sorted(merged.keys())==expected, 'histogram names')
+        check(np.allclose(merged['A_sr_var_nominal'], [0., 2., 0., 6., 0.]),
+              'summed and clipped nominal')
+        with uproot.open(outputfile) as f:
+            hist = f['A_sr_var_nominal']
+            centers = np.array([1., 3., 5.]) / 6.
+            check(np.isclose(hist.member('fTsumw'), 8.)
+                  and np.isclose(hist.member('fTsumwx'), np.sum([2., 0., 6.]*centers))
+                  and np.isclose(hist.member('fTsumwx2'), np.sum([2., 0., 6.]*centers**2)),
+                  'statistics of clipped nominal')
+        check(np.allclose(merged['A_sr_var_foo2017Up'], [0., 4., 4., 4., 0.]),
+              'summed variation')
+        check(np.allclose(merged['A_sr_var_foo2018Up'], [0., 2., 0., 6., 0.]),
+              'nominal copy for other year')
+        check(np.allclose(merged['Data_sr_var_bar_njetsDataUp'], [0., 5., 5., 5., 0.]),
+              'filled systematic for data')
+
+        # parallel merging must give the same result
+        paralleloutputfile = os.path.join(tmpdir, 'merged_parallel.root')
+        hm.merge_histograms(inputfiles, paralleloutputfile,
+          transforms=transforms, histtransforms=[hm.clip_histogram], nworkers=2)
+        parallelmerged = read_file(paralleloutputfile)
+        check(sorted(parallelmerged.keys())==expected
+              and all([np.array_equal(merged[name], parallelmerged[name]) for name in expected]),
+              'parallel merging')
+
+        # strict selection must fail on histograms without selection tag
+        try:
+            hm.merge_histograms(inputfiles, outputfile,
+              transforms=[hm.SelectHistograms(['_tight_'], strict=True)])
+            raise Exception('ERROR: strict selection did not fail.')
+        except Exception as e:
+            check('without any of the tags' in str(e), 'strict selection')
+        print('All checks passed.')
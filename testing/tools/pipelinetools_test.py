@@ -0,0 +1,66 @@
+##############################################
+# Test incremental re-execution of pipelines #
+##############################################
+# A small pipeline of shell commands (a -> b per sample, c merging all samples)
+# is run several times in a temporary directory,
+# checking each time that exactly the expected tasks are re-executed.
+
+import sys
+import os
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parents[2]))
+from tools.pipelinetools import Pipeline, Task
+
+
+def make_pipeline(workdir, failing=None):
+    ### make a test pipeline
+    # note: task a depends on a configuration file, except for sample s3.
+    p = Pipeline(os.path.join(workdir, 'state.json'))
+    for s in ['s1', 's2', 's3']:
+        configfiles = [os.path.join(workdir, 'config.txt')] if s!='s3' else []
+        p.add_task(Task('a/'+s, 'cat config.txt > a_{}.out'.format(s),
+          outputs=['a_{}.out'.format(s)], configfiles=configfiles))
+        cmd = 'cat a_{0}.out > b_{0}.out'.format(s)
+        if failing=='b/'+s: cmd = 'exit 2'
+        p.add_task(Task('b/'+s, cmd,
+          inputs=['a_{}.out'.format(s)], outputs=['b_{}.out'.format(s)]))
+    p.add_task(Task('c', 'cat b_*.out > c.out',
+      inputs=['b_s1.out', 'b_s2.out', 'b_s3.out'], outputs=['c.out']))
+    return p
+
+def check(status, expected):
+    ### check which tasks were run
+    ran = sorted([name for name, s in status.items() if s!='up to date'])
+    if ran!=sorted(expected):
+        raise Exception('ERROR: expected tasks {} to run, found {}.'.format(expected, ran))
+    print('  - OK: ran {}'.format(ran))
+
+
+if __name__=='__main__':
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with open('config.txt', 'w') as f: f.write('1')
+        print('Testing pipeline:')
+        # first run: all tasks
+        check(make_pipeline(workdir).run(nworkers=3), ['a/s1', 'a/s2', 'a/s3', 'b/s1', 'b/s2', 'b/s3', 'c'])
+        # second run: nothing
+        check(make_pipeline(workdir).run(nworkers=3), [])
+        # dry run after changing the configuration file: nothing is run
+        with open('config.txt', 'w') as f: f.write('2')
+        status = make_pipeline(workdir).run(nworkers=3, dryrun=True)
+        check(status, [])
+        # run after changing the configuration file: all except sample s3
+        check(make_pipeline(workdir).run(nworkers=3), ['a/s1', 'a/s2', 'b/s1', 'b/s2', 'c'])
+        # removed output: remake it and everything downstream
+        os.remove('b_s3.out')
+        check(make_pipeline(workdir).run(nworkers=3), ['b/s3', 'c'])
+        # failing task: downstream tasks are skipped
+        status = make_pipeline(workdir, failing='b/s2').run(nworkers=3)
+        if( status['b/s2']!='failed' or status['c']!='skipped' ):
+            raise Exception('ERROR: wrong status after failing task: {}'.format(status))
+        print('  - OK: failing task handled correctly')
+        # forced task
+        check(make_pipeline(workdir).run(nworkers=3, force=['a/s1']), ['a/s1', 'b/s1', 'b/s2', 'c'])
+        print('All checks passed.')
@@ -0,0 +1,162 @@
+##############################################
+# Benchmark the TOP lepton MVA score reading #
+##############################################
+# A synthetic NanoAOD file is made with all input variables
+# of the TOP lepton MVA for electrons and muons.
+# The scores are calculated in a number of chunks for:
+#   - the old approach: loading the boosters for each chunk,
+#     and building the feature matrices by stacking and transposing jagged arrays,
+#   - the current approach: see preprocessing/topleptonmva.py.
+# The scores of both approaches are checked to be identical.
+
+# imports
+import sys
+import os
+import time
+import argparse
+import tempfile
+import warnings
+import numpy as np
+import awkward as ak
+import uproot
+import xgboost as xgb
+from pathlib import Path
+from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
+
+# local imports
+sys.path.append(str(Path(__file__).parents[2]))
+import preprocessing.topleptonmva as topmva
+
+
+def make_nanoaod(path, nevents, rng):
+    ### make a synthetic NanoAOD file with electrons and muons
+    def make_leptons(nleptons, extra):
+        counts = rng.poisson(nleptons, size=nevents)
+        n = int(np.sum(counts))
+        # note: the jet variables of the leptons are normally added by
+        #       preprocessing/leptonvariables.py, here they are stored directly.
+        variables = {
+          'pt': rng.exponential(30., size=n)+10.,
+          'eta': rng.uniform(-2.5, 2.5, size=n),
+          'jetNDauCharged': rng.integers(0, 20, size=n).astype(np.uint8),
+          'miniPFRelIso_chg': rng.exponential(0.05, size=n),
+          'miniPFRelIso_all': rng.exponential(0.1, size=n),
+          'jetPtRelv2': rng.exponential(5., size=n),
+          'jetPtRatio': rng.uniform(0., 1., size=n),
+          'pfRelIso03_all': rng.exponential(0.1, size=n),
+          'jetBTagDeepFlavor': rng.uniform(0., 1., size=n),
+          'sip3d': rng.exponential(2., size=n),
+          'dxy': rng.normal(scale=0.01, size=n),
+          'dz': rng.normal(scale=0.02, size=n),
+          'jetIdx': np.full(n, -1, dtype=np.int32)
+        }
+        variables.update({key: val(n) for key, val in extra.items()})
+        variables = {key: (val.astype(np.float32) if val.dtype==np.float64 else val)
+                     for key, val in variables.items()}
+        return ak.zip({key: ak.unflatten(val, counts) for key, val in variables.items()})
+    electrons = make_leptons(1.5, {
+      'mvaFall17V2noIso': lambda n: rng.uniform(-1., 1., size=n),
+      'lostHits': lambda n: rng.integers(0, 3, size=n).astype(np.uint8)})
+    muons = make_leptons(1.5, {
+      'segmentComp': lambda n: rng.uniform(0., 1., size=n)})
+    with uproot.recreate(path) as f:
+        f['Events'] = {
+          'run': np.ones(nevents, dtype=np.uint32),
+          'luminosityBlock': np.ones(nevents, dtype=np.uint32),
+          'event': np.arange(nevents, dtype=np.uint64),
+          'Electron': electrons,
+          'Muon': muons
+        }
+
+def get_scores_old(leptons, flavour, year, version):
+    ### old approach (see the history of preprocessing/topleptonmva.py)
+    booster = xgb.Booster()
+    booster.load_model(topmva.get_weightfile(year, version, flavour))
+    features = ([
+      leptons.pt,
+      leptons.eta,
+      leptons.jetNDauCharged,
+      leptons.miniPFRelIso_chg,
+      leptons.miniPFRelIso_all - leptons.miniPFRelIso_chg,
+      leptons.jetPtRelv2,
+      leptons.jetPtRatio,
+      leptons.pfRelIso03_all,
+      leptons.jetBTagDeepFlavor,
+      leptons.sip3d,
+      np.log(np.abs(leptons.dxy)),
+      np.log(np.abs(leptons.dz))
+    ])
+    if flavour=='electron':
+        features.append(leptons.mvaFall17V2noIso)
+        if version=='ULv2': features.append(leptons.lostHits)
+    else: features.append(leptons.segmentComp)
+    features = ak.where(ak.is_none(features, axis=2), 0., features)
+    counts = ak.num(features[0])
+    features = np.transpose(np.array(ak.flatten(features, axis=2)))
+    features = np.ascontiguousarray(features)
+    scores = booster.inplace_predict(features)
+    return ak.unflatten(scores, counts)
+
+
+if __name__=='__main__':
+
+    # input arguments:
+    parser = argparse.ArgumentParser(description='Benchmark TOP lepton MVA reading')
+    parser.add_argument('-n', '--nevents', type=int, default=20000,
+      help='Number of events (note: the old approach takes about a minute per 10k events)')
+    parser.add_argument('-s', '--step_size', type=int, default=5000)
+    parser.add_argument('-y', '--year', default='2018')
+    parser.add_argument('-v', '--version', choices=['ULv1', 'ULv2'], default='ULv2')
+    parser.add_argument('-j', '--nthreads', type=int, default=1)
+    args = parser.parse_args()
+
+    # print arguments
+    print('Running with following configuration:')
+    for arg in vars(args):
+        print('  - {}: {}'.format(arg,getattr(args,arg)))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        # make synthetic input file
+        inputfile = os.path.join(tmpdir, 'nanoaod.root')
+        make_nanoaod(inputfile, args.nevents, np.random.default_rng(seed=1))
+
+        # read in chunks
+        chunks = []
+        with warnings.catch_warnings():
+            # (ignore warnings about missing cross-references)
+            warnings.simplefilter('ignore')
+            for start in range(0, args.nevents, args.step_size):
+                events = NanoEventsFactory.from_root(
+                  {inputfile: 'Events'},
+                  entry_start=start, entry_stop=min(start+args.step_size, args.nevents),
+                  schemaclass=NanoAODSchema,
+                  metadata={'year': args.year}
+                ).events()
+                chunks.append((ak.materialize(events.Electron), ak.materialize(events.Muon)))
+
+        # old approach
+        start_time = time.time()
+        oldscores = []
+        for electrons, muons in chunks:
+            oldscores.append((get_scores_old(electrons, 'electron', args.year, args.version),
+                              get_scores_old(muons, 'muon', args.year, args.version)))
+        print('Old approach: {:.3f} seconds'.format(time.time()-start_time))
+
+        # current approach (a new reader per chunk, as in PreProcessor)
+        start_time = time.time()
+        newscores = []
+        for electrons, muons in chunks:
+            reader = topmva.TopLeptonMvaReader(args.year, args.version, nthreads=args.nthreads)
+            newscores.append((reader.get_scores(electrons, 'electron'),
+                              reader.get_scores(muons, 'muon')))
+        print('Current approach: {:.3f} seconds'.format(time.time()-start_time))
+
+        # compare scores
+        for (oldel, oldmu), (newel, newmu) in zip(oldscores, newscores):
+            for old, new in [(oldel, newel), (oldmu, newmu)]:
+                if not ak.all(ak.num(old)==ak.num(new)):
+                    raise Exception('ERROR: scores have different structure.')
+                if not np.array_equal(ak.flatten(old).to_numpy(), ak.flatten(new).to_numpy()):
+                    raise Exception('ERROR: scores are different.')
+        print('Scores of both approaches are identical.')
@@ -0,0 +1,383 @@
+###################################################
+# Single-pass merging of histograms in ROOT files #
+###################################################
+# The histograms in a set of input files are streamed (one file at a time,
+# reading each histogram once), passed through a chain of transforms,
+# summed by name in numpy, and written to the output file in one go.
+# There are two kinds of transforms:
+#   - name transforms: map the histogram names in a single input file
+#     to a list of output names (empty to drop a histogram,
+#     multiple entries to make copies).
+#     They only act on names, so histograms that are dropped are never read.
+#     Name transforms are applied per input file, in the order they are given,
+#     and each one sees the names produced by the previous one.
+#   - histogram transforms: modify the content of the merged histograms
+#     (e.g. clipping); applied after summing over all input files.
+# The summing can be split over several processes (see sum_histograms),
+# which replaces the need for hadd (and a ROOT installation) altogether.
+# Note: only 1D histograms are supported.
+# Note: histograms that get the same name (in one or in several input files) are summed.
+
+import os
+import sys
+import numpy as np
+import uproot
+from concurrent.futures import ProcessPoolExecutor
+from uproot.writing.identify import to_TH1x, to_TAxis
+
+
+### histogram representation ###
+
+class MergeHistogram(object):
+    ### minimal representation of a 1D histogram for merging
+    # note: values and sumw2 include underflow and overflow bins.
+
+    def __init__(self, values, sumw2, stats, xaxis, title=''):
+        ### initializer
+        # input arguments:
+        # - values: numpy array with bin contents
+        # - sumw2: numpy array with sum of squared weights
+        # - stats: numpy array with [fEntries, fTsumw, fTsumw2, fTsumwx, fTsumwx2]
+        # - xaxis: tuple (number of bins, lower edge, upper edge, bin edges, axis title),
+        #   where bin edges is None for histograms with fixed bin width
+        #   (the axis is not kept as an uproot object, as these are expensive to pickle)
+        # - title: histogram title
+        self.values = values
+        self.sumw2 = sumw2
+        self.stats = stats
+        self.xaxis = xaxis
+        self.title = title
+
+    @classmethod
+    def from_uproot(cls, hist):
+        stats = np.array([hist.member(m) for m in
+                          ['fEntries', 'fTsumw', 'fTsumw2', 'fTsumwx', 'fTsumwx2']])
+        axis = hist.member('fXaxis')
+        xbins = np.array(axis.member('fXbins'), dtype=np.float64)
+        xaxis = (axis.member('fNbins'), axis.member('fXmin'), axis.member('fXmax'),
+                 xbins if len(xbins)>0 else None, axis.member('fTitle'))
+        return cls(np.array(hist.values(flow=True), dtype=np.float64),
+                   np.array(hist.variances(flow=True), dtype=np.float64),
+                   stats, xaxis, title=hist.member('fTitle'))
+
+    def copy(self):
+        return MergeHistogram(self.values.copy(), self.sumw2.copy(), self.stats.copy(),
+                              self.xaxis, title=self.title)
+
+    def add(self, other, name=''):
+        ### add another histogram to this one (in place)
+        if len(other.values)!=len(self.values):
+            msg = 'ERROR in MergeHistogram.add:'
+            msg += ' histograms with name {} have different binning'.format(name)
+            msg += ' ({} vs {} bins).'.format(len(self.values)-2, len(other.values)-2)
+            raise Exception(msg)
+        self.values += other.values
+        self.sumw2 += other.sumw2
+        self.stats += other.stats
+
+    def set_stats_from_bins(self):
+        ### recompute the statistics from the bin contents (in place)
+        # (as done by ROOT after modifying bin contents, e.g. with SetBinContent;
+        #  the number of entries is kept)
+        nbins, xmin, xmax, xbins, _ = self.xaxis
+        edges = xbins if xbins is not None else np.linspace(xmin, xmax, nbins+1)
+        centers = (edges[:-1] + edges[1:]) / 2.
+        values = self.values[1:-1]
+        self.stats = np.array([self.stats[0], np.sum(values), np.sum(self.sumw2[1:-1]),
+                               np.sum(values*centers), np.sum(values*centers**2)])
+
+    def to_uproot(self, name):
+        ### convert to an object that can be written with uproot
+        nbins, xmin, xmax, xbins, axistitle = self.xaxis
+        xaxis = to_TAxis('xaxis', axistitle, nbins, xmin, xmax, fXbins=xbins)
+        return to_TH1x(name, self.title, self.values,
+                       *[float(s) for s in self.stats],
+                       self.sumw2, xaxis)
+
+
+### name transforms ###
+
+class RenameProcesses(object):
+    ### rename the process tag (i.e. the first part of the histogram name)
+
+    def __init__(self, renamedict):
+        # input arguments:
+        # - renamedict: dict matching old process tags to new ones
+        #   (tags that are not in the dict are not modified)
+        self.renamedict = renamedict
+
+    def __call__(self, names, rfile=None):
+        res = {}
+        for name in names:
+            pname, rem = name.split('_', 1)
+            res[name] = ['_'.join([self.renamedict.get(pname, pname), rem])]
+        return res
+
+
+class FillSystematics(object):
+    ### add missing systematic histograms (copies of nominal)
+    # to input files that do not contain any systematics (e.g. data).
+    # note: a file is considered to contain systematics
+    #       if it has at least one histogram that does not end with '_nominal';
+    #       it is assumed that all files either have all systematics or do not have any.
+
+    def __init__(self, systematics):
+        # input arguments:
+        # - systematics: list of systematic names to add (see find_systematics)
+        self.systematics = systematics
+
+    def __call__(self, names, rfile=None):
+        res = {name: [name] for name in names}
+        if any([not name.endswith('_nominal') for name in names]): return res
+        nameset = set(names)
+        for name in names:
+            for systematic in self.systematics:
+                newname = name.replace('nominal', systematic)
+                if newname not in nameset: res[name].append(newname)
+        return res
+
+
+class DecorrelateSystematics(object):
+    ### decorrelate systematics by year and/or by process
+    # decorrelation by process simply renames the systematic to include the process.
+    # decorrelation by year renames the systematic to include the year,
+    # and adds copies of the nominal histogram as variations for all other years,
+    # in order to merge several years correctly.
+    # note: some JEC sources are already decorrelated per year in the input ntuples
+    #       (and not listed in the configuration), but are combined for 2016
+    #       instead of being split in 2016PreVFP and 2016PostVFP;
+    #       these are treated as a special case.
+
+    def __init__(self, renamedict, year=None, allyears=None):
+        # input arguments:
+        # - renamedict: dict with keys 'decorrelate_years' and 'decorrelate_processes',
+        #   each holding a list of systematic name tags
+        # - year: year of the input files
+        # - allyears: list of all years to merge later on
+        #   (decorrelation by year is only done if both year and allyears are specified)
+        self.renamedict = renamedict
+        self.year = year
+        self.allyears = allyears
+
+    def __call__(self, names, rfile=None):
+        res = {name: [name] for name in names}
+        nameset = set(names)
+        doyears = (self.year is not None and self.allyears is not None)
+
+        def add_other_years(nomname, name, newname):
+            ### help function to add nominal copies for the other years
+            if nomname not in nameset:
+                raise Exception('ERROR in DecorrelateSystematics:'
+                                +' nominal histogram {} not found'.format(nomname)
+                                +' (required for found histogram {}'.format(name)
+                                +' in file {})'.format(rfile))
+            for otheryear in self.allyears:
+                if otheryear==self.year: continue
+                res[nomname].append(newname.replace(self.year, otheryear))
+
+        for name in names:
+            newname = name
+            pname = name.split('_', 1)[0]
+            # find if histogram belongs to up, down or other
+            tag = name
+            if tag.endswith('Up'): tag = tag[:-2]
+            elif tag.endswith('Down'): tag = tag[:-4]
+            else: continue
+            # decorrelate by year
+            if doyears:
+                for s in self.renamedict['decorrelate_years']:
+                    if tag.endswith(s):
+                        newname = name.replace(s, s+self.year)
+                        add_other_years(tag.replace(s, '_nominal'), name, newname)
+            # special case for JEC sources
+            if( doyears and 'JECGrouped' in tag ):
+                if tag.endswith('2016'):
+                    newname = name.replace('2016', self.year)
+                    tag = tag.replace('2016', self.year)
+                if tag.endswith(self.year):
+                    # extract the full name of the systematic, e.g. JECGrouped_HF_2017
+                    systematic = 'JECGrouped' + tag.split('JECGrouped')[1]
+                    add_other_years(tag.replace(systematic, 'nominal'), name, newname)
+            # decorrelate by process
+            for s in self.renamedict['decorrelate_processes']:
+                if tag.endswith(s): newname = name.replace(s, s+pname)
+            res[name][0] = newname
+        return res
+
+
+class SelectHistograms(object):
+    ### keep only histograms containing at least one of the given tags,
+    # and replace the tag by a single underscore.
+
+    def __init__(self, tags, strict=False):
+        # input arguments:
+        # - tags: list of tags (e.g. selection types like '_tight_')
+        # - strict: raise an error on histograms without any of the tags
+        #   instead of dropping them
+        self.tags = tags
+        self.strict = strict
+
+    def __call__(self, names, rfile=None):
+        res = {}
+        for name in names:
+            if not any([tag in name for tag in self.tags]):
+                if self.strict:
+                    msg = 'ERROR in SelectHistograms: found histogram {}'.format(name)
+                    msg += ' in file {} without any of the tags {}.'.format(rfile, self.tags)
+                    raise Exception(msg)
+                res[name] = []
+                continue
+            newname = name
+            for tag in self.tags: newname = newname.replace(tag, '_')
+            res[name] = [newname]
+        return res
+
+
+### histogram transforms ###
+
+def clip_histogram(hist, clipboundary=0):
+    ### clip a histogram to minimum zero (in place)
+    # (equivalent to histtools.cliphistogram)
+    # note: if any bin is modified, the statistics are recomputed from the bin contents,
+    #       so that e.g. the integral stored in the histogram matches the clipped bins.
+    inds = np.nonzero(hist.values < clipboundary)
+    modified = (len(inds[0]) > 0)
+    hist.values[inds] = 0.
+    hist.sumw2[inds] = 0.
+    # check if histogram is empty after clipping and if so, fill it with dummy value
+    if np.sum(hist.values[1:-1]) < 1e-12:
+        hist.values[1] = 1e-6
+        modified = True
+    if modified: hist.set_stats_from_bins()
+    return hist
+
+
+### merging ###
+
+def get_histogram_names(rfile):
+    ### get the names of all 1D histograms in a file (without reading them)
+    with uproot.open(rfile) as f:
+        classnames = f.classnames(cycle=False)
+    return [name for name, classname in classnames.items()
+            if classname.startswith('TH1')]
+
+def find_systematics(rfiles, verbose=False):
+    ### find the names of all systematics in a set of files
+    # note: only the first file containing systematics is considered
+    #       (assuming all files either have all systematics or do not have any).
+    if verbose: print('Retrieving all systematics from input files')
+    for rfile in rfiles:
+        names = get_histogram_names(rfile)
+        nomnames = [name for name in names if name.endswith('_nominal')]
+        if len(nomnames)==0: continue
+        pretag = nomnames[0][:-len('nominal')]
+        systematics = [name[len(pretag):] for name in names if name.startswith(pretag)]
+        systematics = sorted(set(systematics) - set(['nominal']))
+        if len(systematics)>0: return systematics
+    return []
+
+def get_name_plan(names, transforms, rfile=None):
+    ### apply a chain of name transforms
+    # returns: a dict matching the original names to lists of output names
+    plan = {name: [name] for name in names}
+    for transform in transforms:
+        current = list(dict.fromkeys([n for outs in plan.values() for n in outs]))
+        mapping = transform(current, rfile=rfile)
+        plan = {name: [o for n in outs for o in mapping.get(n, [])]
+                for name, outs in plan.items()}
+    return plan
+
+def merge_file(rfile, transforms, merged, verbose=False):
+    ### read the histograms in a file and add them to merged histograms
+    # input arguments:
+    # - rfile: input file
+    # - transforms: list of name transforms
+    # - merged: dict matching output names to MergeHistogram objects (modified in place)
+    plan = get_name_plan(get_histogram_names(rfile), transforms, rfile=rfile)
+    nread = 0
+    with uproot.open(rfile) as f:
+        for name, outs in plan.items():
+            if len(outs)==0: continue
+            hist = MergeHistogram.from_uproot(f[name])
+            nread += 1
+            for out in outs:
+                if out in merged: merged[out].add(hist, name=out)
+                else: merged[out] = hist.copy()
+    if verbose:
+        print('  - read {} histograms from {}'.format(nread, rfile))
+        sys.stdout.flush()
+    return merged
+
+def write_histograms(outputfile, merged):
+    ### write merged histograms to a file
+    outputdir = os.path.dirname(os.path.abspath(outputfile))
+    if not os.path.exists(outputdir): os.makedirs(outputdir, exist_ok=True)
+    with uproot.recreate(outputfile) as f:
+        for name in sorted(merged.keys()):
+            f[name] = merged[name].to_uproot(name)
+
+def add_merged(merged, other):
+    ### add a dict of merged histograms to another one (in place)
+    for name, hist in other.items():
+        if name in merged: merged[name].add(hist, name=name)
+        else: merged[name] = hist
+    return merged
+
+def merge_files(rfiles, transforms, verbose=False):
+    ### merge the histograms in a list of files (sequentially)
+    merged = {}
+    for idx, rfile in enumerate(rfiles):
+        if verbose: print('Merging file {}/{}'.format(idx+1, len(rfiles)))
+        merge_file(rfile, transforms, merged, verbose=verbose)
+    return merged
+
+def sum_histograms(rfiles, transforms=None, nworkers=1, verbose=False):
+    ### sum histograms with the same name in a set of files
+    # input arguments:
+    # - rfiles: list of input files
+    # - transforms: list of name transforms, applied per input file
+    # - nworkers: number of processes to use
+    # returns: a dict matching histogram names to MergeHistogram objects
+    # note: with multiple workers, the input files are split in nworkers groups
+    #       that are merged in parallel, after which the partial sums are added
+    #       pairwise (in a fixed order, so the result does not depend on timing).
+    if transforms is None: transforms = []
+    if( nworkers<=1 or len(rfiles)<=1 ):
+        return merge_files(rfiles, transforms, verbose=verbose)
+    ngroups = min(nworkers, len(rfiles))
+    groups = [list(group) for group in np.array_split(np.array(rfiles, dtype=object), ngroups)]
+    if verbose:
+        msg = 'Merging {} files in {} groups'.format(len(rfiles), ngroups)
+        msg += ' using {} processes'.format(nworkers)
+        print(msg)
+        sys.stdout.flush()
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        futures = [pool.submit(merge_files, group, transforms) for group in groups]
+        partials = [future.result() for future in futures]
+        # tree reduction of the partial sums
+        while len(partials)>1:
+            futures = [pool.submit(add_merged, partials[i], partials[i+1])
+                       for i in range(0, len(partials)-1, 2)]
+            rest = [partials[-1]] if len(partials)%2==1 else []
+            partials = [future.result() for future in futures] + rest
+    return partials[0]
+
+def merge_histograms(rfiles, outputfile, transforms=None, histtransforms=None,
+                     nworkers=1, verbose=False):
+    ### main function: merge histograms in a set of files into a single output file
+    # input arguments:
+    # - rfiles: list of input files
+    # - outputfile: output file (overwritten if it exists)
+    # - transforms: list of name transforms, applied per input file
+    # - histtransforms: list of functions taking a MergeHistogram as input,
+    #   applied on the merged histograms before writing
+    # - nworkers: number of processes to use (see sum_histograms)
+    # returns: the number of written histograms
+    if histtransforms is None: histtransforms = []
+    merged = sum_histograms(rfiles, transforms=transforms, nworkers=nworkers, verbose=verbose)
+    if len(merged)==0:
+        print('WARNING in merge_histograms: list of merged histograms is empty!')
+    for histtransform in histtransforms:
+        for hist in merged.values(): histtransform(hist)
+    write_histograms(outputfile, merged)
+    return len(merged)
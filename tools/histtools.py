@@ -152,6 +152,125 @@ def findhistogram(histlist, name):
     return None
 
 
+### histogram filling ###
+
+def findbins(values, nbins, xmin, xmax, edges=None):
+    ### find the bin index of each value, following the conventions of TAxis::FindBin
+    # input arguments:
+    # - values: numpy array of values
+    # - nbins, xmin, xmax: axis properties
+    # - edges: array of bin edges (for variable bin width, else None)
+    # returns: numpy array of bin indices,
+    #          with 0 for underflow and nbins+1 for overflow (including nan)
+    values = np.asarray(values, dtype=np.float64)
+    if edges is None:
+        inrange = ((values >= xmin) & (values < xmax))
+        bins = np.where(values < xmin, 0, nbins+1)
+        inrangevalues = values[inrange]
+        bins[inrange] = 1 + (nbins*(inrangevalues-xmin)/(xmax-xmin)).astype(np.int64)
+    else:
+        # note: nan values are sorted at the end, i.e. in the overflow bin
+        bins = np.searchsorted(np.asarray(edges, dtype=np.float64), values, side='right')
+    return bins
+
+def sumbins(bins, weights, nbins):
+    ### sum weights and squared weights per bin
+    # input arguments:
+    # - bins: numpy array of bin indices (e.g. from findbins)
+    # - weights: numpy array of weights, or 2D array of shape (number of values, number of weight sets)
+    # - nbins: number of bins (excluding under- and overflow)
+    # returns: a tuple of numpy arrays (sumw, sumw2) of length nbins+2
+    #          (or shape (nbins+2, number of weight sets) for 2D weights)
+    # note: np.bincount adds the weights sequentially in the order of the values,
+    #       which gives bit-identical results to successive calls to TH1::Fill.
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim==1:
+        sumw = np.bincount(bins, weights=weights, minlength=nbins+2)
+        sumw2 = np.bincount(bins, weights=weights*weights, minlength=nbins+2)
+        return (sumw, sumw2)
+    # for 2D weights, offset the bin indices for each weight set
+    # and do a single bincount over all weight sets
+    # (the weights for each set are still added sequentially in the order of the values)
+    nsets = weights.shape[1]
+    offsets = np.arange(nsets)*(nbins+2)
+    setbins = (bins[np.newaxis,:] + offsets[:,np.newaxis]).ravel()
+    setweights = weights.T.ravel()
+    sumw = np.bincount(setbins, weights=setweights, minlength=nsets*(nbins+2))
+    sumw2 = np.bincount(setbins, weights=setweights*setweights, minlength=nsets*(nbins+2))
+    return (sumw.reshape(nsets, nbins+2).T, sumw2.reshape(nsets, nbins+2).T)
+
+def sumstats(bins, values, weights, nbins):
+    ### calculate the histogram statistics (as in TH1::GetStats) for given bins, values and weights
+    # returns: numpy array with [sumw, sumw2, sumwx, sumwx2]
+    # note: under- and overflow values are not taken into account (as in TH1::Fill)
+    # note: np.cumsum adds sequentially (unlike np.sum),
+    #       which gives bit-identical results to successive calls to TH1::Fill.
+    inrange = ((bins > 0) & (bins < nbins+1))
+    values = np.asarray(values, dtype=np.float64)[inrange]
+    weights = np.asarray(weights, dtype=np.float64)[inrange]
+    if len(weights)==0: return np.zeros(4)
+    wx = weights*values
+    terms = [weights, weights*weights, wx, wx*values]
+    return np.array([np.cumsum(term)[-1] for term in terms])
+
+def getaxisbins(hist):
+    ### get the axis properties of a histogram in the format needed for findbins
+    # returns: a tuple (nbins, xmin, xmax, edges), where edges is None for fixed bin width
+    axis = hist.GetXaxis()
+    nbins = axis.GetNbins()
+    edges = None
+    if axis.IsVariableBinSize():
+        edges = np.array([axis.GetBinLowEdge(i) for i in range(1, nbins+2)])
+    return (nbins, axis.GetXmin(), axis.GetXmax(), edges)
+
+def sethistogram(hist, sumw, sumw2, stats, nentries):
+    ### set bin contents, squared errors and statistics of a histogram
+    # input arguments:
+    # - hist: a ROOT TH1 with Sumw2 enabled
+    # - sumw, sumw2: numpy arrays of length nbins+2 (including under- and overflow)
+    # - stats: numpy array with [sumw, sumw2, sumwx, sumwx2] (see sumstats)
+    # - nentries: number of entries
+    # note: the order matters, since SetBinContent resets the statistics.
+    for i in range(len(sumw)): hist.SetBinContent(i, sumw[i])
+    histsumw2 = hist.GetSumw2()
+    for i in range(len(sumw2)): histsumw2.SetAt(sumw2[i], i)
+    hist.PutStats(array('d', stats))
+    hist.SetEntries(nentries)
+
+def fillhistogram(hist, values, weights):
+    ### fill a histogram with arrays of values and weights in one go
+    # input arguments:
+    # - hist: a ROOT TH1 (empty, with Sumw2 enabled)
+    # - values: numpy array of values
+    # - weights: numpy array of weights
+    # note: the result is bit-identical to calling hist.Fill(value, weight)
+    #       for each value and weight in sequence, but much faster.
+    (nbins, xmin, xmax, edges) = getaxisbins(hist)
+    bins = findbins(values, nbins, xmin, xmax, edges=edges)
+    (sumw, sumw2) = sumbins(bins, weights, nbins)
+    stats = sumstats(bins, values, weights, nbins)
+    sethistogram(hist, sumw, sumw2, stats, len(values))
+
+def fillhistograms(hists, values, weights):
+    ### fill several histograms with the same values but different weights in one go
+    # input arguments:
+    # - hists: list of ROOT TH1 (empty, with Sumw2 enabled, all with the same binning)
+    # - values: numpy array of values
+    # - weights: 2D numpy array of shape (number of values, number of histograms)
+    # note: the bin indices are calculated only once for all histograms.
+    # note: the result for each histogram is bit-identical to fillhistogram.
+    if weights.shape[1]!=len(hists):
+        msg = 'ERROR: got {} histograms but {} weight sets.'.format(len(hists), weights.shape[1])
+        raise Exception(msg)
+    if len(hists)==0: return
+    (nbins, xmin, xmax, edges) = getaxisbins(hists[0])
+    bins = findbins(values, nbins, xmin, xmax, edges=edges)
+    (sumw, sumw2) = sumbins(bins, weights, nbins)
+    for i, hist in enumerate(hists):
+        stats = sumstats(bins, values, weights[:,i], nbins)
+        sethistogram(hist, sumw[:,i], sumw2[:,i], stats, len(values))
+
+
 ### histogram clipping ###
 
 def cliphistogram(hist,clipboundary=0):
@@ -0,0 +1,157 @@
+##########################################################
+# Content-addressed cache for output files of a program #
+##########################################################
+# The cache is a directory holding output files keyed by a hash
+# of everything that determines their content
+# (e.g. the input file, the configuration and the code version).
+# When an output file with the same key is requested again,
+# it is hard-linked (or copied if hard links are not possible) from the cache
+# instead of being remade.
+# The cache can be limited in size, in which case the least recently used
+# entries are removed when adding new ones.
+# Note: the modification time of the cache entries is used to keep track of
+#       when they were last used (access times are not reliable on many file systems).
+
+import os
+import json
+import shutil
+import hashlib
+
+
+def file_checksum(path):
+    ### get the sha256 checksum of the content of a file
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''): sha.update(block)
+    return sha.hexdigest()
+
+def file_signature(path, checksum=False):
+    ### get a signature of a file
+    # input arguments:
+    # - path: path to the file
+    # - checksum: if True, use the checksum of the file content;
+    #   else use the path, size and modification time (much faster for large files).
+    if path is None: return None
+    if checksum: return file_checksum(path)
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+def code_version(directories):
+    ### get a hash of all files in a set of directories
+    # (python caches and hidden files are skipped)
+    sha = hashlib.sha256()
+    for directory in sorted(directories):
+        if os.path.isfile(directory):
+            sha.update(directory.encode('utf-8'))
+            sha.update(file_checksum(directory).encode('utf-8'))
+            continue
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted([d for d in dirs if d!='__pycache__' and not d.startswith('.')])
+            for f in sorted(files):
+                if( f.endswith('.pyc') or f.startswith('.') ): continue
+                path = os.path.join(root, f)
+                sha.update(os.path.relpath(path, directory).encode('utf-8'))
+                sha.update(file_checksum(path).encode('utf-8'))
+    return sha.hexdigest()
+
+def make_cache_key(config):
+    ### make a cache key from a configuration dict
+    # (the dict must be serializable to json)
+    content = json.dumps(config, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class OutputCache(object):
+    ### a directory holding cached output files
+
+    def __init__(self, cachedir, maxsize=None):
+        ### initializer
+        # input arguments:
+        # - cachedir: path to the cache directory (created if it does not exist)
+        # - maxsize: maximum total size of the cache in GB (default: no limit)
+        self.cachedir = os.path.abspath(cachedir)
+        self.maxsize = maxsize
+        if not os.path.exists(self.cachedir): os.makedirs(self.cachedir, exist_ok=True)
+
+    def path(self, key):
+        ### get the path of a cache entry
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def fetch(self, key, outputfile):
+        ### get an output file from the cache
+        # returns: True if the file was found in the cache, False otherwise
+        path = self.path(key)
+        if not os.path.exists(path): return False
+        outputdir = os.path.dirname(os.path.abspath(outputfile))
+        if not os.path.exists(outputdir): os.makedirs(outputdir, exist_ok=True)
+        if os.path.exists(outputfile): os.remove(outputfile)
+        try:
+            link_or_copy(path, outputfile)
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # entry was evicted in the meantime
+            return False
+        return True
+
+    def store(self, key, outputfile, metadata=None):
+        ### add an output file to the cache
+        # input arguments:
+        # - key: cache key
+        # - outputfile: the file to store
+        # - metadata: dict with information on the configuration
+        #   (written to a json file next to the cache entry, for information only)
+        path = self.path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # first link to a temporary name, then move,
+        # so that other processes never see incomplete entries
+        tmppath = '{}.tmp{}'.format(path, os.getpid())
+        link_or_copy(outputfile, tmppath)
+        os.replace(tmppath, path)
+        os.utime(path)
+        if metadata is not None:
+            with open(path+'.json', 'w') as f: json.dump(metadata, f, indent=2, sort_keys=True)
+        self.evict()
+
+    def entries(self):
+        ### get all cache entries as a list of (path, size, last use time)
+        entries = []
+        for root, _, files in os.walk(self.cachedir):
+            for f in files:
+                if( f.endswith('.json') or '.tmp' in f ): continue
+                path = os.path.join(root, f)
+                try: stat = os.stat(path)
+                except FileNotFoundError: continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def size(self):
+        ### get the total size of the cache in GB
+        return sum([entry[1] for entry in self.entries()]) / 1024.**3
+
+    def evict(self):
+        ### remove the least recently used entries until the cache is within its maximum size
+        # returns: the number of removed entries
+        if self.maxsize is None: return 0
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        maxbytes = self.maxsize * 1024.**3
+        total = sum([entry[1] for entry in entries])
+        nremoved = 0
+        for path, size, _ in entries:
+            if total <= maxbytes: break
+            for f in [path, path+'.json']:
+                try: os.remove(f)
+                except FileNotFoundError: pass
+            total -= size
+            nremoved += 1
+        return nremoved
+
+
+def link_or_copy(source, target):
+    ### make a hard link if possible, else copy the file
+    try: os.link(source, target)
+    except OSError: shutil.copy2(source, target)
@@ -0,0 +1,280 @@
+#####################################################################
+# Tools for running a chain of tasks with incremental re-execution #
+#####################################################################
+# A pipeline is a directed acyclic graph of tasks.
+# Each task has a command (a shell command or a python callable),
+# a list of input and output files, and a set of configuration files and values.
+# Dependencies between tasks are found automatically by matching the inputs of a task
+# to the outputs of other tasks, and can also be given explicitly.
+# Each task has a signature, which is a hash of:
+#   - the command,
+#   - the configuration values,
+#   - the content of the configuration files (e.g. variable json file, sample list),
+#   - the signatures of all upstream tasks.
+# The signature of each successful task is stored in a state file.
+# When running the pipeline again, a task is only re-executed if its signature changed
+# (i.e. something changed in its configuration or upstream of it),
+# if one of its outputs is missing, or if it is explicitly forced.
+# Note: the (potentially large) input data files themselves are not hashed;
+#       changes to them are tracked through the signatures of the tasks producing them.
+# Note: changes to the code of the executables are not tracked;
+#       use the force option to re-run the affected tasks in that case.
+# Independent tasks are executed in parallel with a pool of workers.
+
+import sys
+import os
+import json
+import hashlib
+import threading
+import traceback
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def file_hash(path):
+    ### get the sha256 hash of the content of a file
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''): sha.update(block)
+    return sha.hexdigest()
+
+
+class Task(object):
+    ### a single task in a pipeline
+
+    def __init__(self, name, command,
+                 inputs=None, outputs=None, deps=None,
+                 configfiles=None, configvalues=None):
+        ### initializer
+        # input arguments:
+        # - name: unique name of the task (e.g. '<stage>/<sample>')
+        # - command: shell command (string) or python callable without arguments
+        #   (a callable is considered successful if it does not raise an exception)
+        # - inputs: list of input files or directories
+        # - outputs: list of output files or directories
+        # - deps: list of names of tasks that must run before this one
+        #   (in addition to the ones found by matching inputs and outputs)
+        # - configfiles: list of files of which the content determines the task output
+        # - configvalues: dict of other settings that determine the task output
+        #   (must be serializable to json)
+        self.name = name
+        self.command = command
+        self.inputs = [os.path.abspath(f) for f in inputs] if inputs is not None else []
+        self.outputs = [os.path.abspath(f) for f in outputs] if outputs is not None else []
+        self.deps = list(deps) if deps is not None else []
+        self.configfiles = ([os.path.abspath(f) for f in configfiles]
+                            if configfiles is not None else [])
+        self.configvalues = configvalues if configvalues is not None else {}
+
+    def command_string(self):
+        ### get a string representation of the command
+        # (for python callables, only the name of the function is used,
+        #  other settings should be passed as configuration values)
+        if isinstance(self.command, str): return self.command
+        func = getattr(self.command, 'func', self.command)
+        return 'python callable {}'.format(getattr(func, '__name__', type(func).__name__))
+
+    def missing_outputs(self):
+        return [f for f in self.outputs if not os.path.exists(f)]
+
+
+class Pipeline(object):
+    ### a collection of tasks with dependencies
+
+    def __init__(self, statefile):
+        ### initializer
+        # input arguments:
+        # - statefile: json file in which the signatures of successful tasks are stored
+        self.statefile = os.path.abspath(statefile)
+        self.tasks = {}
+        self.order = None
+        self.hashes = {}
+        self.state = {}
+        if os.path.exists(self.statefile):
+            with open(self.statefile, 'r') as f: self.state = json.load(f)
+        self.lock = threading.Lock()
+
+    def add_task(self, task):
+        if task.name in self.tasks:
+            raise Exception('ERROR: task {} was already added to the pipeline.'.format(task.name))
+        self.tasks[task.name] = task
+        self.order = None
+
+    def resolve(self):
+        ### find dependencies and sort the tasks topologically
+        producers = {}
+        for task in self.tasks.values():
+            for output in task.outputs:
+                if output in producers:
+                    msg = 'ERROR: output {} is produced by both {} and {}.'.format(
+                      output, producers[output], task.name)
+                    raise Exception(msg)
+                producers[output] = task.name
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    msg = 'ERROR: task {} depends on unknown task {}.'.format(task.name, dep)
+                    raise Exception(msg)
+            for inputfile in task.inputs:
+                if( inputfile in producers and producers[inputfile] not in task.deps ):
+                    task.deps.append(producers[inputfile])
+        # topological sort (depth-first, keeping the order in which tasks were added)
+        order = []
+        status = {}
+        def visit(name, path):
+            if status.get(name)=='done': return
+            if status.get(name)=='busy':
+                msg = 'ERROR: cyclic dependency: {}'.format(' -> '.join(path+[name]))
+                raise Exception(msg)
+            status[name] = 'busy'
+            for dep in self.tasks[name].deps: visit(dep, path+[name])
+            status[name] = 'done'
+            order.append(name)
+        for name in self.tasks.keys(): visit(name, [])
+        self.order = order
+
+    def config_hash(self, path):
+        ### get the hash of a configuration file (computed only once per file)
+        if path not in self.hashes:
+            if not os.path.exists(path):
+                raise Exception('ERROR: configuration file {} does not exist.'.format(path))
+            self.hashes[path] = file_hash(path)
+        return self.hashes[path]
+
+    def signatures(self):
+        ### compute the signature of all tasks
+        if self.order is None: self.resolve()
+        signatures = {}
+        for name in self.order:
+            task = self.tasks[name]
+            content = ({
+              'command': task.command_string(),
+              'configvalues': task.configvalues,
+              'configfiles': {f: self.config_hash(f) for f in task.configfiles},
+              'deps': {dep: signatures[dep] for dep in sorted(task.deps)}
+            })
+            content = json.dumps(content, sort_keys=True)
+            signatures[name] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return signatures
+
+    def plan(self, force=None):
+        ### determine which tasks need to be (re-)executed
+        # input arguments:
+        # - force: list of task names or name prefixes (e.g. a stage name) to re-run anyway
+        # returns: a dict matching task names to the reason for re-running them
+        #          (tasks that are up to date are not included)
+        if force is None: force = []
+        signatures = self.signatures()
+        stale = {}
+        for name in self.order:
+            task = self.tasks[name]
+            if any([name.startswith(f) for f in force]): stale[name] = 'forced'
+            elif name not in self.state: stale[name] = 'never run'
+            elif self.state[name]!=signatures[name]: stale[name] = 'configuration changed'
+            elif len(task.missing_outputs())>0: stale[name] = 'missing output'
+            else:
+                staledeps = [dep for dep in task.deps if dep in stale]
+                # note: upstream tasks with a changed signature change this signature too,
+                #       so only the case where the upstream output will be remade remains
+                if len(staledeps)>0: stale[name] = 'upstream task re-run'
+        return stale
+
+    def print_plan(self, stale):
+        ### print the execution plan
+        print('Pipeline plan ({} of {} tasks to run):'.format(len(stale), len(self.tasks)))
+        for name in self.order:
+            if name in stale: print('  - [run]  {} ({})'.format(name, stale[name]))
+            else: print('  - [skip] {} (up to date)'.format(name))
+        sys.stdout.flush()
+
+    def save_state(self):
+        ### write the state file (atomically, to avoid corruption when interrupted)
+        tmpfile = self.statefile + '.tmp'
+        with open(tmpfile, 'w') as f: json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmpfile, self.statefile)
+
+    def run(self, executor=None, nworkers=1, force=None, dryrun=False, logdir=None):
+        ### run all stale tasks
+        # input arguments:
+        # - executor: function taking a task and a log file name and returning an exit code
+        #   (default: run_task_locally)
+        # - nworkers: maximum number of tasks to run simultaneously
+        # - force: see plan
+        # - dryrun: only print the plan, do not run anything
+        # - logdir: directory for the log files of the tasks
+        #   (default: next to the state file)
+        # returns: a dict matching task names to their final status
+        #          ('up to date', 'done', 'failed' or 'skipped')
+        if executor is None: executor = run_task_locally
+        if logdir is None: logdir = os.path.splitext(self.statefile)[0]+'_logs'
+        signatures = self.signatures()
+        stale = self.plan(force=force)
+        self.print_plan(stale)
+        status = {name: 'up to date' for name in self.order if name not in stale}
+        if( dryrun or len(stale)==0 ): return status
+        if not os.path.exists(logdir): os.makedirs(logdir)
+        # remove the state of tasks to re-run,
+        # so they are not considered up to date when interrupted
+        with self.lock:
+            for name in stale.keys(): self.state.pop(name, None)
+            self.save_state()
+        pending = [name for name in self.order if name in stale]
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, nworkers)) as pool:
+            while( len(pending)>0 or len(running)>0 ):
+                # submit all tasks of which the dependencies are done
+                for name in list(pending):
+                    depstatus = [status.get(dep) for dep in self.tasks[name].deps]
+                    if any([s in ['failed', 'skipped'] for s in depstatus]):
+                        status[name] = 'skipped'
+                        pending.remove(name)
+                        print('Skipping task {} (upstream task failed)'.format(name))
+                    elif all([s in ['up to date', 'done'] for s in depstatus]):
+                        if len(running)>=max(1, nworkers): continue
+                        logfile = os.path.join(logdir, name.replace('/','_')+'.log')
+                        print('Starting task {}'.format(name))
+                        running[pool.submit(executor, self.tasks[name], logfile)] = name
+                        pending.remove(name)
+                sys.stdout.flush()
+                if len(running)==0: continue
+                # wait for at least one task to finish
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try: returncode = future.result()
+                    except Exception:
+                        traceback.print_exc()
+                        returncode = 1
+                    missing = self.tasks[name].missing_outputs()
+                    if( returncode==0 and len(missing)==0 ):
+                        status[name] = 'done'
+                        with self.lock:
+                            self.state[name] = signatures[name]
+                            self.save_state()
+                        print('Task {} finished successfully'.format(name))
+                    else:
+                        status[name] = 'failed'
+                        msg = 'Task {} failed (exit code {}'.format(name, returncode)
+                        if len(missing)>0: msg += ', missing outputs: {}'.format(missing)
+                        print(msg+')')
+                sys.stdout.flush()
+        # print summary
+        counts = {}
+        for s in status.values(): counts[s] = counts.get(s, 0) + 1
+        print('Pipeline finished: {}'.format(
+          ', '.join(['{} {}'.format(n, s) for s, n in sorted(counts.items())])))
+        return status
+
+
+def run_task_locally(task, logfile):
+    ### run a task on the local machine
+    # the output of the task is written to the log file
+    with open(logfile, 'w') as log:
+        if isinstance(task.command, str):
+            return subprocess.run(['bash', '-c', task.command],
+                     stdout=log, stderr=subprocess.STDOUT).returncode
+        try: task.command()
+        except Exception:
+            log.write(traceback.format_exc())
+            return 1
+    return 0